@@ -1,13 +1,55 @@
-from flask import Flask, render_template, g, session
+from flask import Flask, jsonify, render_template
 import os
 from .db import get_db
+from . import condicional
+from .paginacao import paginar, pedido_json, resposta_json
 
 def create_app(test_config=None):
     # Vamos criar a configuracao do app
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY="a-longer-secret-key-for-dev",
-        DATABASE=os.path.join(app.instance_path, "app.sqlite")
+        DATABASE=os.path.join(app.instance_path, "app.sqlite"),
+        # Pool de conexões por worker e PRAGMAs aplicados a cada conexão
+        DB_POOL_SIZE=8,
+        DB_JOURNAL_MODE="WAL",
+        DB_BUSY_TIMEOUT=5000,
+        DB_SYNCHRONOUS="NORMAL",
+        # Valor negativo = KiB (64 MiB de cache de páginas por conexão)
+        DB_CACHE_SIZE=-65536,
+        DB_MMAP_SIZE=268435456,
+        # Instruções preparadas guardadas por conexão (o padrão do sqlite3 é 128)
+        DB_CACHED_STATEMENTS=256,
+        # Pedidos GET/HEAD usam um pool à parte de conexões só de leitura;
+        # VERIFICAR regista e bloqueia qualquer escrita feita por eles
+        DB_LEITURA_SEPARADA=True,
+        DB_LEITURA_VERIFICAR=False,
+        # Escritas entregues a uma thread por worker que junta vários pedidos
+        # num só commit (lote máximo e espera opcional por mais pedidos)
+        DB_ESCRITOR=False,
+        DB_ESCRITOR_LOTE=64,
+        DB_ESCRITOR_JANELA_MS=0,
+        # Cache dos registos de Usuarios carregados em cada pedido. É por
+        # worker: invalidate_user só limpa a do worker que fez a alteração,
+        # e os outros podem usar o registo antigo (aprovação, estado,
+        # papel) até USER_CACHE_TTL segundos depois. USER_CACHE_TTL=0
+        # desliga a cache quando isso não é aceitável.
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        # Paginação por cursor das listagens
+        PAGINA_TAMANHO=50,
+        PAGINA_TAMANHO_MAX=500,
+        # Hash de passwords num pool de processos (0 = no próprio worker)
+        PASSWORD_HASH_METHOD="scrypt:32768:8:1",
+        PASSWORD_HASH_WORKERS=min(4, os.cpu_count() or 1),
+        # Instrumentação SQL por pedido (desligada por omissão)
+        SQL_PROFILE=False,
+        SQL_PROFILE_LOG=os.path.join(app.instance_path, "sql-profile.jsonl"),
+        SQL_SLOW_MS=50,
+        SQL_EXPLAIN_MAX=5,
+        # HTML das páginas públicas partilhado entre visitantes anónimos (0 = desligado)
+        CACHE_PAGINAS_ANONIMAS=256,
+        CACHE_PAGINAS_ANONIMAS_TTL=300
     )
 
     if test_config is None:
@@ -23,26 +65,53 @@ def create_app(test_config=None):
     except OSError:
         pass
 
-    @app.before_request
-    def load_logged_in_user():
-        user_id = session.get('user_id')
-
-        if user_id is None:
-            g.user = None
-        else:
-            g.user = get_db().execute(
-                'SELECT * FROM Usuarios WHERE id = ?', (user_id,)
-            ).fetchone()
-
     @app.route("/")
     def index():
         db = get_db()
-        anuncios = db.execute('SELECT titulo, conteudo, data_publicacao FROM Anuncios ORDER BY data_publicacao DESC LIMIT 5').fetchall()
-        return render_template('index.html', anuncios=anuncios)
+        resposta = condicional.nao_modificado(*condicional.versao_anuncios(db))
+        if resposta is not None:
+            return resposta
+
+        def gerar():
+            anuncios = db.execute('SELECT titulo, conteudo, data_publicacao FROM Anuncios ORDER BY data_publicacao DESC LIMIT 5').fetchall()
+            return render_template('index.html', anuncios=anuncios)
+        return condicional.pagina_anonima(gerar)
     
     from . import db
     db.init_app(app)
 
+    condicional.init_app(app)
+
+    from . import migrar
+    migrar.init_app(app)
+
+    from . import perfil
+    perfil.init_app(app)
+
+    from . import sintetico
+    sintetico.init_app(app)
+
+    from . import desempenho
+    desempenho.init_app(app)
+
+    from . import carga
+    carga.init_app(app)
+
+    from . import planos
+    planos.init_app(app)
+
+    from . import importacao
+    importacao.init_app(app)
+
+    from . import boletim
+    boletim.init_app(app)
+
+    from . import avaliacoes
+    avaliacoes.init_app(app)
+
+    from . import presencas
+    presencas.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.bp)
 
@@ -58,7 +127,23 @@ def create_app(test_config=None):
     @app.route('/anuncios')
     def anuncios():
         db = get_db()
-        anuncios = db.execute('SELECT titulo, conteudo, data_publicacao FROM Anuncios ORDER BY data_publicacao DESC').fetchall()
-        return render_template('anuncios.html', anuncios=anuncios)
+        resposta = condicional.nao_modificado(*condicional.versao_anuncios(db))
+        if resposta is not None:
+            return resposta
+
+        def pagina():
+            return paginar(
+                db, 'SELECT id, titulo, conteudo, data_publicacao FROM Anuncios', [], [],
+                [('data_publicacao', 'data_publicacao'), ('id', 'id')],
+                descendente=True
+            )
+
+        if pedido_json():
+            return jsonify(resposta_json(*pagina()))
+
+        def gerar():
+            anuncios, proximo = pagina()
+            return render_template('anuncios.html', anuncios=anuncios, filtros={}, proximo=proximo)
+        return condicional.pagina_anonima(gerar)
     
     return app
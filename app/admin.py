@@ -1,9 +1,30 @@
-from flask import Blueprint, render_template, g, request, flash, redirect, url_for, session
-from app.auth import login_required
-from app.db import get_db
+import heapq
+import json
+import os
+import sqlite3
+from itertools import groupby
+
+from flask import (
+    Blueprint, Response, render_template, stream_template, stream_with_context, g, request, flash,
+    get_flashed_messages, redirect, url_for, session, jsonify)
+from app.auth import invalidate_user, login_required
+from app.db import get_db, incrementar_contador, ler_contador
+from app.escritor import transaccao
+from app.notas import (
+    MatrizNotas, flash_resultado, gravar_notas, ler_celulas, ler_celulas_json, sincronizar_notas)
+from app.paginacao import ler_filtros, paginar, paginar_lista, pedido_json, resposta_json
+from app import boletim, condicional, importacao, presencas, referencia, repositorio, senhas
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+
+def _stream_template(template_name, **context):
+    # A sessão é gravada antes do corpo: retirar já as mensagens flash,
+    # senão voltariam a aparecer na página seguinte
+    get_flashed_messages()
+    return stream_template(template_name, **context)
+
+
 @bp.route('/criar_curso', methods=['GET', 'POST'])
 @login_required
 def criar_curso():
@@ -27,6 +48,7 @@ def criar_curso():
             return redirect(url_for('admin.criar_curso'))
         
         db.execute('INSERT INTO Cursos (nome, descricao, carga_horaria) VALUES (?, ?, ?)', (nome, descricao, carga_horaria))
+        referencia.invalidar(db)
         db.commit()
         flash('Curso criado com sucesso.')
         return redirect(url_for('admin.criar_curso'))
@@ -41,7 +63,7 @@ def criar_disciplina():
         return redirect(url_for('index'))
     
     db = get_db()
-    cursos = db.execute('SELECT id, nome FROM Cursos').fetchall()
+    cursos = referencia.dados().cursos
     
     if request.method == 'POST':
         curso_id = request.form.get('curso_id')
@@ -75,6 +97,7 @@ def criar_disciplina():
             'INSERT INTO Disciplinas (curso_id, ano, nome, descricao) VALUES (?, ?, ?, ?)',
             (curso_id, ano_int, nome, descricao)
         )
+        referencia.invalidar(db)
         db.commit()
         flash('Disciplina criada com sucesso.')
         return redirect(url_for('admin.criar_disciplina'))
@@ -89,8 +112,9 @@ def criar_turma():
         return redirect(url_for('index'))
     
     db = get_db()
-    cursos = db.execute('SELECT id, nome FROM Cursos').fetchall()
-    anos_lectivos = db.execute('SELECT id, ano FROM AnoLectivo').fetchall()
+    dados = referencia.dados()
+    cursos = dados.cursos
+    anos_lectivos = dados.anos_lectivos
     
     if request.method == 'POST':
         curso_id = request.form.get('curso_id')
@@ -139,6 +163,7 @@ def criar_turma():
                     [(turma_id, d['id']) for d in disciplinas]
                 )
 
+        incrementar_contador(db, 'turmas')
         db.commit()
         flash('Turma criada com sucesso.')
         return redirect(url_for('admin.criar_turma'))
@@ -152,10 +177,60 @@ def matricular():
         flash('Acesso negado.')
         return redirect(url_for('index'))
     
+    filtros = ler_filtros('curso', 'ano_lectivo', 'classe')
+    status = request.args.get('status')
+    if status in ('ativo', 'pendente'):
+        filtros['status'] = status
+
+    condicoes_alunos, parametros_alunos = [], []
+    condicoes_turmas, parametros_turmas = [], []
+    if 'curso' in filtros:
+        condicoes_alunos.append('a.curso_preferido_id = ?')
+        parametros_alunos.append(filtros['curso'])
+        condicoes_turmas.append('t.curso_id = ?')
+        parametros_turmas.append(filtros['curso'])
+    if 'classe' in filtros:
+        condicoes_alunos.append('a.ano_preferido = ?')
+        parametros_alunos.append(filtros['classe'])
+        condicoes_turmas.append('t.ano = ?')
+        parametros_turmas.append(filtros['classe'])
+    if 'ano_lectivo' in filtros:
+        condicoes_alunos.append('''EXISTS (
+            SELECT 1 FROM Matriculas m JOIN Turmas t ON t.id = m.turma_id
+            WHERE m.aluno_id = a.id AND t.ano_lectivo_id = ?)''')
+        parametros_alunos.append(filtros['ano_lectivo'])
+        condicoes_turmas.append('t.ano_lectivo_id = ?')
+        parametros_turmas.append(filtros['ano_lectivo'])
+    if 'status' in filtros:
+        condicoes_alunos.append('EXISTS (SELECT 1 FROM Usuarios u WHERE u.aluno_id = a.id AND u.status = ?)')
+        parametros_alunos.append(filtros['status'])
+
     db = get_db()
-    alunos = db.execute('SELECT id, nome FROM Alunos').fetchall()
-    turmas = db.execute('SELECT id, designacao FROM Turmas').fetchall()
-    return render_template('admin/matricular.html', alunos=alunos, turmas=turmas)
+    alunos, proximo = paginar(
+        db, 'SELECT a.id, a.nome FROM Alunos a',
+        condicoes_alunos, parametros_alunos,
+        [('a.nome', 'nome'), ('a.id', 'id')]
+    )
+    if pedido_json():
+        return jsonify(resposta_json(alunos, proximo))
+
+    # As turmas continuam a ser consumidas à medida que a página é enviada
+    sql_turmas = 'SELECT t.id, t.designacao FROM Turmas t'
+    if condicoes_turmas:
+        sql_turmas += ' WHERE ' + ' AND '.join(condicoes_turmas)
+    turmas = db.execute(sql_turmas + ' ORDER BY t.designacao, t.id', parametros_turmas)
+    dados = referencia.dados()
+    cursos = dados.cursos_por_nome
+    anos_lectivos = dados.anos_lectivos
+    return _stream_template(
+        'admin/matricular.html',
+        alunos=alunos,
+        turmas=turmas,
+        cursos=cursos,
+        anos_lectivos=anos_lectivos,
+        filtros=filtros,
+        proximo=proximo
+    )
 
 @bp.route('/cursos')
 @login_required
@@ -164,9 +239,10 @@ def cursos():
         flash('Acesso negado.')
         return redirect(url_for('index'))
     
-    db = get_db()
-    cursos = db.execute('SELECT * FROM Cursos').fetchall()
-    return render_template('admin/cursos.html', cursos=cursos)
+    cursos, proximo = paginar_lista(referencia.dados().cursos_por_nome, ['nome', 'id'])
+    if pedido_json():
+        return jsonify(resposta_json(cursos, proximo))
+    return render_template('admin/cursos.html', cursos=cursos, filtros={}, proximo=proximo)
 
 
 @bp.route('/curso/<int:id>')
@@ -177,7 +253,7 @@ def curso_detalhes(id):
         return redirect(url_for('index'))
 
     db = get_db()
-    curso = db.execute('SELECT * FROM Cursos WHERE id = ?', (id,)).fetchone()
+    curso = referencia.dados().curso_por_id.get(id)
     if curso is None:
         flash('Curso não encontrado.')
         return redirect(url_for('admin.cursos'))
@@ -213,8 +289,14 @@ def deletar_curso(id):
         return redirect(url_for('index'))
     
     db = get_db()
-    db.execute('DELETE FROM Cursos WHERE id = ?', (id,))
-    db.commit()
+    try:
+        db.execute('DELETE FROM Cursos WHERE id = ?', (id,))
+        referencia.invalidar(db)
+        db.commit()
+    except sqlite3.IntegrityError:
+        db.rollback()
+        flash('Curso possui turmas associadas e não pode ser deletado.')
+        return redirect(url_for('admin.cursos'))
     flash('Curso deletado.')
     return redirect(url_for('admin.cursos'))
 
@@ -225,13 +307,24 @@ def disciplinas():
         flash('Acesso negado.')
         return redirect(url_for('index'))
     
-    db = get_db()
-    disciplinas = db.execute('''
-        SELECT d.*, c.nome as curso_nome 
-        FROM Disciplinas d 
-        JOIN Cursos c ON d.curso_id = c.id
-    ''').fetchall()
-    return render_template('admin/disciplinas.html', disciplinas=disciplinas)
+    filtros = ler_filtros('curso', 'classe')
+    dados = referencia.dados()
+    disciplinas = [
+        d for d in dados.disciplinas
+        if filtros.get('curso', d.curso_id) == d.curso_id and filtros.get('classe', d.ano) == d.ano
+    ]
+    disciplinas, proximo = paginar_lista(disciplinas, ['nome', 'id'])
+    if pedido_json():
+        return jsonify(resposta_json(disciplinas, proximo))
+
+    cursos = dados.cursos_por_nome
+    return _stream_template(
+        'admin/disciplinas.html',
+        disciplinas=disciplinas,
+        cursos=cursos,
+        filtros=filtros,
+        proximo=proximo
+    )
 
 @bp.route('/deletar_disciplina/<int:id>', methods=['POST'])
 @login_required
@@ -241,8 +334,14 @@ def deletar_disciplina(id):
         return redirect(url_for('index'))
     
     db = get_db()
-    db.execute('DELETE FROM Disciplinas WHERE id = ?', (id,))
-    db.commit()
+    try:
+        db.execute('DELETE FROM Disciplinas WHERE id = ?', (id,))
+        referencia.invalidar(db)
+        db.commit()
+    except sqlite3.IntegrityError:
+        db.rollback()
+        flash('Disciplina está atribuída a turmas e não pode ser deletada.')
+        return redirect(url_for('admin.disciplinas'))
     flash('Disciplina deletada.')
     return redirect(url_for('admin.disciplinas'))
 
@@ -259,32 +358,22 @@ def turmas():
         FROM Turmas t 
         JOIN Cursos c ON t.curso_id = c.id
         JOIN AnoLectivo a ON t.ano_lectivo_id = a.id
-        ORDER BY c.nome, t.ano, a.ano DESC, t.designacao
-    ''').fetchall()
-
-    turmas_por_curso = {}
-    for turma in turmas:
-        curso_id = turma['curso_id']
-        if curso_id not in turmas_por_curso:
-            turmas_por_curso[curso_id] = {
-                'curso_id': curso_id,
-                'curso_nome': turma['curso_nome'],
-                'classes': {}
-            }
-        turmas_por_curso[curso_id]['classes'].setdefault(turma['ano'], []).append(turma)
-
-    cursos_agrupados = []
-    for curso in sorted(turmas_por_curso.values(), key=lambda x: x['curso_nome']):
-        classes_ordenadas = []
-        for classe in sorted(curso['classes'].keys()):
-            classes_ordenadas.append({'ano': classe, 'turmas': curso['classes'][classe]})
-        cursos_agrupados.append({
-            'curso_id': curso['curso_id'],
-            'curso_nome': curso['curso_nome'],
-            'classes': classes_ordenadas
-        })
+        ORDER BY c.nome, t.curso_id, t.ano, a.ano DESC, t.designacao
+    ''')
+
+    # Agrupar por curso e classe sem materializar a lista: a consulta já
+    # vem ordenada, por isso cada grupo é consumido pelo template em ordem
+    def classes(turmas_curso):
+        for ano, turmas_classe in groupby(turmas_curso, key=lambda t: t['ano']):
+            yield {'ano': ano, 'turmas': turmas_classe}
+
+    cursos_agrupados = (
+        {'curso_id': curso_id, 'curso_nome': curso_nome, 'classes': classes(turmas_curso)}
+        for (curso_id, curso_nome), turmas_curso
+        in groupby(turmas, key=lambda t: (t['curso_id'], t['curso_nome']))
+    )
 
-    return render_template('admin/turmas.html', cursos=cursos_agrupados)
+    return _stream_template('admin/turmas.html', cursos=cursos_agrupados)
 
 @bp.route('/turma/<int:id>')
 @login_required
@@ -294,39 +383,16 @@ def turma_detalhes(id):
         return redirect(url_for('index'))
     
     db = get_db()
-    turma = db.execute('''
-        SELECT t.*, c.nome as curso_nome, c.descricao as curso_descricao, a.ano as ano_lectivo
-        FROM Turmas t 
-        JOIN Cursos c ON t.curso_id = c.id
-        JOIN AnoLectivo a ON t.ano_lectivo_id = a.id
-        WHERE t.id = ?
-    ''', (id,)).fetchone()
+    turma = repositorio.turma(db, id)
     
     if turma is None:
         flash('Turma não encontrada.')
         return redirect(url_for('admin.turmas'))
     
-    alunos = db.execute('''
-        SELECT a.id, a.nome, a.email, m.status
-        FROM Alunos a
-        JOIN Matriculas m ON a.id = m.aluno_id
-        WHERE m.turma_id = ? AND m.status = 'ativa'
-        ORDER BY a.nome
-    ''', (id,)).fetchall()
-    
-    disciplinas = db.execute('''
-        SELECT d.nome, d.descricao
-        FROM Disciplinas d
-        JOIN TurmaDisciplinas td ON d.id = td.disciplina_id
-        WHERE td.turma_id = ?
-        ORDER BY d.nome
-    ''', (id,)).fetchall()
-
-    total_curso_row = db.execute(
-        'SELECT COUNT(*) FROM Disciplinas WHERE curso_id = ? AND ano = ?',
-        (turma['curso_id'], turma['ano'])
-    ).fetchone()
-    total_curso = total_curso_row[0] if total_curso_row is not None else 0
+    alunos = repositorio.matriculas_activas(db, id)
+    disciplinas = repositorio.disciplinas_turma(db, id)
+
+    total_curso = len(referencia.dados().disciplinas_curso(turma['curso_id'], turma['ano']))
 
     total_atribuidas_row = db.execute(
         'SELECT COUNT(*) FROM TurmaDisciplinas WHERE turma_id = ?',
@@ -367,64 +433,54 @@ def notas_turma(id):
     if trimestre_int not in (1, 2, 3):
         trimestre_int = 1
 
-    session['admin_notas_trimestre'] = trimestre_int
+    # Só gravar se mudou, para o cookie de sessão não variar em cada resposta
+    if session.get('admin_notas_trimestre') != trimestre_int:
+        session['admin_notas_trimestre'] = trimestre_int
 
     db = get_db()
-    turma = db.execute('''
-        SELECT t.*, c.nome as curso_nome, c.descricao as curso_descricao, a.ano as ano_lectivo
-        FROM Turmas t
-        JOIN Cursos c ON t.curso_id = c.id
-        JOIN AnoLectivo a ON t.ano_lectivo_id = a.id
-        WHERE t.id = ?
-    ''', (id,)).fetchone()
+    turma = repositorio.turma(db, id)
 
     if turma is None:
         flash('Turma não encontrada.')
         return redirect(url_for('admin.turmas'))
 
-    matriculas = db.execute('''
-        SELECT m.id as matricula_id, a.id as aluno_id, a.nome
-        FROM Matriculas m
-        JOIN Alunos a ON a.id = m.aluno_id
-        WHERE m.turma_id = ? AND m.status = 'ativa'
-        ORDER BY a.nome
-    ''', (id,)).fetchall()
-
-    turma_disciplinas = db.execute('''
-        SELECT td.id as turma_disciplina_id, d.nome as disciplina_nome
-        FROM TurmaDisciplinas td
-        JOIN Disciplinas d ON d.id = td.disciplina_id
-        WHERE td.turma_id = ?
-        ORDER BY d.nome
-    ''', (id,)).fetchall()
-
-    notas_rows = db.execute('''
-        SELECT nt.matricula_id, nt.turma_disciplina_id, nt.trimestre, nt.nota
-        FROM NotasTrimestrais nt
-        JOIN Matriculas m ON m.id = nt.matricula_id
-        JOIN TurmaDisciplinas td ON td.id = nt.turma_disciplina_id
-        WHERE m.turma_id = ? AND td.turma_id = ? AND nt.trimestre = ?
-    ''', (id, id, trimestre_int)).fetchall()
-
-    notas = {}
-    for row in notas_rows:
-        notas[(row['matricula_id'], row['turma_disciplina_id'])] = row['nota']
-
-    total_esperado = len(matriculas) * len(turma_disciplinas)
-    total_preenchido = len(notas)
+    resposta = condicional.nao_modificado(condicional.versao_notas_turma(db, id, trimestre_int))
+    if resposta is not None:
+        return resposta
 
-    return render_template(
+    matriz = MatrizNotas.carregar(db, id, trimestre_int)
+
+    return _stream_template(
         'admin/notas_turma.html',
         turma=turma,
         trimestre=trimestre_int,
-        matriculas=matriculas,
-        turma_disciplinas=turma_disciplinas,
-        notas=notas,
-        total_esperado=total_esperado,
-        total_preenchido=total_preenchido
+        matriz=matriz,
+        total_esperado=matriz.total,
+        total_preenchido=matriz.preenchidas
     )
 
 
+@bp.route('/turma/<int:id>/notas/<int:trimestre>/grelha')
+@login_required
+def grelha_notas_turma(id, trimestre):
+    if g.user['papel'] != 'admin':
+        return jsonify({'erro': 'Acesso negado.'}), 403
+
+    if trimestre not in (1, 2, 3):
+        return jsonify({'erro': 'Trimestre inválido.'}), 400
+
+    db = get_db()
+    turma = db.execute('SELECT id FROM Turmas WHERE id = ?', (id,)).fetchone()
+    if turma is None:
+        return jsonify({'erro': 'Turma não encontrada.'}), 404
+
+    # A versão permite continuar com /sync a partir desta grelha
+    versao = ler_contador(db, 'notas')
+    grelha = MatrizNotas.carregar(db, id, trimestre).to_json()
+    grelha['versao'] = versao
+    return jsonify(grelha)
+
+
 @bp.route('/turma/<int:id>/notas/salvar', methods=['POST'])
 @login_required
 def salvar_notas_turma(id):
@@ -449,79 +505,91 @@ def salvar_notas_turma(id):
         flash('Turma não encontrada.')
         return redirect(url_for('admin.turmas'))
 
-    valid_matriculas_rows = db.execute(
-        "SELECT id FROM Matriculas WHERE turma_id = ? AND status = 'ativa'",
-        (id,)
-    ).fetchall()
-    valid_matriculas = {row['id'] for row in valid_matriculas_rows}
+    def chave(sufixo):
+        matricula_id, turma_disciplina_id = sufixo.split('-', 1)
+        return int(matricula_id), int(turma_disciplina_id)
 
-    valid_td_rows = db.execute(
-        'SELECT id FROM TurmaDisciplinas WHERE turma_id = ?',
-        (id,)
-    ).fetchall()
-    valid_turma_disciplinas = {row['id'] for row in valid_td_rows}
+    celulas, erros = ler_celulas(request.form, chave)
+    _, _, recusadas = gravar_notas(db, id, trimestre_int, celulas)
+    if recusadas:
+        flash(f'{recusadas} nota(s) não alterada(s): nessas disciplinas as notas do {trimestre_int}º trimestre '
+              'são calculadas a partir das avaliações.')
+    flash_resultado(trimestre_int, erros)
+    return redirect(url_for('admin.notas_turma', id=id, trimestre=trimestre_int))
 
-    for key, value in request.form.items():
-        if not key.startswith('nota-'):
-            continue
 
-        parts = key.split('-', 2)
-        if len(parts) != 3:
-            continue
 
-        try:
-            matricula_id = int(parts[1])
-            turma_disciplina_id = int(parts[2])
-        except (TypeError, ValueError):
-            flash('Dados inválidos nas notas.')
-            return redirect(url_for('admin.notas_turma', id=id, trimestre=trimestre_int))
+@bp.route('/turma/<int:id>/notas/<int:trimestre>/sync', methods=['GET', 'POST'])
+@login_required
+def sync_notas_turma(id, trimestre):
+    if g.user['papel'] != 'admin':
+        return jsonify({'erro': 'Acesso negado.'}), 403
 
-        if matricula_id not in valid_matriculas or turma_disciplina_id not in valid_turma_disciplinas:
-            continue
+    if trimestre not in (1, 2, 3):
+        return jsonify({'erro': 'Trimestre inválido.'}), 400
 
-        raw = (value or '').strip()
-        if raw == '':
-            db.execute(
-                'DELETE FROM NotasTrimestrais WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?',
-                (matricula_id, turma_disciplina_id, trimestre_int)
-            )
-            continue
+    if request.method == 'POST':
+        dados = request.get_json(silent=True)
+        if not isinstance(dados, dict):
+            return jsonify({'erro': 'Pedido inválido.'}), 400
+        itens = dados.get('celulas') or []
+    else:
+        dados = request.args
+        itens = []
 
-        try:
-            nota = float(raw.replace(',', '.'))
-        except ValueError:
-            flash('Nota inválida. Use um número entre 0 e 20.')
-            return redirect(url_for('admin.notas_turma', id=id, trimestre=trimestre_int))
+    try:
+        desde = int(dados.get('desde') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'erro': 'Versão inválida.'}), 400
 
-        if nota < 0 or nota > 20:
-            flash('Nota inválida. Use um número entre 0 e 20.')
-            return redirect(url_for('admin.notas_turma', id=id, trimestre=trimestre_int))
+    db = get_db()
+    turma = db.execute('SELECT id FROM Turmas WHERE id = ?', (id,)).fetchone()
+    if turma is None:
+        return jsonify({'erro': 'Turma não encontrada.'}), 404
 
-        try:
-            db.execute(
-                '''
-                INSERT INTO NotasTrimestrais (matricula_id, turma_disciplina_id, trimestre, nota)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(matricula_id, turma_disciplina_id, trimestre)
-                DO UPDATE SET nota = excluded.nota
-                ''',
-                (matricula_id, turma_disciplina_id, trimestre_int, nota)
-            )
-        except Exception:
-            try:
-                db.execute(
-                    'INSERT INTO NotasTrimestrais (matricula_id, turma_disciplina_id, trimestre, nota) VALUES (?, ?, ?, ?)',
-                    (matricula_id, turma_disciplina_id, trimestre_int, nota)
-                )
-            except Exception:
-                db.execute(
-                    'UPDATE NotasTrimestrais SET nota = ? WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?',
-                    (nota, matricula_id, turma_disciplina_id, trimestre_int)
-                )
+    celulas, erros = ler_celulas_json(itens)
+    resultado = sincronizar_notas(db, id, trimestre, celulas, desde)
+    resultado['erros'] = erros
+    return jsonify(resultado)
 
-    db.commit()
-    flash(f'Notas do {trimestre_int}º trimestre salvas com sucesso.')
-    return redirect(url_for('admin.notas_turma', id=id, trimestre=trimestre_int))
+@bp.route('/turma/<int:id>/boletim')
+@login_required
+def boletim_turma(id):
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    db = get_db()
+    turma = repositorio.turma(db, id)
+    if turma is None:
+        flash('Turma não encontrada.')
+        return redirect(url_for('admin.turmas'))
+
+    boletins = repositorio.boletins_turma(db, id)
+    if pedido_json():
+        return jsonify(resposta_json(boletins, None))
+    return render_template('admin/boletim_turma.html', turma=turma, boletins=boletins)
+
+
+@bp.route('/turma/<int:id>/faltas')
+@login_required
+def faltas_turma(id):
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    db = get_db()
+    turma = repositorio.turma(db, id)
+    if turma is None:
+        flash('Turma não encontrada.')
+        return redirect(url_for('admin.turmas'))
+
+    alunos = repositorio.faltas_acima_limite(db, id, presencas.LIMITE_FALTAS)
+    if pedido_json():
+        return jsonify(resposta_json(alunos, None))
+    return render_template(
+        'admin/faltas_turma.html', turma=turma, alunos=alunos, limite=presencas.LIMITE_FALTAS
+    )
 
 
 @bp.route('/turma/<int:id>/docencia')
@@ -532,34 +600,13 @@ def docencia_turma(id):
         return redirect(url_for('index'))
 
     db = get_db()
-    turma = db.execute('''
-        SELECT t.*, c.nome as curso_nome, c.descricao as curso_descricao, a.ano as ano_lectivo
-        FROM Turmas t
-        JOIN Cursos c ON t.curso_id = c.id
-        JOIN AnoLectivo a ON t.ano_lectivo_id = a.id
-        WHERE t.id = ?
-    ''', (id,)).fetchone()
+    turma = repositorio.turma(db, id)
 
     if turma is None:
         flash('Turma não encontrada.')
         return redirect(url_for('admin.turmas'))
 
-    turma_disciplinas = db.execute('''
-        SELECT
-            td.id as turma_disciplina_id,
-            d.nome as disciplina_nome,
-            p.id as professor_id,
-            p.nome as professor_nome
-        FROM TurmaDisciplinas td
-        JOIN Disciplinas d ON d.id = td.disciplina_id
-        LEFT JOIN Docencia doc
-            ON doc.turma_disciplina_id = td.id
-            AND doc.data_fim IS NULL
-        LEFT JOIN Professores p
-            ON p.id = doc.professor_id
-        WHERE td.turma_id = ?
-        ORDER BY d.nome
-    ''', (id,)).fetchall()
+    turma_disciplinas = repositorio.docentes_turma(db, id)
 
     professores = db.execute(
         'SELECT id, nome FROM Professores ORDER BY nome'
@@ -625,23 +672,26 @@ def atribuir_docencia(id):
         flash('Professor já está atribuído a esta disciplina.')
         return redirect(url_for('admin.docencia_turma', id=id))
 
-    db.execute(
-        'UPDATE Docencia SET data_fim = CURRENT_DATE WHERE turma_disciplina_id = ? AND data_fim IS NULL',
-        (turma_disciplina_id_int,)
-    )
-
-    try:
-        db.execute(
-            'INSERT INTO Docencia (turma_disciplina_id, professor_id, data_inicio) VALUES (?, ?, CURRENT_DATE)',
-            (turma_disciplina_id_int, professor_id_int)
-        )
-    except Exception:
+    def atribuir(db):
         db.execute(
-            "INSERT INTO Docencia (turma_disciplina_id, professor_id, data_inicio) VALUES (?, ?, datetime('now','localtime'))",
-            (turma_disciplina_id_int, professor_id_int)
+            'UPDATE Docencia SET data_fim = CURRENT_DATE WHERE turma_disciplina_id = ? AND data_fim IS NULL',
+            (turma_disciplina_id_int,)
         )
 
-    db.commit()
+        try:
+            db.execute(
+                'INSERT INTO Docencia (turma_disciplina_id, professor_id, data_inicio) VALUES (?, ?, CURRENT_DATE)',
+                (turma_disciplina_id_int, professor_id_int)
+            )
+        except Exception:
+            db.execute(
+                "INSERT INTO Docencia (turma_disciplina_id, professor_id, data_inicio) VALUES (?, ?, datetime('now','localtime'))",
+                (turma_disciplina_id_int, professor_id_int)
+            )
+
+        incrementar_contador(db, 'turmas')
+
+    transaccao(db, atribuir)
     flash('Professor atribuído com sucesso.')
     return redirect(url_for('admin.docencia_turma', id=id))
 
@@ -668,6 +718,9 @@ def sync_disciplinas(id):
         ''',
         (id, turma['curso_id'], turma['ano'])
     )
+    # Disciplinas novas deixam os boletins da turma incompletos
+    boletim.recalcular(db, turma_id=id)
+    incrementar_contador(db, 'turmas')
     db.commit()
     flash('Disciplinas sincronizadas com sucesso.')
     return redirect(url_for('admin.turma_detalhes', id=id))
@@ -681,10 +734,45 @@ def deletar_turma(id):
     
     db = get_db()
     db.execute('DELETE FROM Turmas WHERE id = ?', (id,))
+    incrementar_contador(db, 'turmas')
     db.commit()
     flash('Turma deletada.')
     return redirect(url_for('admin.turmas'))
 
+def _turmas_para_pendentes(db, user_ids=None):
+    """Turmas compatíveis com os alunos pendentes, agrupadas por (curso, classe).
+
+    Uma única consulta para todos os alunos; ``total_alunos`` conta as
+    matrículas activas de cada turma.
+    """
+    filtro_ids = ''
+    parametros = []
+    if user_ids is not None:
+        filtro_ids = 'AND u.id IN (SELECT value FROM json_each(?))'
+        parametros.append(json.dumps(list(user_ids)))
+
+    turmas = db.execute(f'''
+        SELECT t.id, t.designacao, t.curso_id, t.ano, al.ano as ano_lectivo, c.nome as curso_nome,
+            (SELECT COUNT(*) FROM Matriculas m WHERE m.turma_id = t.id AND m.status = 'ativa') as total_alunos
+        FROM Turmas t
+        JOIN Cursos c ON t.curso_id = c.id
+        JOIN AnoLectivo al ON t.ano_lectivo_id = al.id
+        WHERE (t.curso_id, t.ano) IN (
+            SELECT a.curso_preferido_id, a.ano_preferido
+            FROM Usuarios u
+            JOIN Alunos a ON u.aluno_id = a.id
+            WHERE u.status = 'pendente' AND u.papel = 'aluno'
+              {filtro_ids}
+        )
+        ORDER BY al.ano DESC, t.designacao
+    ''', parametros).fetchall()
+
+    turmas_por_grupo = {}
+    for turma in turmas:
+        turmas_por_grupo.setdefault((turma['curso_id'], turma['ano']), []).append(turma)
+    return turmas_por_grupo
+
+
 @bp.route('/aprovar_alunos')
 @login_required
 def aprovar_alunos():
@@ -699,22 +787,16 @@ def aprovar_alunos():
         JOIN Alunos a ON u.aluno_id = a.id
         WHERE u.status = 'pendente' AND u.papel = 'aluno'
     ''').fetchall()
-    
-    # For each student, get matching turmas
+    turmas_por_grupo = _turmas_para_pendentes(db)
+
     alunos_com_turmas = []
     for aluno in alunos_pendentes:
-        turmas = db.execute('''
-            SELECT t.id, t.designacao, c.nome as curso_nome
-            FROM Turmas t
-            JOIN Cursos c ON t.curso_id = c.id
-            WHERE t.curso_id = ? AND t.ano = ?
-        ''', (aluno['curso_preferido_id'], aluno['ano_preferido'])).fetchall()
         alunos_com_turmas.append({
             'user_id': aluno['user_id'],
             'aluno_id': aluno['aluno_id'],
             'nome': aluno['nome'],
             'email': aluno['email'],
-            'turmas': turmas
+            'turmas': turmas_por_grupo.get((aluno['curso_preferido_id'], aluno['ano_preferido']), [])
         })
     
     return render_template('admin/aprovar_alunos.html', alunos=alunos_com_turmas)
@@ -731,21 +813,100 @@ def aprovar_aluno(user_id):
         flash('Selecione uma turma.')
         return redirect(url_for('admin.aprovar_alunos'))
     
-    db = get_db()
-    # Update status to ativo
-    db.execute('UPDATE Usuarios SET status = ? WHERE id = ?', ('ativo', user_id))
-    # Get aluno_id
-    user = db.execute('SELECT aluno_id FROM Usuarios WHERE id = ?', (user_id,)).fetchone()
-    if user:
-        aluno_id = user['aluno_id']
-        # Matricular
-        existing = db.execute('SELECT id FROM Matriculas WHERE aluno_id = ? AND turma_id = ?', (aluno_id, turma_id)).fetchone()
-        if not existing:
-            db.execute('INSERT INTO Matriculas (aluno_id, turma_id) VALUES (?, ?)', (aluno_id, turma_id))
-    db.commit()
+    def aprovar(db):
+        db.execute('UPDATE Usuarios SET status = ? WHERE id = ?', ('ativo', user_id))
+        # UNIQUE (aluno_id, turma_id) dispensa verificar se já está matriculado
+        db.execute(
+            '''
+            INSERT OR IGNORE INTO Matriculas (aluno_id, turma_id)
+            SELECT aluno_id, ? FROM Usuarios WHERE id = ? AND aluno_id IS NOT NULL
+            ''',
+            (turma_id, user_id)
+        )
+        incrementar_contador(db, 'turmas')
+
+    transaccao(get_db(), aprovar)
+    invalidate_user(user_id)
     flash('Aluno aprovado e matriculado.')
     return redirect(url_for('admin.aprovar_alunos'))
 
+
+def _aprovar_em_lote(db, user_ids):
+    """Aprovar e matricular vários alunos pendentes numa só transacção.
+
+    Cada aluno vai para a turma do seu curso e classe preferidos com menos
+    matrículas activas, considerando só o ano lectivo mais recente com
+    turmas compatíveis. Devolve os ids aprovados e os ids sem turma.
+    """
+    def aprovar(db):
+        pendentes = db.execute('''
+            SELECT u.id as user_id, u.aluno_id, a.curso_preferido_id, a.ano_preferido
+            FROM Usuarios u
+            JOIN Alunos a ON u.aluno_id = a.id
+            WHERE u.status = 'pendente' AND u.papel = 'aluno'
+              AND u.id IN (SELECT value FROM json_each(?))
+            ORDER BY a.nome, u.id
+        ''', (json.dumps(list(user_ids)),)).fetchall()
+
+        filas = {}
+        for grupo, turmas in _turmas_para_pendentes(db, user_ids).items():
+            recente = max(t['ano_lectivo'] for t in turmas)
+            fila = [
+                (t['total_alunos'], t['designacao'], t['id'])
+                for t in turmas if t['ano_lectivo'] == recente
+            ]
+            heapq.heapify(fila)
+            filas[grupo] = fila
+
+        aprovados = []
+        matriculas = []
+        sem_turma = []
+        for aluno in pendentes:
+            fila = filas.get((aluno['curso_preferido_id'], aluno['ano_preferido']))
+            if not fila:
+                sem_turma.append(aluno['user_id'])
+                continue
+            total, designacao, turma_id = heapq.heappop(fila)
+            heapq.heappush(fila, (total + 1, designacao, turma_id))
+            aprovados.append((aluno['user_id'],))
+            matriculas.append((aluno['aluno_id'], turma_id))
+
+        db.executemany("UPDATE Usuarios SET status = 'ativo' WHERE id = ?", aprovados)
+        db.executemany('INSERT OR IGNORE INTO Matriculas (aluno_id, turma_id) VALUES (?, ?)', matriculas)
+        if matriculas:
+            incrementar_contador(db, 'turmas')
+        return aprovados, sem_turma
+
+    aprovados, sem_turma = transaccao(db, aprovar)
+    return [user_id for (user_id,) in aprovados], sem_turma
+
+
+@bp.route('/aprovar_alunos/lote', methods=['POST'])
+@login_required
+def aprovar_alunos_lote():
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    try:
+        user_ids = sorted({int(v) for v in request.form.getlist('user_id')})
+    except (TypeError, ValueError):
+        flash('Dados inválidos.')
+        return redirect(url_for('admin.aprovar_alunos'))
+
+    if not user_ids:
+        flash('Selecione pelo menos um aluno.')
+        return redirect(url_for('admin.aprovar_alunos'))
+
+    aprovados, sem_turma = _aprovar_em_lote(get_db(), user_ids)
+    for user_id in aprovados:
+        invalidate_user(user_id)
+
+    flash(f'{len(aprovados)} aluno(s) aprovado(s) e matriculado(s).')
+    if sem_turma:
+        flash(f'{len(sem_turma)} aluno(s) sem turma compatível ficaram pendentes.')
+    return redirect(url_for('admin.aprovar_alunos'))
+
 @bp.route('/anuncios')
 @login_required
 def anuncios():
@@ -754,8 +915,14 @@ def anuncios():
         return redirect(url_for('index'))
     
     db = get_db()
-    anuncios = db.execute('SELECT * FROM Anuncios ORDER BY data_publicacao DESC').fetchall()
-    return render_template('admin/anuncios.html', anuncios=anuncios)
+    anuncios, proximo = paginar(
+        db, 'SELECT * FROM Anuncios', [], [],
+        [('data_publicacao', 'data_publicacao'), ('id', 'id')],
+        descendente=True
+    )
+    if pedido_json():
+        return jsonify(resposta_json(anuncios, proximo))
+    return render_template('admin/anuncios.html', anuncios=anuncios, filtros={}, proximo=proximo)
 
 @bp.route('/criar_anuncio', methods=['GET', 'POST'])
 @login_required
@@ -774,8 +941,124 @@ def criar_anuncio():
         
         db = get_db()
         db.execute('INSERT INTO Anuncios (titulo, conteudo, admin_id) VALUES (?, ?, ?)', (titulo, conteudo, g.user['id']))
+        incrementar_contador(db, 'anuncios')
         db.commit()
+        condicional.limpar_paginas()
         flash('Anúncio criado com sucesso.')
         return redirect(url_for('admin.anuncios'))
     
-    return render_template('admin/criar_anuncio.html')
\ No newline at end of file
+    return render_template('admin/criar_anuncio.html')
+
+
+@bp.route('/metricas/senhas')
+@login_required
+def metricas_senhas():
+    if g.user['papel'] != 'admin':
+        return jsonify({'erro': 'Acesso negado.'}), 403
+
+    return jsonify(senhas.metricas())
+
+
+@bp.route('/importar_alunos', methods=['GET', 'POST'])
+@login_required
+def importar_alunos():
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    db = get_db()
+    if request.method == 'POST':
+        ficheiro = request.files.get('ficheiro')
+        status = request.form.get('status', 'pendente')
+        if ficheiro is None or not ficheiro.filename:
+            flash('Escolha um ficheiro CSV ou XLSX.')
+            return redirect(url_for('admin.importar_alunos'))
+        if status not in ('pendente', 'ativo'):
+            flash('Estado inválido.')
+            return redirect(url_for('admin.importar_alunos'))
+
+        extensao = os.path.splitext(ficheiro.filename)[1].lower()
+        temporario = os.path.join(importacao.pasta(), f'envio-{os.getpid()}-{g.user["id"]}{extensao}')
+        ficheiro.save(temporario)
+        # O nome final é o checksum: reenviar o mesmo ficheiro retoma a importação
+        caminho = os.path.join(importacao.pasta(), importacao.checksum(temporario) + extensao)
+        os.replace(temporario, caminho)
+        try:
+            registo = importacao.importar(
+                caminho, status=status, admin_id=g.user['id'], nome=ficheiro.filename
+            )
+        except importacao.ErroImportacao as erro:
+            os.remove(caminho)
+            flash(str(erro))
+            return redirect(url_for('admin.importar_alunos'))
+        # Só é guardado para retomar uma importação interrompida
+        if registo['estado'] == 'concluida':
+            os.remove(caminho)
+
+        flash(f'{registo["inseridos"]} aluno(s) importado(s), {registo["rejeitados"]} linha(s) rejeitada(s).')
+        return redirect(url_for('admin.detalhes_importacao', id=registo['id']))
+
+    importacoes = db.execute('SELECT * FROM Importacoes ORDER BY id DESC LIMIT 20').fetchall()
+    return render_template('admin/importar_alunos.html', importacoes=importacoes)
+
+
+@bp.route('/importacao/<int:id>')
+@login_required
+def detalhes_importacao(id):
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    db = get_db()
+    registo = db.execute('SELECT * FROM Importacoes WHERE id = ?', (id,)).fetchone()
+    if registo is None:
+        flash('Importação não encontrada.')
+        return redirect(url_for('admin.importar_alunos'))
+
+    rejeicoes, proximo = paginar(
+        db, 'SELECT linha, motivo, dados FROM ImportacaoRejeicoes', ['importacao_id = ?'], [id],
+        [('linha', 'linha')]
+    )
+    rejeicoes = [dict(r, dados=json.loads(r['dados'])) for r in rejeicoes]
+    credenciais = os.path.exists(os.path.join(importacao.pasta(), f'{id}-credenciais.csv'))
+    return render_template(
+        'admin/detalhes_importacao.html', importacao=registo, rejeicoes=rejeicoes,
+        credenciais=credenciais, filtros={}, proximo=proximo
+    )
+
+
+@bp.route('/importacao/<int:id>/rejeitadas.csv')
+@login_required
+def rejeitadas_importacao(id):
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    return Response(
+        stream_with_context(importacao.rejeicoes_csv(get_db(), id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=importacao-{id}-rejeitadas.csv'}
+    )
+
+
+@bp.route('/importacao/<int:id>/credenciais', methods=['POST'])
+@login_required
+def credenciais_importacao(id):
+    if g.user['papel'] != 'admin':
+        flash('Acesso negado.')
+        return redirect(url_for('index'))
+
+    # As passwords geradas só podem ser descarregadas uma vez
+    caminho = os.path.join(importacao.pasta(), f'{id}-credenciais.csv')
+    try:
+        with open(caminho, encoding='utf8') as f:
+            conteudo = f.read()
+        os.remove(caminho)
+    except FileNotFoundError:
+        flash('As credenciais desta importação já foram descarregadas.')
+        return redirect(url_for('admin.detalhes_importacao', id=id))
+
+    return Response(
+        conteudo, mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=importacao-{id}-credenciais.csv'}
+    )
@@ -1,9 +1,12 @@
 import functools
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for)
-from werkzeug.security import check_password_hash, generate_password_hash
+    Blueprint, current_app, flash, g, redirect, render_template, request, session, url_for)
+from app import referencia
+from app.cache import TTLCache
 from app.db import get_db
+from app.escritor import transaccao
+from app.senhas import gerar_hash, precisa_rehash, verificar
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -36,11 +39,12 @@ def register():
                     error = 'Username or email already registered.'
 
             if error is None:
-                db.execute(
+                pwhash = gerar_hash(password)
+                user_id = transaccao(db, lambda db: db.execute(
                     'INSERT INTO Usuarios (username, password, email, papel) VALUES (?, ?, ?, ?)',
-                    (username, generate_password_hash(password), email, 'admin')
-                )
-                db.commit()
+                    (username, pwhash, email, 'admin')
+                ).lastrowid)
+                invalidate_user(user_id)
                 flash('Admin registered successfully.')
                 return redirect(url_for('auth.login'))
 
@@ -70,16 +74,21 @@ def register():
                     error = 'Professor ou usuário já registrado com este email ou número do bilhete.'
 
             if error is None:
-                db.execute(
-                    'INSERT INTO Professores (nome, email, telefone, departamento, numero_bilhete, especialidade, endereco, genero) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                    (nome, email, telefone, departamento, numero_bilhete, especialidade, endereco, genero)
-                )
-                professor_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
-                db.execute(
-                    'INSERT INTO Usuarios (username, password, email, papel, professor_id) VALUES (?, ?, ?, ?, ?)',
-                    (username, generate_password_hash(password), email, 'professor', professor_id)
-                )
-                db.commit()
+                # O hash é lento: calculá-lo antes de pedir o lock de escrita
+                pwhash = gerar_hash(password)
+
+                def registar(db):
+                    professor_id = db.execute(
+                        'INSERT INTO Professores (nome, email, telefone, departamento, numero_bilhete, especialidade, endereco, genero) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (nome, email, telefone, departamento, numero_bilhete, especialidade, endereco, genero)
+                    ).lastrowid
+                    return db.execute(
+                        'INSERT INTO Usuarios (username, password, email, papel, professor_id) VALUES (?, ?, ?, ?, ?)',
+                        (username, pwhash, email, 'professor', professor_id)
+                    ).lastrowid
+
+                user_id = transaccao(db, registar)
+                invalidate_user(user_id)
                 flash('Professor registered successfully.')
                 return redirect(url_for('auth.login'))
 
@@ -113,16 +122,20 @@ def register():
                     error = 'Aluno ou usuário já registrado com este email ou número do bilhete.'
 
             if error is None:
-                db.execute(
-                    'INSERT INTO Alunos (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                    (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido)
-                )
-                aluno_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
-                db.execute(
-                    'INSERT INTO Usuarios (username, password, email, papel, aluno_id) VALUES (?, ?, ?, ?, ?)',
-                    (username, generate_password_hash(password), email, 'aluno', aluno_id)
-                )
-                db.commit()
+                pwhash = gerar_hash(password)
+
+                def registar(db):
+                    aluno_id = db.execute(
+                        'INSERT INTO Alunos (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido)
+                    ).lastrowid
+                    return db.execute(
+                        'INSERT INTO Usuarios (username, password, email, papel, aluno_id) VALUES (?, ?, ?, ?, ?)',
+                        (username, pwhash, email, 'aluno', aluno_id)
+                    ).lastrowid
+
+                user_id = transaccao(db, registar)
+                invalidate_user(user_id)
                 flash('Aluno registered successfully.')
                 return redirect(url_for('auth.login'))
 
@@ -168,24 +181,26 @@ def pre_register():
                 error = 'Já existe registro com este email ou número do bilhete.'
 
         if error is None:
-            db.execute(
-                'INSERT INTO Alunos (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido)
-            )
-            aluno_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
-            db.execute(
-                'INSERT INTO Usuarios (username, password, email, papel, status, aluno_id) VALUES (?, ?, ?, ?, ?, ?)',
-                (username, generate_password_hash(password), email, 'aluno', 'pendente', aluno_id)
-            )
-            db.commit()
+            pwhash = gerar_hash(password)
+
+            def registar(db):
+                aluno_id = db.execute(
+                    'INSERT INTO Alunos (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido)
+                ).lastrowid
+                return db.execute(
+                    'INSERT INTO Usuarios (username, password, email, papel, status, aluno_id) VALUES (?, ?, ?, ?, ?, ?)',
+                    (username, pwhash, email, 'aluno', 'pendente', aluno_id)
+                ).lastrowid
+
+            user_id = transaccao(db, registar)
+            invalidate_user(user_id)
             flash('Pré-inscrição enviada. Aguarde aprovação do administrador.')
             return redirect(url_for('index'))
 
         flash(error)
 
-    db = get_db()
-    cursos = db.execute('SELECT id, nome, descricao FROM Cursos ORDER BY id').fetchall()
-    return render_template('auth/pre_register.html', cursos=cursos)
+    return render_template('auth/pre_register.html', cursos=referencia.dados().cursos)
 
 
 # Rota para fazer login
@@ -204,12 +219,21 @@ def login():
 
         if user is None:
             error = 'Usuario não encontrado.'
-        elif not check_password_hash(user['password'], password):
+        elif not verificar(user['password'], password):
             error = 'Senha incorreta.'
         elif user['status'] == 'pendente':
             error = 'Conta pendente de aprovação pelo administrador.'
 
         if error is None:
+            # Actualizar hashes antigos quando os parâmetros configurados mudam
+            if precisa_rehash(user['password']):
+                db.execute(
+                    'UPDATE Usuarios SET password = ? WHERE id = ?',
+                    (gerar_hash(password), user['id'])
+                )
+                db.commit()
+                invalidate_user(user['id'])
+
             session.clear()
             session['user_id'] = user['id']
             session.modified = True
@@ -221,6 +245,39 @@ def login():
 
     return render_template('auth/login.html')
 
+def _user_cache():
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('user_cache', TTLCache(
+            maxsize=current_app.config['USER_CACHE_SIZE'],
+            ttl=current_app.config['USER_CACHE_TTL']
+        ))
+    return cache
+
+
+def get_user(user_id):
+    cache = _user_cache()
+    user = cache.get(user_id)
+    if user is None:
+        version = cache.version(user_id)
+        row = get_db().execute(
+            'SELECT * FROM Usuarios WHERE id = ?', (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        cache.put(user_id, user, version)
+    return user
+
+
+def invalidate_user(user_id):
+    """Descartar o utilizador em cache após alterar o seu registo.
+
+    Só neste worker: nos outros o registo antigo dura até USER_CACHE_TTL.
+    """
+    _user_cache().invalidate(user_id)
+
+
 @bp.before_app_request
 def load_logged_in_user():
     user_id = session.get('user_id')
@@ -228,9 +285,7 @@ def load_logged_in_user():
     if user_id is None:
         g.user = None
     else:
-        g.user = get_db().execute(
-            'SELECT * FROM Usuarios WHERE id = ?', (user_id,)
-        ).fetchone()
+        g.user = get_user(user_id)
 
 @bp.route('/logout')
 def logout():
@@ -0,0 +1,185 @@
+import json
+import time
+
+import click
+
+from app.db import get_db
+from app.escritor import transaccao
+from app.notas import aplicar_celulas
+
+TIPOS = ('teste', 'trabalho', 'prova', 'exame', 'oral', 'participacao')
+
+# Nota trimestral = 20 × Σ(peso × nota / nota_max) / Σ peso, só sobre as
+# avaliações do trimestre em que o aluno tem nota; arredondada às décimas,
+# como as notas lançadas à mão
+_PONDERADAS = '''
+    SELECT n.matricula_id, a.trimestre,
+           ROUND(MIN(20.0, 20.0 * SUM(a.peso * n.nota / a.nota_max) / SUM(a.peso)), 1)
+    FROM Avaliacoes a
+    JOIN Notas n ON n.avaliacao_id = a.id
+    JOIN Matriculas m ON m.id = n.matricula_id
+    WHERE a.turma_disciplina_id = ? AND m.status = 'ativa'
+      AND a.trimestre IN (SELECT value FROM json_each(?))
+      {matriculas}
+    GROUP BY n.matricula_id, a.trimestre
+'''
+
+
+def recalcular(db, turma_disciplina_id, trimestres=None, matriculas=None):
+    """Passar para NotasTrimestrais as notas ponderadas das avaliações.
+
+    Um só SELECT agregado calcula as notas de todos os alunos (ou só de
+    ``matriculas``) nos ``trimestres`` pedidos; só as células que mudam
+    são gravadas, pelo mesmo caminho das notas lançadas à mão (versões,
+    sincronização e boletins), com ``origem = 'avaliacoes'``. Só os
+    trimestres com avaliações são tocados. Um aluno com notas nas
+    avaliações do trimestre fica com a nota calculada, mesmo que a tivesse
+    lançada à mão; sem notas nas avaliações mantém a nota lançada à mão,
+    e perde só uma nota calculada antes. Sem ``trimestres`` são todos os
+    trimestres com avaliações. Não faz commit; devolve o número de
+    células gravadas e apagadas.
+    """
+    com_avaliacoes = {row[0] for row in db.execute(
+        'SELECT DISTINCT trimestre FROM Avaliacoes WHERE turma_disciplina_id = ?',
+        (turma_disciplina_id,)
+    )}
+    if trimestres is not None:
+        com_avaliacoes &= set(trimestres)
+    trimestres = sorted(com_avaliacoes)
+    if not trimestres or matriculas is not None and not matriculas:
+        return 0
+
+    parametros = [turma_disciplina_id, json.dumps(trimestres)]
+    filtro = ''
+    if matriculas is not None:
+        filtro = 'AND m.id IN (SELECT value FROM json_each(?))'
+        parametros.append(json.dumps(sorted(set(matriculas))))
+    calculadas = {
+        (matricula_id, trimestre): nota
+        for matricula_id, trimestre, nota in db.execute(_PONDERADAS.format(matriculas=filtro), parametros)
+    }
+    actuais = {
+        (matricula_id, trimestre): (nota, origem)
+        for matricula_id, trimestre, nota, origem in db.execute(
+            '''
+            SELECT nt.matricula_id, nt.trimestre, nt.nota, nt.origem
+            FROM NotasTrimestrais nt
+            JOIN Matriculas m ON m.id = nt.matricula_id
+            WHERE nt.turma_disciplina_id = ? AND m.status = 'ativa'
+              AND nt.trimestre IN (SELECT value FROM json_each(?))
+              {matriculas}
+            '''.format(matriculas=filtro),
+            parametros
+        )
+    }
+
+    total = 0
+    for trimestre in trimestres:
+        upserts = [
+            (matricula_id, turma_disciplina_id, nota)
+            for (matricula_id, t), nota in calculadas.items()
+            if t == trimestre and actuais.get((matricula_id, t)) != (nota, 'avaliacoes')
+        ]
+        deletes = [
+            (matricula_id, turma_disciplina_id)
+            for (matricula_id, t), (_, origem) in actuais.items()
+            if t == trimestre and origem == 'avaliacoes' and (matricula_id, t) not in calculadas
+        ]
+        aplicar_celulas(db, trimestre, upserts, deletes, origem='avaliacoes')
+        total += len(upserts) + len(deletes)
+    return total
+
+
+def criar_avaliacao(db, turma_disciplina_id, trimestre, tipo, titulo, data, peso, nota_max):
+    def criar(db):
+        return db.execute(
+            '''
+            INSERT INTO Avaliacoes (turma_disciplina_id, trimestre, tipo, titulo, data, peso, nota_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (turma_disciplina_id, trimestre, tipo, titulo, data, peso, nota_max)
+        ).lastrowid
+
+    return transaccao(db, criar)
+
+
+def gravar_notas_avaliacao(db, avaliacao, celulas):
+    """Gravar as notas de uma avaliação e recalcular só as matrículas alteradas.
+
+    ``celulas`` mapeia matricula_id para a nota (``None`` = apagar), já
+    validada contra ``nota_max``. Matrículas que não estão activas na
+    turma são ignoradas. Devolve o número de notas gravadas e apagadas.
+    """
+    def gravar(db):
+        activas = {row[0] for row in db.execute(
+            '''
+            SELECT m.id
+            FROM Matriculas m
+            JOIN TurmaDisciplinas td ON td.turma_id = m.turma_id
+            WHERE td.id = ? AND m.status = 'ativa'
+            ''',
+            (avaliacao['turma_disciplina_id'],)
+        )}
+        upserts = [(m, nota) for m, nota in celulas.items() if m in activas and nota is not None]
+        deletes = [m for m, nota in celulas.items() if m in activas and nota is None]
+        db.executemany(
+            '''
+            INSERT INTO Notas (avaliacao_id, matricula_id, nota) VALUES (?, ?, ?)
+            ON CONFLICT(avaliacao_id, matricula_id) DO UPDATE SET nota = excluded.nota
+            WHERE nota <> excluded.nota
+            ''',
+            [(avaliacao['id'], m, nota) for m, nota in upserts]
+        )
+        db.executemany(
+            'DELETE FROM Notas WHERE avaliacao_id = ? AND matricula_id = ?',
+            [(avaliacao['id'], m) for m in deletes]
+        )
+        recalcular(
+            db, avaliacao['turma_disciplina_id'], [avaliacao['trimestre']],
+            [m for m, _ in upserts] + deletes
+        )
+        return len(upserts), len(deletes)
+
+    return transaccao(db, gravar)
+
+
+def apagar_avaliacao(db, avaliacao):
+    """Apagar a avaliação (e as suas notas) e recalcular o trimestre dela.
+
+    Se era a última avaliação do trimestre, as notas trimestrais ficam
+    como estavam e voltam a poder ser lançadas à mão.
+    """
+    def apagar(db):
+        db.execute('DELETE FROM Avaliacoes WHERE id = ?', (avaliacao['id'],))
+        recalcular(db, avaliacao['turma_disciplina_id'], [avaliacao['trimestre']])
+
+    transaccao(db, apagar)
+
+
+@click.command('recompute-grades')
+@click.option('--turma-disciplina', 'turmas_disciplinas', type=int, multiple=True,
+              help='Disciplina de uma turma (repetível).')
+@click.option('--turma', 'turma_id', type=int, help='Todas as disciplinas desta turma.')
+def recompute_grades_command(turmas_disciplinas, turma_id):
+    """Recalcular as notas trimestrais a partir das avaliações."""
+    db = get_db()
+    turmas_disciplinas = list(turmas_disciplinas)
+    if turma_id is not None:
+        turmas_disciplinas += [row[0] for row in db.execute(
+            'SELECT id FROM TurmaDisciplinas WHERE turma_id = ? ORDER BY id', (turma_id,)
+        )]
+    if not turmas_disciplinas:
+        raise click.UsageError('Indique --turma-disciplina ou --turma.')
+
+    inicio = time.perf_counter()
+    total = 0
+    for turma_disciplina_id in turmas_disciplinas:
+        total += transaccao(db, lambda db: recalcular(db, turma_disciplina_id))
+    click.echo(
+        f'{len(turmas_disciplinas)} disciplina(s), {total} nota(s) trimestral(is) alterada(s) '
+        f'em {time.perf_counter() - inicio:.1f}s.'
+    )
+
+
+def init_app(app):
+    app.cli.add_command(recompute_grades_command)
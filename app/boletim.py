@@ -0,0 +1,274 @@
+import json
+import math
+import time
+from array import array
+
+import click
+
+from app.db import get_db
+
+# Classificação anual mínima para uma disciplina ser positiva (escala 0-20)
+NOTA_MINIMA = 10
+# O aluno transita com até este número de disciplinas negativas
+MAX_NEGATIVAS = 2
+
+TRIMESTRES = 3
+
+# Conjuntos de matrículas que podem ser calculados de uma só vez
+_AMBITOS = {
+    'turma': 'm.turma_id = ?',
+    'ano_lectivo': 'm.turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?)',
+    'matriculas': 'm.id IN (SELECT value FROM json_each(?))',
+}
+
+
+def _valor(x):
+    return None if x != x else x
+
+
+def _media(valores):
+    presentes = [v for v in valores if v == v]
+    return math.fsum(presentes) / len(presentes) if presentes else math.nan
+
+
+class Pauta:
+    """Notas trimestrais de um conjunto de matrículas, guardadas em colunas.
+
+    Há uma posição por par (matrícula, turma_disciplina), ordenada por
+    matrícula e disciplina; ``notas`` tem ``TRIMESTRES`` valores por par,
+    com NaN onde não há nota. Os pares de cada matrícula são um intervalo
+    contíguo (``inicios``), por isso as médias do aluno saem das mesmas
+    colunas sem agrupar linha a linha.
+    """
+
+    __slots__ = (
+        'ambito', 'valor', 'matriculas', 'inicios', 'pares_matriculas', 'pares_disciplinas',
+        'notas', 'medias', 'finais', 'medias_trimestres', 'medias_finais', 'negativas', 'resultados'
+    )
+
+    def __init__(self, ambito, valor):
+        self.ambito = ambito
+        self.valor = valor
+        self.matriculas = array('q')
+        self.inicios = array('q')
+        self.pares_matriculas = array('q')
+        self.pares_disciplinas = array('q')
+
+    @classmethod
+    def carregar(cls, db, ambito, valor):
+        onde = _AMBITOS[ambito]
+        pauta = cls(ambito, valor)
+        cur = db.cursor()
+        cur.row_factory = None
+
+        posicao = {}
+        for matricula_id, turma_disciplina_id in cur.execute(
+            f'''
+            SELECT m.id, td.id
+            FROM Matriculas m
+            JOIN TurmaDisciplinas td ON td.turma_id = m.turma_id
+            WHERE {onde}
+            ORDER BY m.id, td.id
+            ''',
+            (valor,)
+        ):
+            p = len(pauta.pares_matriculas)
+            if not pauta.matriculas or pauta.matriculas[-1] != matricula_id:
+                pauta.matriculas.append(matricula_id)
+                pauta.inicios.append(p)
+            pauta.pares_matriculas.append(matricula_id)
+            pauta.pares_disciplinas.append(turma_disciplina_id)
+            posicao[matricula_id, turma_disciplina_id] = p
+        pauta.inicios.append(len(pauta.pares_matriculas))
+
+        notas = pauta.notas = array('d', [math.nan]) * (TRIMESTRES * len(pauta.pares_matriculas))
+        for matricula_id, turma_disciplina_id, trimestre, nota in cur.execute(
+            f'''
+            SELECT nt.matricula_id, nt.turma_disciplina_id, nt.trimestre, nt.nota
+            FROM NotasTrimestrais nt
+            JOIN Matriculas m ON m.id = nt.matricula_id
+            WHERE {onde}
+            ''',
+            (valor,)
+        ):
+            p = posicao.get((matricula_id, turma_disciplina_id))
+            if p is not None:
+                notas[TRIMESTRES * p + trimestre - 1] = nota
+
+        pauta.calcular()
+        return pauta
+
+    def calcular(self):
+        notas = self.notas
+        pares = len(self.pares_matriculas)
+
+        # Por disciplina: média dos trimestres com nota e, com os três
+        # trimestres lançados, a classificação anual
+        self.medias = array('d', [math.nan]) * pares
+        self.finais = array('d', [math.nan]) * pares
+        for p in range(pares):
+            trimestres = notas[TRIMESTRES * p:TRIMESTRES * (p + 1)]
+            self.medias[p] = media = _media(trimestres)
+            if all(nota == nota for nota in trimestres):
+                self.finais[p] = media
+
+        # Por aluno: média de cada trimestre, média final e resultado
+        self.medias_trimestres = array('d')
+        self.medias_finais = array('d')
+        self.negativas = array('q')
+        self.resultados = []
+        for k in range(len(self.matriculas)):
+            inicio, fim = self.inicios[k], self.inicios[k + 1]
+            for t in range(TRIMESTRES):
+                self.medias_trimestres.append(
+                    _media(notas[TRIMESTRES * inicio + t:TRIMESTRES * fim:TRIMESTRES])
+                )
+            finais = self.finais[inicio:fim]
+            self.medias_finais.append(_media(finais))
+            negativas = sum(1 for nota in finais if nota < NOTA_MINIMA)
+            self.negativas.append(negativas)
+            if any(nota != nota for nota in finais):
+                self.resultados.append('em_curso')
+            elif negativas <= MAX_NEGATIVAS:
+                self.resultados.append('aprovado')
+            else:
+                self.resultados.append('reprovado')
+
+    def gravar(self, db, pares=None):
+        """Materializar a pauta em BoletimDisciplinas e Boletins.
+
+        Com ``pares`` só esses (matrícula, turma_disciplina) são
+        reescritos em BoletimDisciplinas; sem eles as linhas de todo o
+        âmbito são substituídas. Só os pares com alguma nota têm linha em
+        BoletimDisciplinas. Os Boletins das matrículas do âmbito são
+        sempre reescritos. Não faz commit.
+        """
+        onde = _AMBITOS[self.ambito]
+        if pares is None:
+            db.execute(
+                f'''
+                DELETE FROM BoletimDisciplinas
+                WHERE matricula_id IN (SELECT m.id FROM Matriculas m WHERE {onde})
+                ''',
+                (self.valor,)
+            )
+        db.execute(
+            f'DELETE FROM Boletins WHERE matricula_id IN (SELECT m.id FROM Matriculas m WHERE {onde})',
+            (self.valor,)
+        )
+
+        linhas = []
+        vazios = []
+        for p, (matricula_id, turma_disciplina_id) in enumerate(
+            zip(self.pares_matriculas, self.pares_disciplinas)
+        ):
+            if pares is not None and (matricula_id, turma_disciplina_id) not in pares:
+                continue
+            if self.medias[p] != self.medias[p]:
+                vazios.append((matricula_id, turma_disciplina_id))
+                continue
+            linhas.append((
+                matricula_id, turma_disciplina_id,
+                *(_valor(nota) for nota in self.notas[TRIMESTRES * p:TRIMESTRES * (p + 1)]),
+                _valor(self.medias[p]), _valor(self.finais[p])
+            ))
+        if pares is not None:
+            db.executemany(
+                'DELETE FROM BoletimDisciplinas WHERE matricula_id = ? AND turma_disciplina_id = ?',
+                vazios
+            )
+        db.executemany(
+            '''
+            INSERT OR REPLACE INTO BoletimDisciplinas
+              (matricula_id, turma_disciplina_id, nota_t1, nota_t2, nota_t3, media, classificacao_final)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''',
+            linhas
+        )
+        db.executemany(
+            '''
+            INSERT INTO Boletins
+              (matricula_id, media_t1, media_t2, media_t3, media_final, disciplinas, negativas, resultado)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            [
+                (
+                    matricula_id,
+                    *(_valor(m) for m in self.medias_trimestres[TRIMESTRES * k:TRIMESTRES * (k + 1)]),
+                    _valor(self.medias_finais[k]),
+                    self.inicios[k + 1] - self.inicios[k],
+                    self.negativas[k],
+                    self.resultados[k]
+                )
+                for k, matricula_id in enumerate(self.matriculas)
+            ]
+        )
+        return len(linhas)
+
+
+def actualizar(db, pares):
+    """Recalcular os boletins depois de alterar as notas dos ``pares`` indicados.
+
+    ``pares`` são (matricula_id, turma_disciplina_id). Só esses pares e os
+    Boletins das suas matrículas são reescritos. Chamar na transacção de
+    escrita das notas, antes do commit.
+    """
+    pares = set(pares)
+    if not pares:
+        return
+    matriculas = sorted({matricula_id for matricula_id, _ in pares})
+    Pauta.carregar(db, 'matriculas', json.dumps(matriculas)).gravar(db, pares)
+
+
+def recalcular(db, turma_id=None, ano_lectivo_id=None):
+    """Recalcular de raiz os boletins de uma turma, de um ano lectivo ou de todos.
+
+    Sem argumentos cada ano lectivo é calculado e gravado à vez. Não faz
+    commit. Devolve o número de matrículas calculadas.
+    """
+    if turma_id is not None:
+        pauta = Pauta.carregar(db, 'turma', turma_id)
+    elif ano_lectivo_id is not None:
+        pauta = Pauta.carregar(db, 'ano_lectivo', ano_lectivo_id)
+    else:
+        return sum(
+            recalcular(db, ano_lectivo_id=row[0])
+            for row in db.execute('SELECT id FROM AnoLectivo ORDER BY ano').fetchall()
+        )
+    pauta.gravar(db)
+    return len(pauta.matriculas)
+
+
+@click.command('rebuild-boletins')
+@click.option('--turma', 'turma_id', type=int, help='Só esta turma.')
+@click.option('--ano', type=int, help='Só este ano lectivo (ex.: 2025).')
+def rebuild_boletins_command(turma_id, ano):
+    """Recalcular de raiz os boletins (médias, classificações e resultados)."""
+    db = get_db()
+    inicio = time.perf_counter()
+    if ano is not None:
+        anos = db.execute('SELECT id FROM AnoLectivo WHERE ano = ?', (ano,)).fetchall()
+        if not anos:
+            raise click.ClickException(f'Ano lectivo {ano} não existe.')
+    else:
+        anos = db.execute('SELECT id FROM AnoLectivo ORDER BY ano').fetchall()
+
+    if turma_id is not None:
+        lotes = [{'turma_id': turma_id}]
+    else:
+        # Uma transacção por ano lectivo para não prender o lock de escrita
+        lotes = [{'ano_lectivo_id': row[0]} for row in anos]
+    total = 0
+    for lote in lotes:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            total += recalcular(db, **lote)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    click.echo(f'{total} boletim(ns) recalculado(s) em {time.perf_counter() - inicio:.1f}s.')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_boletins_command)
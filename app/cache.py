@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache LRU em memória com expiração por tempo.
+
+    Uma geração, avançada a cada invalidação, evita que uma leitura
+    concorrente guarde um valor obtido antes de uma invalidação: ``put``
+    só aceita o valor se a geração lida com ``version`` antes da consulta
+    ainda for a actual. Uma única geração (e não uma por chave) mantém a
+    memória limitada a ``maxsize`` entradas; como as invalidações são
+    raras, recusar de vez em quando um ``put`` de outra chave é barato.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._geracao = 0
+        self._lock = threading.Lock()
+
+    def version(self, key):
+        return self._geracao
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, version):
+        with self._lock:
+            if version != self._geracao:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._geracao += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._geracao += 1
+            self._data.clear()
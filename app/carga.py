@@ -0,0 +1,241 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+
+from app.desempenho import ESCALAS, base_sintetica
+from app.sintetico import TRIMESTRE_ABERTO
+
+
+def _docencias(db):
+    """Disciplinas do último ano lectivo com professor e alunos activos."""
+    linhas = db.execute('''
+        SELECT td.id as turma_disciplina_id, td.turma_id, u.id as user_id
+        FROM TurmaDisciplinas td
+        JOIN Turmas t ON t.id = td.turma_id
+        JOIN Docencia doc ON doc.turma_disciplina_id = td.id AND doc.data_fim IS NULL
+        JOIN Usuarios u ON u.professor_id = doc.professor_id
+        WHERE t.ano_lectivo_id = (SELECT MAX(ano_lectivo_id) FROM Turmas)
+        ORDER BY td.id
+    ''').fetchall()
+    matriculas = {}
+    for turma_id in {l['turma_id'] for l in linhas}:
+        matriculas[turma_id] = [r[0] for r in db.execute(
+            "SELECT id FROM Matriculas WHERE turma_id = ? AND status = 'ativa'", (turma_id,)
+        )]
+    return [
+        (l['user_id'], l['turma_disciplina_id'], l['turma_id'], matriculas[l['turma_id']])
+        for l in linhas if matriculas[l['turma_id']]
+    ]
+
+
+def _classificar(erro):
+    if isinstance(erro, sqlite3.OperationalError):
+        mensagem = str(erro).lower()
+        if 'locked' in mensagem or 'busy' in mensagem:
+            return 'bloqueio'
+    return 'erro'
+
+
+class _Medidor:
+    """Latências por operação, erros e escritores em curso (partilhado pelas threads)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = {'gravar': [], 'consultar': []}
+        self.erros = {'bloqueio': 0, 'erro': 0, 'http': 0}
+        self.escritores = 0
+        self.amostras_fila = []
+
+    def medir(self, operacao, pedido):
+        escrita = operacao == 'gravar'
+        if escrita:
+            with self.lock:
+                self.escritores += 1
+        inicio = time.perf_counter()
+        tipo = None
+        try:
+            resposta = pedido()
+            resposta.get_data()
+            resposta.close()
+            if resposta.status_code not in (200, 302):
+                tipo = 'http'
+        except Exception as erro:
+            tipo = _classificar(erro)
+        duracao = (time.perf_counter() - inicio) * 1000
+        with self.lock:
+            if escrita:
+                self.escritores -= 1
+            if tipo is None:
+                self.latencias[operacao].append(duracao)
+            else:
+                self.erros[tipo] += 1
+
+    def amostrar(self, fim, intervalo=0.01):
+        # Escritores com pedido em curso: o que tem o lock mais os que esperam
+        while time.monotonic() < fim:
+            self.amostras_fila.append(self.escritores)
+            time.sleep(intervalo)
+
+
+def _processo(database, indice, professores, admins, segundos, pausa_ms, docencias, admin_id, seed,
+              escritor):
+    """Corre as threads de um processo e devolve as medições em bruto."""
+    from app import create_app
+    from app.db import fechar_pools
+    from app.escritor import metricas
+
+    app = create_app({
+        'TESTING': True, 'DATABASE': database, 'PASSWORD_HASH_WORKERS': 0, 'DB_ESCRITOR': escritor
+    })
+    medidor = _Medidor()
+    fim = time.monotonic() + segundos
+    turmas = sorted({turma_id for _, _, turma_id, _ in docencias})
+
+    def professor(n):
+        rng = random.Random(seed * 1000 + indice * 100 + n)
+        user_id, td, _, matriculas = docencias[(indice * professores + n) % len(docencias)]
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao['user_id'] = user_id
+        while time.monotonic() < fim:
+            dados = {'trimestre': str(TRIMESTRE_ABERTO)}
+            for m in matriculas:
+                dados[f'nota-{m}'] = str(rng.randint(0, 20))
+            medidor.medir('gravar', lambda: cliente.post(
+                f'/professor/turma_disciplina/{td}/notas/salvar', data=dados))
+            time.sleep(pausa_ms / 1000 * rng.random() * 2)
+
+    def admin(n):
+        rng = random.Random(seed * 1000 + indice * 100 + 50 + n)
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao['user_id'] = admin_id
+        while time.monotonic() < fim:
+            turma_id = rng.choice(turmas)
+            medidor.medir('consultar', lambda: cliente.get(
+                f'/admin/turma/{turma_id}/notas?trimestre={rng.randint(1, 3)}'))
+            time.sleep(pausa_ms / 1000 * rng.random() * 2)
+
+    threads = [threading.Thread(target=professor, args=(n,)) for n in range(professores)]
+    threads += [threading.Thread(target=admin, args=(n,)) for n in range(admins)]
+    threads.append(threading.Thread(target=medidor.amostrar, args=(fim,)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with app.app_context():
+        commits = metricas()['commits']
+        fechar_pools()
+    return medidor.latencias, medidor.erros, medidor.amostras_fila, commits
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+def executar(escala, seed, processos, professores, admins, segundos, pausa_ms, escritor=False):
+    """Simular o fecho de notas: professores a gravar e administradores a consultar."""
+    from app import create_app
+    from app.db import fechar_pools, get_db
+
+    origem = base_sintetica(escala, seed)
+    pasta = tempfile.mkdtemp(prefix='carga-')
+    database = os.path.join(pasta, 'app.sqlite')
+    shutil.copyfile(origem, database)
+    try:
+        app = create_app({'DATABASE': database})
+        with app.app_context():
+            docencias = [tuple(d) for d in _docencias(get_db())]
+            admin_id = get_db().execute(
+                "SELECT id FROM Usuarios WHERE papel = 'admin' ORDER BY id LIMIT 1"
+            ).fetchone()[0]
+        with app.app_context():
+            fechar_pools()
+
+        argumentos = [
+            (database, i, professores, admins, segundos, pausa_ms, docencias, admin_id, seed, escritor)
+            for i in range(processos)
+        ]
+        inicio = time.perf_counter()
+        if processos == 1:
+            resultados = [_processo(*argumentos[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=processos) as executor:
+                resultados = list(executor.map(_processo, *zip(*argumentos)))
+        duracao = time.perf_counter() - inicio
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    latencias = {'gravar': [], 'consultar': []}
+    erros = {'bloqueio': 0, 'erro': 0, 'http': 0}
+    fila = []
+    commits = 0
+    for lat, err, amostras, n in resultados:
+        commits += n
+        for operacao, valores in lat.items():
+            latencias[operacao].extend(valores)
+        for tipo, n in err.items():
+            erros[tipo] += n
+        fila.extend(amostras)
+
+    relatorio = {'segundos': duracao, 'operacoes': {}, 'erros': erros, 'commits_escritor': commits}
+    for operacao, valores in latencias.items():
+        valores.sort()
+        relatorio['operacoes'][operacao] = {
+            'total': len(valores),
+            'por_segundo': len(valores) / duracao,
+            'p50': _percentil(valores, 50),
+            'p90': _percentil(valores, 90),
+            'p99': _percentil(valores, 99),
+            'max': valores[-1] if valores else 0.0,
+        }
+    relatorio['fila_escrita'] = {
+        'media': sum(fila) / len(fila) if fila else 0.0,
+        'p99': _percentil(sorted(fila), 99),
+        'max': max(fila, default=0),
+    }
+    return relatorio
+
+
+@click.command('load-test')
+@click.option('--escala', type=click.Choice(list(ESCALAS)), default='pequena', show_default=True)
+@click.option('--seed', default=42, show_default=True)
+@click.option('--processos', default=1, show_default=True)
+@click.option('--professores', default=50, show_default=True, help='Threads de professores por processo.')
+@click.option('--admins', default=5, show_default=True, help='Threads de administradores por processo.')
+@click.option('--segundos', default=30.0, show_default=True)
+@click.option('--pausa', default=50, show_default=True, help='Pausa média entre pedidos, em ms.')
+@click.option('--escritor/--sem-escritor', default=False, show_default=True,
+              help='Gravar através da thread de escrita com commit em grupo (DB_ESCRITOR).')
+def load_test_command(escala, seed, processos, professores, admins, segundos, pausa, escritor):
+    """Cenário de fim de trimestre contra uma cópia da base sintética."""
+    if current_app.config['DB_JOURNAL_MODE'].upper() != 'WAL':
+        click.echo('Aviso: sem WAL as leituras bloqueiam durante as escritas.')
+    r = executar(escala, seed, processos, professores, admins, segundos, pausa, escritor)
+    click.echo(f'{processos} processo(s) x ({professores} professores + {admins} admins), {r["segundos"]:.1f}s')
+    click.echo(f'{"operação":<10} {"total":>7} {"/s":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for operacao, o in r['operacoes'].items():
+        click.echo(f'{operacao:<10} {o["total"]:>7} {o["por_segundo"]:>8.1f} {o["p50"]:>8.1f} '
+                   f'{o["p90"]:>8.1f} {o["p99"]:>8.1f} {o["max"]:>8.1f}')
+    e = r['erros']
+    click.echo(f'bloqueios (SQLITE_BUSY/locked): {e["bloqueio"]}, outros erros: {e["erro"]}, HTTP: {e["http"]}')
+    f = r['fila_escrita']
+    click.echo(f'escritores em curso por processo: média {f["media"]:.1f}, p99 {f["p99"]}, máximo {f["max"]}')
+    if escritor and r['commits_escritor']:
+        gravacoes = r['operacoes']['gravar']['total']
+        click.echo(f'commits do escritor: {r["commits_escritor"]} '
+                   f'({gravacoes / r["commits_escritor"]:.1f} gravações por commit)')
+
+
+def init_app(app):
+    app.cli.add_command(load_test_command)
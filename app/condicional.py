@@ -0,0 +1,141 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import current_app, g, request, session
+from werkzeug.http import is_resource_modified
+
+from app.cache import TTLCache
+
+
+def _base():
+    # Muda com os templates: depois de um deploy os ETags antigos deixam de servir
+    base = current_app.extensions.get('etag_base')
+    if base is None:
+        h = hashlib.sha1()
+        pasta = os.path.join(current_app.root_path, current_app.template_folder)
+        for raiz, pastas, ficheiros in os.walk(pasta):
+            pastas.sort()
+            for nome in sorted(ficheiros):
+                with open(os.path.join(raiz, nome), 'rb') as f:
+                    h.update(nome.encode())
+                    h.update(f.read())
+        base = current_app.extensions.setdefault('etag_base', h.hexdigest()[:8])
+    return base
+
+
+def versao_anuncios(db):
+    """Impressão digital e data da última publicação dos anúncios."""
+    contador, maximo, publicado = db.execute('''
+        SELECT
+            (SELECT valor FROM Contadores WHERE nome = 'anuncios'),
+            (SELECT MAX(id) FROM Anuncios),
+            (SELECT MAX(data_publicacao) FROM Anuncios)
+    ''').fetchone()
+    if publicado is not None:
+        publicado = datetime.fromisoformat(publicado).replace(tzinfo=timezone.utc)
+    return ('anuncios', contador, maximo), publicado
+
+
+def versao_notas_disciplina(db, turma_disciplina_id, trimestre):
+    return tuple(db.execute('''
+        SELECT
+            (SELECT valor FROM Contadores WHERE nome = 'turmas'),
+            (SELECT valor FROM Contadores WHERE nome = 'referencia'),
+            (SELECT MAX(versao) FROM NotasTrimestrais
+             WHERE turma_disciplina_id = ? AND trimestre = ?),
+            (SELECT MAX(versao) FROM NotasTrimestraisRemovidas
+             WHERE turma_disciplina_id = ? AND trimestre = ?),
+            -- Com avaliações a grelha passa a só de leitura
+            (SELECT COUNT(*) FROM Avaliacoes
+             WHERE turma_disciplina_id = ? AND trimestre = ?)
+    ''', (turma_disciplina_id, trimestre) * 3).fetchone())
+
+
+def versao_notas_turma(db, turma_id, trimestre):
+    # Um MAX por disciplina: cada um é uma só procura no índice
+    return tuple(db.execute('''
+        SELECT
+            (SELECT valor FROM Contadores WHERE nome = 'turmas'),
+            (SELECT valor FROM Contadores WHERE nome = 'referencia'),
+            (SELECT MAX((SELECT MAX(versao) FROM NotasTrimestrais n
+                         WHERE n.turma_disciplina_id = td.id AND n.trimestre = ?))
+             FROM TurmaDisciplinas td WHERE td.turma_id = ?),
+            (SELECT MAX((SELECT MAX(versao) FROM NotasTrimestraisRemovidas r
+                         WHERE r.turma_disciplina_id = td.id AND r.trimestre = ?))
+             FROM TurmaDisciplinas td WHERE td.turma_id = ?)
+    ''', (trimestre, turma_id, trimestre, turma_id)).fetchone())
+
+
+def nao_modificado(versao, modificado=None):
+    """Preparar o ETag do pedido e devolver 304 se o cliente já tem esta versão.
+
+    ``versao`` identifica os dados mostrados; o utilizador e o formato
+    (HTML ou JSON) entram no ETag. Pedidos com mensagens flash por
+    mostrar não são condicionais. Os cabeçalhos são postos em
+    ``adicionar_cabecalhos``.
+    """
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+    utilizador = g.user['id'] if g.user is not None else None
+    etag = hashlib.sha1(repr((
+        _base(), request.path, request.args.get('formato'), utilizador, versao
+    )).encode()).hexdigest()[:20]
+    g.etag = (etag, modificado)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modificado):
+        return current_app.response_class(status=304)
+    return None
+
+
+def adicionar_cabecalhos(response):
+    condicional = g.get('etag')
+    if condicional is None or response.status_code not in (200, 304):
+        return response
+    etag, modificado = condicional
+    response.set_etag(etag, weak=True)
+    if modificado is not None:
+        response.last_modified = modificado
+    # O cliente guarda a página mas tem de revalidar sempre
+    response.cache_control.no_cache = True
+    if g.user is not None:
+        response.cache_control.private = True
+    response.vary.add('Cookie')
+    return response
+
+
+def _paginas():
+    cache = current_app.extensions.get('paginas_anonimas')
+    if cache is None:
+        cache = current_app.extensions.setdefault('paginas_anonimas', TTLCache(
+            maxsize=current_app.config['CACHE_PAGINAS_ANONIMAS'],
+            ttl=current_app.config['CACHE_PAGINAS_ANONIMAS_TTL']
+        ))
+    return cache
+
+
+def pagina_anonima(gerar):
+    """HTML de uma página pública, partilhado entre visitantes anónimos.
+
+    A chave inclui o ETag do pedido, por isso uma alteração noutro worker
+    muda a chave; ``limpar_paginas`` liberta já as entradas deste worker.
+    """
+    condicional = g.get('etag')
+    if g.user is not None or condicional is None or not current_app.config['CACHE_PAGINAS_ANONIMAS']:
+        return gerar()
+    cache = _paginas()
+    chave = (request.full_path, condicional[0])
+    corpo = cache.get(chave)
+    if corpo is None:
+        versao = cache.version(chave)
+        corpo = gerar()
+        cache.put(chave, corpo, versao)
+    return corpo
+
+
+def limpar_paginas():
+    if current_app.config['CACHE_PAGINAS_ANONIMAS']:
+        _paginas().clear()
+
+
+def init_app(app):
+    app.after_request(adicionar_cabecalhos)
@@ -1,21 +1,201 @@
+import os
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import urllib.parse
 import click
-from flask import current_app, g
+from flask import current_app, g, request
+
+from app.perfil import instrumentar
+
+
+class ConnectionPool:
+    """Conexões SQLite reutilizáveis de um worker (processo).
+
+    Com ``leitura=True`` as conexões abrem o ficheiro com ``mode=ro`` e
+    ``query_only``; ``autorizador`` é instalado em cada conexão nova.
+    """
+
+    def __init__(self, database, size, pragmas, cached_statements=128, leitura=False,
+                 autorizador=None):
+        self.database = database
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self.leitura = leitura
+        self.autorizador = autorizador
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        destino = self.database
+        if self.leitura:
+            destino = 'file:{}?mode=ro'.format(urllib.parse.quote(os.path.abspath(self.database)))
+        # Sem detect_types: as datas ficam em texto e o repositório só as
+        # converte quando uma coluna é lida
+        conn = sqlite3.connect(
+            destino,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            uri=self.leitura
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.autorizador is not None:
+            conn.set_authorizer(self.autorizador)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        # Nunca devolver ao pool uma conexão com transacção pendente
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pragmas(config, leitura=False):
+    pragmas = [
+        ('busy_timeout', int(config['DB_BUSY_TIMEOUT'])),
+        ('cache_size', int(config['DB_CACHE_SIZE'])),
+        ('mmap_size', int(config['DB_MMAP_SIZE'])),
+    ]
+    if leitura:
+        return pragmas + [('query_only', 'ON')]
+    # journal_mode é persistente no ficheiro, mas repetir é barato
+    return [
+        ('journal_mode', config['DB_JOURNAL_MODE']),
+        ('synchronous', config['DB_SYNCHRONOUS']),
+        ('foreign_keys', 'ON'),
+    ] + pragmas
+
+
+# Acções do autorizador que alteram a base (ver sqlite3.SQLITE_*)
+_ESCRITAS = {
+    sqlite3.SQLITE_INSERT: 'INSERT', sqlite3.SQLITE_UPDATE: 'UPDATE', sqlite3.SQLITE_DELETE: 'DELETE',
+    sqlite3.SQLITE_CREATE_TABLE: 'CREATE TABLE', sqlite3.SQLITE_CREATE_INDEX: 'CREATE INDEX',
+    sqlite3.SQLITE_CREATE_TRIGGER: 'CREATE TRIGGER', sqlite3.SQLITE_CREATE_VIEW: 'CREATE VIEW',
+    sqlite3.SQLITE_DROP_TABLE: 'DROP TABLE', sqlite3.SQLITE_DROP_INDEX: 'DROP INDEX',
+    sqlite3.SQLITE_DROP_TRIGGER: 'DROP TRIGGER', sqlite3.SQLITE_DROP_VIEW: 'DROP VIEW',
+    sqlite3.SQLITE_ALTER_TABLE: 'ALTER TABLE',
+}
+
+
+# O primeiro uso de uma tabela virtual epónima (json_each, json_tree) numa
+# conexão regista-a com um UPDATE interno do esquema, que não é escrita
+_ESQUEMA = {'sqlite_master', 'sqlite_temp_master', 'sqlite_schema', 'sqlite_temp_schema'}
+
+
+def _verificar_leitura(accao, arg1, arg2, nome_db, origem):
+    """Autorizador das conexões só de leitura com DB_LEITURA_VERIFICAR."""
+    if accao not in _ESCRITAS or nome_db == 'temp':
+        return sqlite3.SQLITE_OK
+    if accao == sqlite3.SQLITE_UPDATE and arg1 in _ESQUEMA:
+        return sqlite3.SQLITE_OK
+    vista = request.endpoint if request else None
+    current_app.logger.error(
+        'Escrita (%s %s) numa vista só de leitura: %s %s', _ESCRITAS[accao], arg1,
+        request.method if request else '-', vista
+    )
+    g.setdefault('escritas_bloqueadas', []).append((_ESCRITAS[accao], arg1))
+    return sqlite3.SQLITE_DENY
+
+
+def get_pool(leitura=False):
+    config = current_app.config
+    # Pools são por processo: conexões SQLite não sobrevivem a um fork
+    key = (os.getpid(), config['DATABASE'], leitura)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    config['DATABASE'],
+                    int(config['DB_POOL_SIZE']),
+                    _pragmas(config, leitura),
+                    int(config['DB_CACHED_STATEMENTS']),
+                    leitura=leitura,
+                    autorizador=_verificar_leitura if leitura and config['DB_LEITURA_VERIFICAR'] else None
+                )
+                _pools[key] = pool
+    return pool
+
+
+def fechar_pools():
+    """Fechar as conexões livres de todos os pools deste processo e base."""
+    chave = (os.getpid(), current_app.config['DATABASE'])
+    for key, pool in list(_pools.items()):
+        if key[:2] == chave:
+            pool.close_all()
+
+
+def _so_leitura():
+    # Só pedidos com método seguro; comandos CLI e escritas usam o pool normal
+    return (
+        current_app.config['DB_LEITURA_SEPARADA']
+        and request
+        and request.method in ('GET', 'HEAD', 'OPTIONS')
+    )
+
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        leitura = bool(_so_leitura())
+        db = get_pool(leitura).acquire()
+        if leitura:
+            # Um snapshot WAL para todo o pedido: as consultas da vista vêem
+            # o mesmo estado e nunca esperam pelas transacções de escrita
+            db.execute('BEGIN')
+        g.db_leitura = leitura
+        if current_app.config['SQL_PROFILE']:
+            db = instrumentar(db)
+        g.db = db
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        # Com SQL_PROFILE activo g.db é um invólucro da conexão do pool
+        get_pool(g.pop('db_leitura', False)).release(getattr(db, 'conexao', db))
+
+
+def incrementar_contador(db, nome, n=1):
+    """Avançar um contador da tabela Contadores e devolver o novo valor.
+
+    Deve ser chamado dentro da transacção de escrita que o justifica.
+    """
+    db.execute(
+        '''
+        INSERT INTO Contadores (nome, valor) VALUES (?, ?)
+        ON CONFLICT(nome) DO UPDATE SET valor = valor + excluded.valor
+        ''',
+        (nome, n)
+    )
+    return db.execute('SELECT valor FROM Contadores WHERE nome = ?', (nome,)).fetchone()[0]
+
+
+def ler_contador(db, nome):
+    row = db.execute('SELECT valor FROM Contadores WHERE nome = ?', (nome,)).fetchone()
+    return row[0] if row is not None else 0
 
 
 def init_db():
@@ -24,6 +204,10 @@ def init_db():
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    # schema.sql já inclui o efeito de todas as migrações
+    from app.migrar import marcar_aplicadas
+    marcar_aplicadas(db)
+
 
 @click.command('init-db')
 def init_db_command():
@@ -32,10 +216,6 @@ def init_db_command():
     click.echo('Banco de dados inicializado.')
 
 
-sqlite3.register_converter(
-    "timestamp", lambda v: datetime.fromisoformat(v.decode())
-)
-
 def init_app(app):
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    app.cli.add_command(init_db_command)
@@ -0,0 +1,311 @@
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import click
+from flask import appcontext_tearing_down, current_app, g
+
+from app.sintetico import TRIMESTRE_ABERTO
+
+# Parâmetros de seed-synthetic para cada escala
+ESCALAS = {
+    'pequena': dict(escolas=1, anos=2, cursos=2, disciplinas_por_classe=6, turmas_por_classe=2,
+                    alunos_por_turma=30, professores=20, avaliacoes=1, aulas=2, pendentes=20),
+    'media': dict(escolas=1, anos=3, cursos=4, disciplinas_por_classe=8, turmas_por_classe=3,
+                  alunos_por_turma=40, professores=60, avaliacoes=2, aulas=6, pendentes=50),
+    'grande': dict(escolas=4, anos=3, cursos=4, disciplinas_por_classe=10, turmas_por_classe=4,
+                   alunos_por_turma=45, professores=80, avaliacoes=2, aulas=8, pendentes=100),
+}
+
+
+def base_sintetica(escala, seed):
+    """Caminho de uma base sintética de referência, gerada só na primeira vez."""
+    from app import create_app
+    from app.db import fechar_pools, get_db, init_db
+    from app.sintetico import gerar
+
+    # O nome inclui um resumo do esquema e do gerador: alterar schema.sql
+    # ou sintetico.py gera uma base nova
+    resumo = hashlib.sha1()
+    for recurso in ('schema.sql', 'sintetico.py'):
+        with current_app.open_resource(recurso) as f:
+            resumo.update(f.read())
+    esquema = resumo.hexdigest()[:10]
+    destino = os.path.join(current_app.instance_path, 'bench', f'{escala}-{seed}-{esquema}.sqlite')
+    if os.path.exists(destino):
+        return destino
+
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporario = destino + '.tmp'
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    app = create_app({'DATABASE': temporario, 'PASSWORD_HASH_WORKERS': 0})
+    with app.app_context():
+        init_db()
+        gerar(ano_inicial=2025, anuncios=200, seed=seed, lote=50000, **ESCALAS[escala])
+        # Uma só cópia do ficheiro, sem -wal pendente
+        get_db().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    with app.app_context():
+        fechar_pools()
+    os.replace(temporario, destino)
+    return destino
+
+
+def contexto(db):
+    """Ids usados pelos cenários: a primeira turma com alunos do último ano lectivo."""
+    turma_id = db.execute('''
+        SELECT t.id
+        FROM Turmas t
+        JOIN AnoLectivo a ON a.id = t.ano_lectivo_id
+        WHERE EXISTS (SELECT 1 FROM Matriculas m WHERE m.turma_id = t.id AND m.status = 'ativa')
+        ORDER BY a.ano DESC, t.id
+        LIMIT 1
+    ''').fetchone()[0]
+    doc = db.execute('''
+        SELECT td.id as turma_disciplina_id, u.id as user_id
+        FROM TurmaDisciplinas td
+        JOIN Docencia doc ON doc.turma_disciplina_id = td.id AND doc.data_fim IS NULL
+        JOIN Usuarios u ON u.professor_id = doc.professor_id
+        WHERE td.turma_id = ?
+        ORDER BY td.id
+        LIMIT 1
+    ''', (turma_id,)).fetchone()
+    admin = db.execute("SELECT id FROM Usuarios WHERE papel = 'admin' ORDER BY id DESC LIMIT 1").fetchone()
+    matriculas = [r[0] for r in db.execute(
+        "SELECT id FROM Matriculas WHERE turma_id = ? AND status = 'ativa' ORDER BY id", (turma_id,)
+    )]
+    tds = [r[0] for r in db.execute(
+        'SELECT id FROM TurmaDisciplinas WHERE turma_id = ? ORDER BY id', (turma_id,)
+    )]
+    aula = db.execute(
+        'SELECT id FROM Aulas WHERE turma_disciplina_id = ? ORDER BY data DESC LIMIT 1',
+        (doc['turma_disciplina_id'],)
+    ).fetchone()
+    return {
+        'turma_id': turma_id,
+        'turma_disciplina_id': doc['turma_disciplina_id'],
+        'aula_id': aula[0],
+        'professor_user_id': doc['user_id'],
+        'admin_user_id': admin[0],
+        'matriculas': matriculas,
+        'turma_disciplinas': tds,
+    }
+
+
+def _nota(ronda, i):
+    # Alternar os valores entre rondas para cada gravação alterar linhas
+    return f'{(ronda * 7 + i) % 21}'
+
+
+def _cenarios(ctx):
+    """Pares (nome, utilizador, função(cliente, ronda)) de cada cenário."""
+    prof = ctx['professor_user_id']
+    admin = ctx['admin_user_id']
+    turma = ctx['turma_id']
+    td = ctx['turma_disciplina_id']
+
+    def form_professor(ronda):
+        dados = {'trimestre': str(TRIMESTRE_ABERTO)}
+        for i, m in enumerate(ctx['matriculas']):
+            dados[f'nota-{m}'] = _nota(ronda, i)
+        return dados
+
+    def form_turma(ronda):
+        dados = {'trimestre': str(TRIMESTRE_ABERTO)}
+        for i, m in enumerate(ctx['matriculas']):
+            for j, t in enumerate(ctx['turma_disciplinas']):
+                dados[f'nota-{m}-{t}'] = _nota(ronda, i + j)
+        return dados
+
+    def chamada(ronda):
+        # Um aluno em cada cinco falta, a rodar entre rondas
+        return {
+            f'estado-{m}': 'falta'
+            for i, m in enumerate(ctx['matriculas']) if (ronda + i) % 5 == 0
+        }
+
+    return [
+        ('professor.index', prof, lambda c, r: c.get('/professor/')),
+        ('professor.notas_disciplina', prof,
+         lambda c, r: c.get(f'/professor/turma_disciplina/{td}/notas?trimestre=1')),
+        ('admin.notas_turma', admin, lambda c, r: c.get(f'/admin/turma/{turma}/notas?trimestre=1')),
+        ('admin.turma_detalhes', admin, lambda c, r: c.get(f'/admin/turma/{turma}')),
+        ('admin.docencia_turma', admin, lambda c, r: c.get(f'/admin/turma/{turma}/docencia')),
+        ('admin.aprovar_alunos', admin, lambda c, r: c.get('/admin/aprovar_alunos')),
+        ('professor.salvar_notas_disciplina', prof,
+         lambda c, r: c.post(f'/professor/turma_disciplina/{td}/notas/salvar', data=form_professor(r))),
+        ('admin.salvar_notas_turma', admin,
+         lambda c, r: c.post(f'/admin/turma/{turma}/notas/salvar', data=form_turma(r))),
+        ('professor.chamada_aula', prof,
+         lambda c, r: c.post(f'/professor/aula/{ctx["aula_id"]}/chamada', data=chamada(r))),
+    ]
+
+
+def _estatisticas(valores):
+    return {
+        'min': min(valores),
+        'max': max(valores),
+        'media': statistics.fmean(valores),
+        'mediana': statistics.median(valores),
+        'desvio': statistics.pstdev(valores),
+    }
+
+
+def executar(escala, seed, rondas, aquecimento, filtro=None):
+    """Medir cada cenário contra uma cópia da base sintética.
+
+    Cada pedido passa pela vista real com SQL_PROFILE activo; além do tempo
+    total regista-se o tempo em SQL, o número de instruções e as linhas lidas.
+    """
+    from app import create_app
+    from app.db import fechar_pools, get_db
+
+    origem = base_sintetica(escala, seed)
+    pasta = tempfile.mkdtemp(prefix='bench-')
+    database = os.path.join(pasta, 'app.sqlite')
+    shutil.copyfile(origem, database)
+
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': database,
+        'SQL_PROFILE': True,
+        'SQL_PROFILE_LOG': None,
+        'SQL_SLOW_MS': float('inf'),
+        'PASSWORD_HASH_WORKERS': 0,
+    })
+
+    perfis = []
+
+    def recolher(sender, **extra):
+        perfil = g.get('sql_perfil')
+        if perfil is not None:
+            perfis.append(perfil)
+
+    resultados = {}
+    appcontext_tearing_down.connect(recolher, app)
+    try:
+        with app.app_context():
+            ctx = contexto(get_db())
+        for nome, user_id, pedido in _cenarios(ctx):
+            if filtro and filtro not in nome:
+                continue
+            cliente = app.test_client()
+            with cliente.session_transaction() as sessao:
+                sessao['user_id'] = user_id
+
+            amostras = {'ms': [], 'sql_ms': [], 'instrucoes': [], 'linhas': []}
+            for ronda in range(aquecimento + rondas):
+                perfis.clear()
+                inicio = time.perf_counter()
+                resposta = pedido(cliente, ronda)
+                resposta.get_data()
+                duracao = (time.perf_counter() - inicio) * 1000
+                resposta.close()
+                if resposta.status_code not in (200, 302):
+                    raise click.ClickException(f'{nome}: HTTP {resposta.status_code}')
+                if ronda < aquecimento:
+                    continue
+                amostras['ms'].append(duracao)
+                amostras['sql_ms'].append(sum(p['ms'] for p in perfis))
+                amostras['instrucoes'].append(sum(p['instrucoes'] for p in perfis))
+                amostras['linhas'].append(sum(p['linhas'] for p in perfis))
+
+            resultados[nome] = {
+                'rondas': rondas,
+                'ms': _estatisticas(amostras['ms']),
+                'sql_ms': _estatisticas(amostras['sql_ms']),
+                'instrucoes': max(amostras['instrucoes']),
+                'linhas': max(amostras['linhas']),
+            }
+    finally:
+        appcontext_tearing_down.disconnect(recolher, app)
+        with app.app_context():
+            fechar_pools()
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    return {
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'escala': escala,
+        'seed': seed,
+        'python': platform.python_version(),
+        'maquina': platform.machine(),
+        'benchmarks': resultados,
+    }
+
+
+def comparar(base, novo, metrica, limiar):
+    """Linhas (nome, antes, depois, razão, regressão) dos cenários comuns.
+
+    Há regressão quando a mediana da métrica cresce mais que ``limiar``
+    ou quando o cenário passa a executar mais instruções SQL.
+    """
+    linhas = []
+    for nome, depois in novo['benchmarks'].items():
+        antes = base['benchmarks'].get(nome)
+        if antes is None:
+            continue
+        a = antes[metrica]['mediana']
+        d = depois[metrica]['mediana']
+        razao = d / a if a else float('inf') if d else 1.0
+        regressao = razao > 1 + limiar or depois['instrucoes'] > antes['instrucoes']
+        linhas.append((nome, antes, depois, razao, regressao))
+    return linhas
+
+
+@click.group('bench')
+def bench_command():
+    """Medir o acesso a dados das vistas principais."""
+
+
+@bench_command.command('run')
+@click.option('--escala', type=click.Choice(list(ESCALAS)), default='pequena', show_default=True)
+@click.option('--seed', default=42, show_default=True)
+@click.option('--rondas', default=20, show_default=True)
+@click.option('--aquecimento', default=3, show_default=True)
+@click.option('--filtro', help='Só cenários cujo nome contém este texto.')
+@click.option('--saida', type=click.Path(dir_okay=False), help='Gravar os resultados neste ficheiro JSON.')
+def bench_run_command(escala, seed, rondas, aquecimento, filtro, saida):
+    """Correr os cenários e mostrar (ou gravar) os resultados."""
+    resultado = executar(escala, seed, rondas, aquecimento, filtro)
+    click.echo(f'{"cenário":<36} {"mediana ms":>11} {"sql ms":>9} {"instr.":>7} {"linhas":>8}')
+    for nome, r in resultado['benchmarks'].items():
+        click.echo(f'{nome:<36} {r["ms"]["mediana"]:>11.2f} {r["sql_ms"]["mediana"]:>9.2f} '
+                   f'{r["instrucoes"]:>7} {r["linhas"]:>8}')
+    if saida:
+        with open(saida, 'w', encoding='utf8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        click.echo(f'Resultados gravados em {saida}.')
+
+
+@bench_command.command('compare')
+@click.argument('base', type=click.File(encoding='utf8'))
+@click.argument('novo', type=click.File(encoding='utf8'))
+@click.option('--metrica', type=click.Choice(['ms', 'sql_ms']), default='sql_ms', show_default=True)
+@click.option('--limiar', default=0.25, show_default=True, help='Aumento relativo tolerado (0.25 = 25%).')
+def bench_compare_command(base, novo, metrica, limiar):
+    """Comparar dois ficheiros de resultados; falha se houver regressões."""
+    base = json.load(base)
+    novo = json.load(novo)
+    if (base['escala'], base['seed']) != (novo['escala'], novo['seed']):
+        raise click.ClickException('Os resultados foram medidos com escalas ou sementes diferentes.')
+
+    regressoes = 0
+    click.echo(f'{"cenário":<36} {"antes":>9} {"depois":>9} {"razão":>7}  instr.')
+    for nome, antes, depois, razao, regressao in comparar(base, novo, metrica, limiar):
+        regressoes += regressao
+        click.echo(
+            f'{nome:<36} {antes[metrica]["mediana"]:>9.2f} {depois[metrica]["mediana"]:>9.2f} '
+            f'{razao:>7.2f}  {antes["instrucoes"]} -> {depois["instrucoes"]}'
+            + ('  REGRESSÃO' if regressao else '')
+        )
+    if regressoes:
+        raise click.ClickException(f'{regressoes} cenário(s) com regressão (limiar {limiar:.0%}).')
+
+
+def init_app(app):
+    app.cli.add_command(bench_command)
@@ -0,0 +1,141 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from app.db import get_pool
+
+_escritores = {}
+_escritores_lock = threading.Lock()
+
+
+class Escritor:
+    """Thread única de escrita de um worker, com commit em grupo.
+
+    Os pedidos entregam funções ``funcao(db)`` que fazem as suas escritas
+    sem commit. A thread junta as que estiverem em fila numa só
+    transacção, cada uma dentro do seu SAVEPOINT: um erro desfaz só a
+    função que falhou e o resto do lote é gravado com um único commit.
+    """
+
+    def __init__(self, conexao, lote, janela):
+        self.conexao = conexao
+        self.lote = lote
+        self.janela = janela
+        self.fila = queue.Queue()
+        self.pedidos = 0
+        self.commits = 0
+        self.maior_lote = 0
+        self.thread = threading.Thread(target=self._correr, name='escritor-sqlite', daemon=True)
+        self.thread.start()
+
+    def submeter(self, funcao):
+        futuro = Future()
+        self.fila.put((funcao, futuro))
+        return futuro
+
+    def _recolher(self):
+        lote = [self.fila.get()]
+        limite = time.monotonic() + self.janela
+        while len(lote) < self.lote:
+            try:
+                if self.janela:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    lote.append(self.fila.get(timeout=restante))
+                else:
+                    lote.append(self.fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _correr(self):
+        while True:
+            lote = self._recolher()
+            try:
+                self._gravar(lote)
+            except Exception as erro:
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(erro)
+
+    def _gravar(self, lote):
+        db = self.conexao
+        resultados = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for funcao, futuro in lote:
+                db.execute('SAVEPOINT pedido')
+                try:
+                    resultado = funcao(db)
+                except Exception as erro:
+                    db.execute('ROLLBACK TO pedido')
+                    db.execute('RELEASE pedido')
+                    resultados.append((futuro, None, erro))
+                else:
+                    db.execute('RELEASE pedido')
+                    resultados.append((futuro, resultado, None))
+            db.commit()
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+        self.pedidos += len(lote)
+        self.commits += 1
+        self.maior_lote = max(self.maior_lote, len(lote))
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+
+def get_escritor():
+    config = current_app.config
+    # Um escritor por processo, como o pool de conexões
+    chave = (os.getpid(), config['DATABASE'])
+    escritor = _escritores.get(chave)
+    if escritor is None:
+        with _escritores_lock:
+            escritor = _escritores.get(chave)
+            if escritor is None:
+                # Conexão própria retirada do pool; nunca é devolvida
+                escritor = _escritores[chave] = Escritor(
+                    get_pool().acquire(),
+                    int(config['DB_ESCRITOR_LOTE']),
+                    config['DB_ESCRITOR_JANELA_MS'] / 1000
+                )
+    return escritor
+
+
+def transaccao(db, funcao):
+    """Executar ``funcao(db)`` numa transacção de escrita e devolver o resultado.
+
+    Com ``DB_ESCRITOR`` activo a função corre na thread de escrita do
+    worker, junto com as dos outros pedidos; senão corre em ``db`` com
+    BEGIN IMMEDIATE. Em ambos os casos não deve fazer commit nem
+    rollback, e as excepções que levanta chegam a quem chamou.
+    """
+    if current_app.config['DB_ESCRITOR']:
+        return get_escritor().submeter(funcao).result()
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        resultado = funcao(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return resultado
+
+
+def metricas():
+    escritor = _escritores.get((os.getpid(), current_app.config['DATABASE']))
+    if escritor is None:
+        return {'pedidos': 0, 'commits': 0, 'maior_lote': 0}
+    return {'pedidos': escritor.pedidos, 'commits': escritor.commits, 'maior_lote': escritor.maior_lote}
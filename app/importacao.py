@@ -0,0 +1,456 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import secrets
+import time
+from datetime import date, datetime
+
+import click
+from flask import current_app
+
+from app.db import get_db
+from app.escritor import transaccao
+from app.senhas import gerar_hashes
+
+CAMPOS = (
+    'nome', 'data_nascimento', 'email', 'telefone', 'endereco', 'numero_bilhete', 'genero',
+    'nome_pai', 'nome_mae', 'telefone_encarregado', 'curso_preferido_id', 'ano_preferido',
+    'username', 'password'
+)
+OBRIGATORIOS = ('nome', 'data_nascimento', 'email', 'numero_bilhete')
+
+# Nomes de coluna alternativos aceites no cabeçalho
+SINONIMOS = {
+    'curso': 'curso_preferido_id',
+    'classe': 'ano_preferido',
+    'bilhete': 'numero_bilhete',
+    'bi': 'numero_bilhete',
+    'data_de_nascimento': 'data_nascimento',
+}
+
+
+class ErroImportacao(Exception):
+    """Ficheiro que não pode ser importado (formato ou cabeçalho)."""
+
+
+def pasta():
+    caminho = os.path.join(current_app.instance_path, 'importacoes')
+    os.makedirs(caminho, exist_ok=True)
+    return caminho
+
+
+def checksum(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _coluna(nome):
+    nome = str(nome or '').strip().lower().replace(' ', '_').replace('-', '_')
+    return SINONIMOS.get(nome, nome)
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.date().isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    # Folhas de cálculo guardam bilhetes e telefones como números
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor).strip()
+
+
+def _linhas_csv(caminho):
+    with open(caminho, encoding='utf-8-sig', newline='') as f:
+        amostra = f.read(8192)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(amostra, delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        leitor = csv.reader(f, dialecto)
+        yield from leitor
+
+
+def _linhas_xlsx(caminho):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ErroImportacao('Para importar .xlsx instale o pacote openpyxl (ou exporte a folha para CSV).')
+    livro = openpyxl.load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        yield from livro.active.iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+
+def ler_ficheiro(caminho):
+    """Validar o cabeçalho e devolver as linhas ``(numero, campos)`` do ficheiro.
+
+    As linhas são lidas à medida que são pedidas; ``numero`` conta as
+    linhas de dados a partir de 1 (sem o cabeçalho).
+    """
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao == '.xlsx':
+        linhas = _linhas_xlsx(caminho)
+    elif extensao in ('.csv', '.txt'):
+        linhas = _linhas_csv(caminho)
+    else:
+        raise ErroImportacao('Formato não suportado: use .csv ou .xlsx.')
+
+    cabecalho = next(linhas, None)
+    if cabecalho is None:
+        raise ErroImportacao('Ficheiro vazio.')
+    colunas = [_coluna(c) for c in cabecalho]
+    em_falta = [c for c in OBRIGATORIOS if c not in colunas]
+    if em_falta:
+        raise ErroImportacao('Colunas obrigatórias em falta: {}.'.format(', '.join(em_falta)))
+    return _dados(colunas, linhas)
+
+
+def _dados(colunas, linhas):
+    numero = 0
+    for valores in linhas:
+        if valores is None or all(_texto(v) == '' for v in valores):
+            continue
+        numero += 1
+        yield numero, {
+            coluna: _texto(valor)
+            for coluna, valor in zip(colunas, valores) if coluna in CAMPOS
+        }
+
+
+def _data(texto):
+    for formato in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def _validar(campos, cursos):
+    """Normalizar uma linha; devolve ``(aluno, motivo)`` com um deles ``None``."""
+    for campo in OBRIGATORIOS:
+        if not campos.get(campo):
+            return None, f'Campo obrigatório vazio: {campo}.'
+
+    aluno = {campo: campos.get(campo) or None for campo in CAMPOS}
+    aluno['email'] = campos['email'].lower()
+    aluno['numero_bilhete'] = campos['numero_bilhete'].upper()
+    aluno['username'] = campos.get('username') or aluno['email']
+
+    aluno['data_nascimento'] = _data(campos['data_nascimento'])
+    if aluno['data_nascimento'] is None:
+        return None, 'Data de nascimento inválida (use AAAA-MM-DD ou DD/MM/AAAA).'
+
+    genero = campos.get('genero')
+    if genero:
+        genero = {'m': 'M', 'f': 'F', 'outro': 'Outro'}.get(genero.lower())
+        if genero is None:
+            return None, 'Género inválido (use M, F ou Outro).'
+    aluno['genero'] = genero
+
+    curso = campos.get('curso_preferido_id')
+    if curso:
+        curso_id = cursos.get(curso.lower())
+        if curso_id is None:
+            return None, f'Curso desconhecido: {curso}.'
+        aluno['curso_preferido_id'] = curso_id
+
+    ano = campos.get('ano_preferido')
+    if ano:
+        try:
+            aluno['ano_preferido'] = int(ano)
+        except ValueError:
+            aluno['ano_preferido'] = 0
+        if not 1 <= aluno['ano_preferido'] <= 13:
+            return None, 'Classe inválida.'
+    return aluno, None
+
+
+def _existentes(db, alunos):
+    """Emails, bilhetes e usernames do lote que já existem na base.
+
+    Três consultas por lote, cada uma com todos os valores num só
+    parâmetro JSON e resolvida por índices. Os emails do lote já vêm em
+    minúsculas e comparam com ``lower(email)``, para ``Ana@X.ao`` já
+    registado travar ``ana@x.ao``.
+    """
+    def valores(campo):
+        return json.dumps([a[campo] for a in alunos])
+
+    emails = {r[0] for r in db.execute('''
+        SELECT lower(email) FROM Alunos WHERE lower(email) IN (SELECT value FROM json_each(?))
+        UNION
+        SELECT lower(email) FROM Usuarios WHERE lower(email) IN (SELECT value FROM json_each(?))
+    ''', (valores('email'), valores('email')))}
+    bilhetes = {r[0] for r in db.execute(
+        'SELECT numero_bilhete FROM Alunos WHERE numero_bilhete IN (SELECT value FROM json_each(?))',
+        (valores('numero_bilhete'),)
+    )}
+    usernames = {r[0] for r in db.execute(
+        'SELECT username FROM Usuarios WHERE username IN (SELECT value FROM json_each(?))',
+        (valores('username'),)
+    )}
+    return emails, bilhetes, usernames
+
+
+def _duplicado(aluno, emails, bilhetes, usernames):
+    if aluno['email'] in emails:
+        return 'Email já registado.'
+    if aluno['numero_bilhete'] in bilhetes:
+        return 'Número do bilhete já registado.'
+    if aluno['username'] in usernames:
+        return 'Username já registado.'
+    return None
+
+
+def _separar(db, lote):
+    """Retirar do lote as linhas que já existem na base."""
+    existentes = _existentes(db, [aluno for _, aluno, _ in lote])
+    novos, rejeitadas = [], []
+    for numero, aluno, campos in lote:
+        motivo = _duplicado(aluno, *existentes)
+        if motivo is None:
+            novos.append((numero, aluno, campos))
+        else:
+            rejeitadas.append((numero, motivo, campos))
+    return novos, rejeitadas
+
+
+def _sem_password(campos):
+    # O relatório de rejeições fica na base: não guardar passwords em claro
+    return {campo: valor for campo, valor in campos.items() if campo != 'password'}
+
+
+def _registo(db, caminho, nome, status, admin_id):
+    soma = checksum(caminho)
+    registo = db.execute('SELECT * FROM Importacoes WHERE checksum = ?', (soma,)).fetchone()
+    if registo is None:
+        db.execute(
+            'INSERT INTO Importacoes (checksum, ficheiro, status_usuarios, admin_id) VALUES (?, ?, ?, ?)',
+            (soma, nome or os.path.basename(caminho), status, admin_id)
+        )
+        db.commit()
+        registo = db.execute('SELECT * FROM Importacoes WHERE checksum = ?', (soma,)).fetchone()
+    return registo
+
+
+def _credenciais(importacao_id, pendentes=False):
+    sufixo = '-credenciais.pendentes.csv' if pendentes else '-credenciais.csv'
+    return os.path.join(pasta(), f'{importacao_id}{sufixo}')
+
+
+def _gravar_credenciais(caminho, credenciais, modo='a'):
+    novo = modo == 'a' and not os.path.exists(caminho)
+    descritor = os.open(caminho, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if modo == 'a' else os.O_TRUNC), 0o600)
+    with open(descritor, modo, encoding='utf8', newline='') as f:
+        escritor = csv.writer(f)
+        if novo:
+            escritor.writerow(['username', 'password'])
+        escritor.writerows(credenciais)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _confirmar_credenciais(db, importacao_id):
+    """Passar as credenciais pendentes do último lote para o ficheiro final.
+
+    As passwords de um lote são escritas à parte antes do commit; se o
+    processo morreu antes de o lote ficar gravado, só passam as dos
+    utilizadores que existem de facto na base.
+    """
+    pendentes = _credenciais(importacao_id, pendentes=True)
+    try:
+        with open(pendentes, encoding='utf8', newline='') as f:
+            credenciais = [tuple(linha) for linha in csv.reader(f) if len(linha) == 2]
+    except FileNotFoundError:
+        return
+    existentes = {r[0] for r in db.execute(
+        'SELECT username FROM Usuarios WHERE username IN (SELECT value FROM json_each(?))',
+        (json.dumps([username for username, _ in credenciais]),)
+    )}
+    credenciais = [(username, password) for username, password in credenciais if username in existentes]
+    if credenciais:
+        _gravar_credenciais(_credenciais(importacao_id), credenciais)
+    os.remove(pendentes)
+
+
+def importar(caminho, lote=500, status='pendente', admin_id=None, nome=None, progresso=None):
+    """Importar alunos de um ficheiro CSV/XLSX em transacções de ``lote`` linhas.
+
+    O ficheiro é identificado pelo sha256: repetir a importação do mesmo
+    ficheiro retoma a partir da última linha gravada. Cada transacção
+    grava os alunos e utilizadores do lote, as linhas rejeitadas e o
+    novo ponto de retoma. As passwords em falta são geradas e escritas
+    em ``instance/importacoes/<id>-credenciais.csv`` (primeiro num
+    ficheiro de pendentes, antes do commit do lote). Devolve a linha de
+    Importacoes actualizada.
+    """
+    linhas = ler_ficheiro(caminho)
+    db = get_db()
+    registo = _registo(db, caminho, nome, status, admin_id)
+    if registo['estado'] == 'concluida':
+        return registo
+    importacao_id = registo['id']
+    status = registo['status_usuarios']
+    inicio = registo['linhas']
+    # Lote interrompido entre escrever as passwords e o commit
+    _confirmar_credenciais(db, importacao_id)
+    pendentes = _credenciais(importacao_id, pendentes=True)
+
+    cursos = {}
+    for curso_id, nome in db.execute('SELECT id, nome FROM Cursos'):
+        cursos[str(curso_id)] = curso_id
+        cursos[nome.lower()] = curso_id
+
+    # Duplicados dentro do próprio ficheiro (só das linhas já lidas)
+    vistos = (set(), set(), set())
+
+    def gravar_lote(validas, rejeitadas, ultima):
+        validas, duplicadas = _separar(db, validas)
+        rejeitadas = rejeitadas + duplicadas
+
+        geradas = {}
+        passwords = []
+        for numero, aluno, _ in validas:
+            if not aluno['password']:
+                geradas[numero] = secrets.token_urlsafe(9)
+            passwords.append(aluno['password'] or geradas[numero])
+        hashes = gerar_hashes(passwords)
+
+        def gravar(db):
+            # Outro pedido pode ter registado o mesmo aluno entretanto
+            novos, tardias = _separar(db, validas)
+            todas = rejeitadas + tardias
+            por_numero = {numero: pwhash for (numero, _, _), pwhash in zip(validas, hashes)}
+            # Ids pelo AUTOINCREMENT, para não reutilizar os de alunos apagados
+            for numero, a, _ in novos:
+                aluno_id = db.execute(
+                    'INSERT INTO Alunos (nome, data_nascimento, email, telefone, endereco, numero_bilhete, genero, nome_pai, nome_mae, telefone_encarregado, curso_preferido_id, ano_preferido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (a['nome'], a['data_nascimento'], a['email'], a['telefone'], a['endereco'],
+                     a['numero_bilhete'], a['genero'], a['nome_pai'], a['nome_mae'],
+                     a['telefone_encarregado'], a['curso_preferido_id'], a['ano_preferido'])
+                ).lastrowid
+                db.execute(
+                    "INSERT INTO Usuarios (username, password, email, papel, status, aluno_id) VALUES (?, ?, ?, 'aluno', ?, ?)",
+                    (a['username'], por_numero[numero], a['email'], status, aluno_id)
+                )
+            db.executemany(
+                'INSERT OR REPLACE INTO ImportacaoRejeicoes (importacao_id, linha, motivo, dados) VALUES (?, ?, ?, ?)',
+                [(importacao_id, numero, motivo, json.dumps(_sem_password(campos), ensure_ascii=False))
+                 for numero, motivo, campos in todas]
+            )
+            db.execute(
+                '''
+                UPDATE Importacoes
+                SET linhas = ?, inseridos = inseridos + ?, rejeitados = rejeitados + ?
+                WHERE id = ?
+                ''',
+                (ultima, len(novos), len(todas), importacao_id)
+            )
+            # Antes do commit: um utilizador gravado tem sempre a password guardada
+            credenciais = [(a['username'], geradas[numero]) for numero, a, _ in novos if numero in geradas]
+            if credenciais:
+                _gravar_credenciais(pendentes, credenciais, modo='w')
+            return [n for n, _, _ in novos]
+
+        try:
+            inseridas = transaccao(db, gravar)
+        except Exception:
+            if os.path.exists(pendentes):
+                os.remove(pendentes)
+            raise
+        _confirmar_credenciais(db, importacao_id)
+        if progresso is not None:
+            progresso(ultima, len(inseridas))
+
+    validas, rejeitadas = [], []
+    ultima = inicio
+    for numero, campos in linhas:
+        if numero <= inicio:
+            continue
+        ultima = numero
+        aluno, motivo = _validar(campos, cursos)
+        if aluno is not None:
+            motivo = _duplicado(aluno, *vistos)
+        if motivo is not None:
+            rejeitadas.append((numero, motivo, campos))
+        else:
+            vistos[0].add(aluno['email'])
+            vistos[1].add(aluno['numero_bilhete'])
+            vistos[2].add(aluno['username'])
+            validas.append((numero, aluno, campos))
+        if len(validas) + len(rejeitadas) >= lote:
+            gravar_lote(validas, rejeitadas, ultima)
+            validas, rejeitadas = [], []
+    if validas or rejeitadas:
+        gravar_lote(validas, rejeitadas, ultima)
+
+    db.execute(
+        "UPDATE Importacoes SET estado = 'concluida', concluida_em = CURRENT_TIMESTAMP WHERE id = ?",
+        (importacao_id,)
+    )
+    db.commit()
+    return db.execute('SELECT * FROM Importacoes WHERE id = ?', (importacao_id,)).fetchone()
+
+
+def rejeicoes_csv(db, importacao_id):
+    """Relatório das linhas rejeitadas em CSV, gerado aos poucos."""
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    colunas = [campo for campo in CAMPOS if campo != 'password']
+    escritor.writerow(['linha', 'motivo'] + colunas)
+    for linha, motivo, dados in db.execute(
+        'SELECT linha, motivo, dados FROM ImportacaoRejeicoes WHERE importacao_id = ? ORDER BY linha',
+        (importacao_id,)
+    ):
+        campos = json.loads(dados)
+        escritor.writerow([linha, motivo] + [campos.get(c, '') for c in colunas])
+        yield saida.getvalue()
+        saida.seek(0)
+        saida.truncate()
+    yield saida.getvalue()
+
+
+@click.command('import-students')
+@click.argument('ficheiro', type=click.Path(exists=True, dir_okay=False))
+@click.option('--lote', default=500, show_default=True, help='Linhas por transacção.')
+@click.option('--status', type=click.Choice(['pendente', 'ativo']), default='pendente', show_default=True,
+              help='Estado dos utilizadores criados (pendente = aguarda aprovação e matrícula).')
+@click.option('--rejeitadas', type=click.Path(dir_okay=False), help='Escrever aqui o relatório das linhas rejeitadas.')
+def import_students_command(ficheiro, lote, status, rejeitadas):
+    """Importar alunos de um ficheiro CSV ou XLSX (retoma se for interrompido)."""
+    inicio = time.perf_counter()
+
+    def progresso(linha, inseridos):
+        click.echo(f'  linha {linha}: +{inseridos} aluno(s)')
+
+    try:
+        registo = importar(ficheiro, lote=lote, status=status, progresso=progresso)
+    except ErroImportacao as erro:
+        raise click.ClickException(str(erro))
+    click.echo(
+        f'Importação {registo["id"]}: {registo["linhas"]} linhas, {registo["inseridos"]} alunos inseridos, '
+        f'{registo["rejeitados"]} rejeitados ({time.perf_counter() - inicio:.1f}s).'
+    )
+    credenciais = _credenciais(registo['id'])
+    if os.path.exists(credenciais):
+        click.echo(f'Passwords geradas em {credenciais}')
+    if rejeitadas and registo['rejeitados']:
+        with open(rejeitadas, 'w', encoding='utf8', newline='') as f:
+            for parte in rejeicoes_csv(get_db(), registo['id']):
+                f.write(parte)
+        click.echo(f'Linhas rejeitadas em {rejeitadas}')
+
+
+def init_app(app):
+    app.cli.add_command(import_students_command)
@@ -0,0 +1,27 @@
+# Versões das notas trimestrais para a sincronização incremental
+
+
+def aplicar(m):
+    # ADD COLUMN com valor por omissão constante não reescreve a tabela
+    if not m.coluna_existe('NotasTrimestrais', 'versao'):
+        m.passo(
+            'NotasTrimestrais.versao',
+            'ALTER TABLE NotasTrimestrais ADD COLUMN versao INTEGER NOT NULL DEFAULT 0'
+        )
+
+    m.passo('NotasTrimestraisRemovidas', '''
+        CREATE TABLE IF NOT EXISTS NotasTrimestraisRemovidas (
+          turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+          trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)),
+          matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+          versao INTEGER NOT NULL,
+          PRIMARY KEY (turma_disciplina_id, trimestre, matricula_id)
+        ) WITHOUT ROWID
+    ''')
+
+    m.passo('Contadores', '''
+        CREATE TABLE IF NOT EXISTS Contadores (
+          nome TEXT PRIMARY KEY,
+          valor INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
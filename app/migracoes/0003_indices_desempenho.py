@@ -0,0 +1,33 @@
+# Índices de listagens e de acesso às notas. O SQLite não constrói índices
+# em paralelo com escritas: cada índice é um passo (transacção) próprio,
+# para o lock de escrita ser libertado entre eles, e os índices que ficam
+# redundantes só são apagados depois de os novos existirem.
+
+INDICES = [
+    ('idx_alunos_nome', 'Alunos(nome)'),
+    ('idx_anuncios_data_publicacao', 'Anuncios(data_publicacao)'),
+    ('idx_disciplinas_nome', 'Disciplinas(nome)'),
+    ('idx_matriculas_turma_status', 'Matriculas(turma_id, status, aluno_id)'),
+    ('idx_docencia_professor', 'Docencia(professor_id, data_fim, turma_disciplina_id)'),
+    ('idx_docencia_activa_turma_disciplina',
+     'Docencia(turma_disciplina_id, professor_id) WHERE data_fim IS NULL'),
+    ('idx_notas_tri_td_trimestre',
+     'NotasTrimestrais(turma_disciplina_id, trimestre, versao, matricula_id, nota)'),
+    ('idx_notas_tri_removidas_matricula', 'NotasTrimestraisRemovidas(matricula_id)'),
+    ('idx_usuarios_pendentes', "Usuarios(papel, aluno_id) WHERE status = 'pendente'"),
+]
+
+SUBSTITUIDOS = [
+    'idx_matriculas_turma_id',
+    'idx_docencia_professor_id',
+    'idx_docencia_turma_disciplina_id',
+    'idx_notas_tri_turma_disciplina',
+    'idx_notas_tri_versao',
+]
+
+
+def aplicar(m):
+    for nome, definicao in INDICES:
+        m.passo(nome, f'CREATE INDEX IF NOT EXISTS {nome} ON {definicao}')
+    m.passo('remover substituídos', *(f'DROP INDEX IF EXISTS {nome}' for nome in SUBSTITUIDOS))
+    m.passo('ANALYZE', 'ANALYZE')
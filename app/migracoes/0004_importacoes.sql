@@ -0,0 +1,23 @@
+-- Importação de alunos em massa: ficheiros importados e linhas rejeitadas
+
+CREATE TABLE IF NOT EXISTS Importacoes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  checksum TEXT NOT NULL UNIQUE,
+  ficheiro TEXT NOT NULL,
+  status_usuarios TEXT NOT NULL DEFAULT 'pendente' CHECK(status_usuarios IN ('ativo','pendente')),
+  estado TEXT NOT NULL DEFAULT 'em_curso' CHECK(estado IN ('em_curso','concluida')),
+  linhas INTEGER NOT NULL DEFAULT 0,
+  inseridos INTEGER NOT NULL DEFAULT 0,
+  rejeitados INTEGER NOT NULL DEFAULT 0,
+  admin_id INTEGER REFERENCES Usuarios(id) ON DELETE SET NULL,
+  criado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  concluida_em TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ImportacaoRejeicoes (
+  importacao_id INTEGER NOT NULL REFERENCES Importacoes(id) ON DELETE CASCADE,
+  linha INTEGER NOT NULL,
+  motivo TEXT NOT NULL,
+  dados TEXT NOT NULL, -- JSON com os campos da linha original
+  PRIMARY KEY (importacao_id, linha)
+) WITHOUT ROWID;
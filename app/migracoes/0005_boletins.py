@@ -0,0 +1,82 @@
+# Boletins materializados a partir das notas trimestrais. O cálculo
+# inicial é feito ano lectivo a ano lectivo, um passo (transacção) cada.
+# O cálculo está aqui em SQL, com as regras em vigor nesta versão (nota
+# mínima 10, até 2 negativas), e não em app/boletim.py: repetir a
+# migração numa base antiga dá sempre o mesmo resultado.
+
+BOLETIM_DISCIPLINAS = '''
+    INSERT INTO BoletimDisciplinas
+      (matricula_id, turma_disciplina_id, nota_t1, nota_t2, nota_t3, media, classificacao_final)
+    SELECT nt.matricula_id, nt.turma_disciplina_id,
+           MAX(CASE WHEN nt.trimestre = 1 THEN nt.nota END),
+           MAX(CASE WHEN nt.trimestre = 2 THEN nt.nota END),
+           MAX(CASE WHEN nt.trimestre = 3 THEN nt.nota END),
+           AVG(nt.nota),
+           CASE WHEN COUNT(*) = 3 THEN AVG(nt.nota) END
+    FROM Matriculas m
+    JOIN NotasTrimestrais nt ON nt.matricula_id = m.id
+    JOIN TurmaDisciplinas td ON td.id = nt.turma_disciplina_id AND td.turma_id = m.turma_id
+    WHERE m.turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?)
+    GROUP BY nt.matricula_id, nt.turma_disciplina_id
+'''
+
+# Uma linha por matrícula com disciplinas; 'em_curso' enquanto alguma
+# disciplina não tiver os três trimestres
+BOLETINS = '''
+    INSERT INTO Boletins
+      (matricula_id, media_t1, media_t2, media_t3, media_final, disciplinas, negativas, resultado)
+    SELECT m.id,
+           AVG(bd.nota_t1), AVG(bd.nota_t2), AVG(bd.nota_t3), AVG(bd.classificacao_final),
+           COUNT(*),
+           COALESCE(SUM(bd.classificacao_final < 10), 0),
+           CASE
+             WHEN COUNT(bd.classificacao_final) < COUNT(*) THEN 'em_curso'
+             WHEN COALESCE(SUM(bd.classificacao_final < 10), 0) <= 2 THEN 'aprovado'
+             ELSE 'reprovado'
+           END
+    FROM Matriculas m
+    JOIN TurmaDisciplinas td ON td.turma_id = m.turma_id
+    LEFT JOIN BoletimDisciplinas bd ON bd.matricula_id = m.id AND bd.turma_disciplina_id = td.id
+    WHERE m.turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?)
+    GROUP BY m.id
+'''
+
+_DO_ANO = 'matricula_id IN (SELECT id FROM Matriculas WHERE turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?))'
+
+
+def _calcular(db, ano_lectivo_id):
+    for tabela in ('Boletins', 'BoletimDisciplinas'):
+        db.execute(f'DELETE FROM {tabela} WHERE {_DO_ANO}', (ano_lectivo_id,))
+    db.execute(BOLETIM_DISCIPLINAS, (ano_lectivo_id,))
+    db.execute(BOLETINS, (ano_lectivo_id,))
+
+
+def aplicar(m):
+    m.passo('BoletimDisciplinas', '''
+        CREATE TABLE IF NOT EXISTS BoletimDisciplinas (
+          matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+          turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+          nota_t1 REAL,
+          nota_t2 REAL,
+          nota_t3 REAL,
+          media REAL,
+          classificacao_final REAL,
+          PRIMARY KEY (matricula_id, turma_disciplina_id)
+        ) WITHOUT ROWID
+    ''', 'CREATE INDEX IF NOT EXISTS idx_boletim_disciplinas_td ON BoletimDisciplinas(turma_disciplina_id)')
+
+    m.passo('Boletins', '''
+        CREATE TABLE IF NOT EXISTS Boletins (
+          matricula_id INTEGER PRIMARY KEY REFERENCES Matriculas(id) ON DELETE CASCADE,
+          media_t1 REAL,
+          media_t2 REAL,
+          media_t3 REAL,
+          media_final REAL,
+          disciplinas INTEGER NOT NULL,
+          negativas INTEGER NOT NULL,
+          resultado TEXT NOT NULL CHECK(resultado IN ('em_curso','aprovado','reprovado'))
+        )
+    ''')
+
+    for ano_lectivo_id, ano in m.db.execute('SELECT id, ano FROM AnoLectivo ORDER BY ano').fetchall():
+        m.passo(f'boletins {ano}', lambda db, ano_lectivo_id=ano_lectivo_id: _calcular(db, ano_lectivo_id))
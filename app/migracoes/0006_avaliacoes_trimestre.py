@@ -0,0 +1,25 @@
+# Trimestre de cada avaliação, para o cálculo das notas trimestrais
+# ponderadas (app/avaliacoes.py).
+
+
+def aplicar(m):
+    # ADD COLUMN exige um valor por omissão; o valor real vem do preenchimento
+    if not m.coluna_existe('Avaliacoes', 'trimestre'):
+        m.passo(
+            'Avaliacoes.trimestre',
+            'ALTER TABLE Avaliacoes ADD COLUMN trimestre INTEGER NOT NULL DEFAULT 1 CHECK(trimestre IN (1,2,3))'
+        )
+
+    # Avaliações antigas: trimestres de 91 dias a partir de 1 de Fevereiro
+    m.preencher(
+        'Avaliacoes.trimestre', 'Avaliacoes',
+        '''trimestre = MAX(1, MIN(3, 1 + CAST(
+            (julianday(data) - julianday(strftime('%Y', data) || '-02-01')) / 91 AS INTEGER
+        )))'''
+    )
+
+    m.passo(
+        'idx_avaliacoes_td_trimestre',
+        'CREATE INDEX IF NOT EXISTS idx_avaliacoes_td_trimestre ON Avaliacoes(turma_disciplina_id, trimestre)'
+    )
+    m.passo('remover idx_avaliacoes_turma_disciplina_id', 'DROP INDEX IF EXISTS idx_avaliacoes_turma_disciplina_id')
@@ -0,0 +1,80 @@
+# Trimestre de cada aula e contagens de faltas mantidas ao registar a
+# chamada (app/presencas.py). A contagem inicial é feita ano lectivo a
+# ano lectivo, um passo (transacção) cada, com o SQL aqui e não o de
+# app/presencas.py, para a migração dar sempre o mesmo resultado.
+
+_DO_ANO = 'turma_disciplina_id IN (SELECT id FROM TurmaDisciplinas WHERE turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?))'
+
+FALTAS_TRIMESTRAIS = '''
+    INSERT INTO FaltasTrimestrais
+      (matricula_id, turma_disciplina_id, trimestre, faltas, justificadas, atrasos)
+    SELECT p.matricula_id, a.turma_disciplina_id, a.trimestre,
+           SUM(p.estado = 'falta'), SUM(p.estado = 'justificada'), SUM(p.estado = 'atraso')
+    FROM TurmaDisciplinas td
+    JOIN Aulas a ON a.turma_disciplina_id = td.id
+    JOIN Presencas p ON p.aula_id = a.id
+    WHERE td.turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?) AND p.estado <> 'presente'
+    GROUP BY p.matricula_id, a.turma_disciplina_id, a.trimestre
+'''
+
+FALTAS_DISCIPLINAS = '''
+    INSERT INTO FaltasDisciplinas (matricula_id, turma_disciplina_id, faltas, justificadas, atrasos)
+    SELECT ft.matricula_id, ft.turma_disciplina_id, SUM(ft.faltas), SUM(ft.justificadas), SUM(ft.atrasos)
+    FROM TurmaDisciplinas td
+    JOIN FaltasTrimestrais ft ON ft.turma_disciplina_id = td.id
+    WHERE td.turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?)
+    GROUP BY ft.matricula_id, ft.turma_disciplina_id
+'''
+
+
+def _contar(db, ano_lectivo_id):
+    for tabela in ('FaltasTrimestrais', 'FaltasDisciplinas'):
+        db.execute(f'DELETE FROM {tabela} WHERE {_DO_ANO}', (ano_lectivo_id,))
+    db.execute(FALTAS_TRIMESTRAIS, (ano_lectivo_id,))
+    db.execute(FALTAS_DISCIPLINAS, (ano_lectivo_id,))
+
+
+def aplicar(m):
+    # ADD COLUMN exige um valor por omissão; o valor real vem do preenchimento
+    if not m.coluna_existe('Aulas', 'trimestre'):
+        m.passo(
+            'Aulas.trimestre',
+            'ALTER TABLE Aulas ADD COLUMN trimestre INTEGER NOT NULL DEFAULT 1 CHECK(trimestre IN (1,2,3))'
+        )
+
+    # Como nas avaliações (0006): trimestres de 91 dias a partir de 1 de Fevereiro
+    m.preencher(
+        'Aulas.trimestre', 'Aulas',
+        '''trimestre = MAX(1, MIN(3, 1 + CAST(
+            (julianday(data) - julianday(strftime('%Y', data) || '-02-01')) / 91 AS INTEGER
+        )))'''
+    )
+
+    m.passo('FaltasTrimestrais', '''
+        CREATE TABLE IF NOT EXISTS FaltasTrimestrais (
+          matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+          turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+          trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)),
+          faltas INTEGER NOT NULL,
+          justificadas INTEGER NOT NULL,
+          atrasos INTEGER NOT NULL,
+          PRIMARY KEY (matricula_id, turma_disciplina_id, trimestre)
+        ) WITHOUT ROWID
+    ''')
+
+    m.passo('FaltasDisciplinas', '''
+        CREATE TABLE IF NOT EXISTS FaltasDisciplinas (
+          matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+          turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+          faltas INTEGER NOT NULL,
+          justificadas INTEGER NOT NULL,
+          atrasos INTEGER NOT NULL,
+          PRIMARY KEY (matricula_id, turma_disciplina_id)
+        ) WITHOUT ROWID
+    ''', '''
+        CREATE INDEX IF NOT EXISTS idx_faltas_disciplinas_td_faltas
+        ON FaltasDisciplinas(turma_disciplina_id, faltas)
+    ''')
+
+    for ano_lectivo_id, ano in m.db.execute('SELECT id, ano FROM AnoLectivo ORDER BY ano').fetchall():
+        m.passo(f'faltas {ano}', lambda db, ano_lectivo_id=ano_lectivo_id: _contar(db, ano_lectivo_id))
@@ -0,0 +1,4 @@
+-- Procura de emails já registados sem distinguir maiúsculas (importação de alunos)
+
+CREATE INDEX IF NOT EXISTS idx_alunos_email_lower ON Alunos(lower(email));
+CREATE INDEX IF NOT EXISTS idx_usuarios_email_lower ON Usuarios(lower(email));
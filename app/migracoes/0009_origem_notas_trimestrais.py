@@ -0,0 +1,26 @@
+# Origem de cada nota trimestral: lançada à mão ou calculada a partir das
+# avaliações (app/avaliacoes.py), para o recálculo só tocar nas calculadas.
+
+
+def aplicar(m):
+    # ADD COLUMN exige um valor por omissão; as calculadas vêm do preenchimento
+    if not m.coluna_existe('NotasTrimestrais', 'origem'):
+        m.passo(
+            'NotasTrimestrais.origem',
+            "ALTER TABLE NotasTrimestrais ADD COLUMN origem TEXT NOT NULL DEFAULT 'manual' "
+            "CHECK(origem IN ('manual','avaliacoes'))"
+        )
+
+    # Até aqui o recálculo escrevia por cima de todas as notas dos alunos
+    # com notas nas avaliações do trimestre: essas eram as calculadas
+    m.preencher(
+        'NotasTrimestrais.origem', 'NotasTrimestrais',
+        "origem = 'avaliacoes'",
+        '''EXISTS (
+            SELECT 1 FROM Avaliacoes a
+            JOIN Notas n ON n.avaliacao_id = a.id
+            WHERE a.turma_disciplina_id = NotasTrimestrais.turma_disciplina_id
+              AND a.trimestre = NotasTrimestrais.trimestre
+              AND n.matricula_id = NotasTrimestrais.matricula_id
+        )'''
+    )
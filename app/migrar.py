@@ -0,0 +1,259 @@
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import time
+
+import click
+from flask import current_app
+
+from app.db import get_db
+
+_ficheiro = re.compile(r'^(\d{4})_([a-z0-9_]+)\.(sql|py)$')
+
+
+def _pasta():
+    return os.path.join(current_app.root_path, 'migracoes')
+
+
+def migracoes():
+    """Lista ordenada de ``(versao, nome, caminho, checksum)`` das migrações."""
+    encontradas = []
+    for nome in sorted(os.listdir(_pasta())):
+        m = _ficheiro.match(nome)
+        if m is None:
+            continue
+        caminho = os.path.join(_pasta(), nome)
+        with open(caminho, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        encontradas.append((int(m.group(1)), nome, caminho, checksum))
+    versoes = [v for v, *_ in encontradas]
+    if len(versoes) != len(set(versoes)):
+        raise click.ClickException('Há duas migrações com o mesmo número.')
+    return encontradas
+
+
+def _criar_tabela(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+          versao INTEGER PRIMARY KEY,
+          nome TEXT NOT NULL,
+          checksum TEXT NOT NULL,
+          estado TEXT NOT NULL CHECK(estado IN ('em_curso', 'aplicada')),
+          progresso TEXT NOT NULL DEFAULT '{}',
+          iniciada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          aplicada_em TIMESTAMP
+        )
+    ''')
+    db.commit()
+
+
+def registadas(db):
+    _criar_tabela(db)
+    return {
+        row['versao']: row for row in
+        db.execute('SELECT versao, nome, checksum, estado, progresso, aplicada_em FROM schema_version')
+    }
+
+
+def marcar_aplicadas(db):
+    """Registar todas as migrações como aplicadas (base criada pelo schema.sql)."""
+    _criar_tabela(db)
+    db.executemany(
+        '''
+        INSERT OR REPLACE INTO schema_version (versao, nome, checksum, estado, aplicada_em)
+        VALUES (?, ?, ?, 'aplicada', CURRENT_TIMESTAMP)
+        ''',
+        [(versao, nome, checksum) for versao, nome, _, checksum in migracoes()]
+    )
+    db.commit()
+
+
+class Migracao:
+    """Contexto passado a ``aplicar(m)`` nas migrações em Python.
+
+    Cada passo corre na sua própria transacção curta e fica registado em
+    ``schema_version.progresso``; ao repetir uma migração interrompida os
+    passos concluídos são saltados e os preenchimentos continuam do último
+    lote gravado.
+    """
+
+    def __init__(self, db, versao, progresso, lote, pausa):
+        self.db = db
+        self.versao = versao
+        self.progresso = progresso
+        self.lote = lote
+        self.pausa = pausa
+
+    def _gravar_progresso(self):
+        self.db.execute(
+            'UPDATE schema_version SET progresso = ? WHERE versao = ?',
+            (json.dumps(self.progresso), self.versao)
+        )
+
+    def coluna_existe(self, tabela, coluna):
+        return any(row[1] == coluna for row in self.db.execute(f'PRAGMA table_info({tabela})'))
+
+    def passo(self, nome, *instrucoes):
+        """Executar as instruções numa transacção, uma única vez por migração.
+
+        Cada instrução é SQL ou uma função ``f(db)`` que não faz commit.
+        """
+        feitos = self.progresso.setdefault('passos', [])
+        if nome in feitos:
+            return False
+        inicio = time.perf_counter()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for sql in instrucoes:
+                if callable(sql):
+                    sql(self.db)
+                else:
+                    self.db.execute(sql)
+            feitos.append(nome)
+            self._gravar_progresso()
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            if nome in feitos:
+                feitos.remove(nome)
+            raise
+        click.echo(f'  {nome} ({time.perf_counter() - inicio:.1f}s)')
+        if self.pausa:
+            time.sleep(self.pausa)
+        return True
+
+    def preencher(self, nome, tabela, atribuicao, onde='1'):
+        """Actualizar ``tabela`` em lotes de rowid, cada lote na sua transacção.
+
+        ``atribuicao`` é o SET do UPDATE e ``onde`` filtra as linhas a
+        alterar. O último rowid tratado é gravado com cada lote, por isso
+        uma interrupção perde no máximo o lote em curso.
+        """
+        chave = f'preencher:{nome}'
+        if chave in self.progresso.get('passos', []):
+            return
+        ultimo = self.progresso.get(chave, 0)
+        maximo = self.db.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {tabela}').fetchone()[0]
+        total = 0
+        inicio = time.perf_counter()
+        while ultimo < maximo:
+            limite = ultimo + self.lote
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                total += self.db.execute(
+                    f'UPDATE {tabela} SET {atribuicao} WHERE rowid > ? AND rowid <= ? AND ({onde})',
+                    (ultimo, limite)
+                ).rowcount
+                self.progresso[chave] = ultimo = limite
+                self._gravar_progresso()
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            # Deixar entrar os pedidos que esperam pelo lock de escrita
+            if self.pausa:
+                time.sleep(self.pausa)
+        self.progresso.pop(chave, None)
+        self.passo(chave)
+        click.echo(f'  {nome}: {total} linha(s) em {time.perf_counter() - inicio:.1f}s')
+
+
+def _aplicar_sql(db, versao, nome, caminho, checksum):
+    with open(caminho, encoding='utf8') as f:
+        script = f.read()
+    # Script e registo na mesma transacção: ou fica tudo aplicado ou nada
+    try:
+        db.executescript(
+            'BEGIN IMMEDIATE;\n' + script + ';\n'
+            "INSERT OR REPLACE INTO schema_version (versao, nome, checksum, estado, aplicada_em) "
+            f"VALUES ({versao}, '{nome}', '{checksum}', 'aplicada', CURRENT_TIMESTAMP);\n"
+            'COMMIT;'
+        )
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+
+
+def _aplicar_py(db, versao, nome, caminho, checksum, progresso, lote, pausa):
+    spec = importlib.util.spec_from_file_location(f'app.migracoes.m{versao:04d}', caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+
+    db.execute(
+        '''
+        INSERT INTO schema_version (versao, nome, checksum, estado) VALUES (?, ?, ?, 'em_curso')
+        ON CONFLICT(versao) DO NOTHING
+        ''',
+        (versao, nome, checksum)
+    )
+    db.commit()
+    modulo.aplicar(Migracao(db, versao, progresso, lote, pausa))
+    db.execute(
+        "UPDATE schema_version SET estado = 'aplicada', aplicada_em = CURRENT_TIMESTAMP WHERE versao = ?",
+        (versao,)
+    )
+    db.commit()
+
+
+def migrar(ate=None, lote=5000, pausa=0.0):
+    """Aplicar por ordem as migrações pendentes (ou retomar a que ficou a meio)."""
+    db = get_db()
+    feitas = registadas(db)
+    aplicadas = []
+    for versao, nome, caminho, checksum in migracoes():
+        if ate is not None and versao > ate:
+            break
+        registo = feitas.get(versao)
+        if registo is not None and registo['checksum'] != checksum:
+            raise click.ClickException(
+                f'{nome} foi alterada depois de {"aplicada" if registo["estado"] == "aplicada" else "iniciada"}; '
+                'crie uma nova migração em vez de editar esta.'
+            )
+        if registo is not None and registo['estado'] == 'aplicada':
+            continue
+
+        click.echo(f'{nome}{" (a retomar)" if registo is not None else ""}')
+        inicio = time.perf_counter()
+        if caminho.endswith('.sql'):
+            _aplicar_sql(db, versao, nome, caminho, checksum)
+        else:
+            progresso = json.loads(registo['progresso']) if registo is not None else {}
+            _aplicar_py(db, versao, nome, caminho, checksum, progresso, lote, pausa)
+        click.echo(f'{nome} aplicada em {time.perf_counter() - inicio:.1f}s')
+        aplicadas.append(nome)
+    return aplicadas
+
+
+@click.command('db-migrate')
+@click.option('--ate', type=int, help='Aplicar só até esta versão.')
+@click.option('--lote', default=5000, show_default=True, help='Linhas por transacção nos preenchimentos.')
+@click.option('--pausa', default=0.05, show_default=True, help='Segundos de pausa entre lotes e passos.')
+def db_migrate_command(ate, lote, pausa):
+    """Aplicar as migrações pendentes sem apagar dados."""
+    aplicadas = migrar(ate, lote, pausa)
+    click.echo(f'{len(aplicadas)} migração(ões) aplicada(s).' if aplicadas else 'Esquema já actualizado.')
+
+
+@click.command('db-status')
+def db_status_command():
+    """Mostrar o estado de cada migração."""
+    feitas = registadas(get_db())
+    for versao, nome, _, checksum in migracoes():
+        registo = feitas.get(versao)
+        if registo is None:
+            estado = 'pendente'
+        elif registo['checksum'] != checksum:
+            estado = 'ALTERADA'
+        elif registo['estado'] == 'em_curso':
+            estado = f'em curso {registo["progresso"]}'
+        else:
+            estado = f'aplicada {registo["aplicada_em"]}'
+        click.echo(f'{nome:<40} {estado}')
+
+
+def init_app(app):
+    app.cli.add_command(db_migrate_command)
+    app.cli.add_command(db_status_command)
@@ -0,0 +1,462 @@
+import json
+import math
+from array import array
+
+from flask import flash
+
+from app import boletim
+from app.db import incrementar_contador, ler_contador
+from app.escritor import transaccao
+
+
+def ler_celulas(form, chave, maximo=20):
+    """Validar todas as células ``nota-*`` de um formulário antes de gravar.
+
+    ``chave`` recebe o sufixo do nome do campo e devolve a chave da
+    célula, em regra o par ``(matricula_id, turma_disciplina_id)``.
+    Devolve ``(celulas, erros)``, onde ``celulas`` mapeia a chave para a
+    nota (``None`` = apagar).
+    """
+    celulas = {}
+    erros = []
+    for key, value in form.items():
+        if not key.startswith('nota-'):
+            continue
+
+        try:
+            celula = chave(key[len('nota-'):])
+        except (TypeError, ValueError):
+            erros.append(f'Campo de nota inválido: {key}.')
+            continue
+
+        raw = (value or '').strip()
+        if raw == '':
+            celulas[celula] = None
+            continue
+
+        try:
+            nota = float(raw.replace(',', '.'))
+        except ValueError:
+            nota = None
+        if nota is None or not math.isfinite(nota) or nota < 0 or nota > maximo:
+            matricula_id = celula[0] if isinstance(celula, tuple) else celula
+            erros.append(f'Nota inválida "{raw}" (matrícula {matricula_id}). Use um número entre 0 e {maximo:g}.')
+            continue
+
+        celulas[celula] = nota
+
+    return celulas, erros
+
+
+def _celulas_validas(db, turma_id):
+    matriculas = {row[0] for row in db.execute(
+        "SELECT id FROM Matriculas WHERE turma_id = ? AND status = 'ativa'",
+        (turma_id,)
+    )}
+    turma_disciplinas = {row[0] for row in db.execute(
+        'SELECT id FROM TurmaDisciplinas WHERE turma_id = ?',
+        (turma_id,)
+    )}
+    return matriculas, turma_disciplinas
+
+
+def avaliadas(db, trimestre, turma_disciplinas):
+    """Disciplinas cujas notas do trimestre vêm das avaliações (app/avaliacoes.py).
+
+    Nessas as notas trimestrais não são lançadas à mão.
+    """
+    if not turma_disciplinas:
+        return set()
+    return {row[0] for row in db.execute(
+        '''
+        SELECT DISTINCT turma_disciplina_id FROM Avaliacoes
+        WHERE trimestre = ? AND turma_disciplina_id IN (SELECT value FROM json_each(?))
+        ''',
+        (trimestre, json.dumps(sorted(turma_disciplinas)))
+    )}
+
+
+def aplicar_celulas(db, trimestre, upserts, deletes, origem='manual'):
+    """Aplicar upserts ``(m, td, nota)`` e deletes ``(m, td)`` já validados.
+
+    Todas as células alteradas recebem a mesma nova versão; apagar uma
+    nota deixa um registo em NotasTrimestraisRemovidas com essa versão.
+    ``origem`` distingue as notas lançadas à mão das calculadas a partir
+    das avaliações. Células que já têm esse valor (ou que já estão
+    vazias) são descartadas; só os boletins dos pares realmente alterados
+    são recalculados, na mesma transacção. Sem alterações não há nova
+    versão e devolve ``None``.
+    """
+    actuais = {}
+    for td in {td for _, td, _ in upserts} | {td for _, td in deletes}:
+        for m, nota, origem_actual in db.execute(
+            '''
+            SELECT matricula_id, nota, origem FROM NotasTrimestrais
+            WHERE turma_disciplina_id = ? AND trimestre = ?
+            ''',
+            (td, trimestre)
+        ):
+            actuais[(m, td)] = (nota, origem_actual)
+    upserts = [(m, td, nota) for m, td, nota in upserts if actuais.get((m, td)) != (nota, origem)]
+    deletes = [(m, td) for m, td in deletes if (m, td) in actuais]
+    if not upserts and not deletes:
+        return None
+
+    versao = incrementar_contador(db, 'notas')
+    if deletes:
+        db.executemany(
+            '''
+            INSERT OR REPLACE INTO NotasTrimestraisRemovidas (turma_disciplina_id, trimestre, matricula_id, versao)
+            SELECT turma_disciplina_id, trimestre, matricula_id, ?
+            FROM NotasTrimestrais
+            WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?
+            ''',
+            [(versao, m, td, trimestre) for m, td in deletes]
+        )
+        db.executemany(
+            'DELETE FROM NotasTrimestrais WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?',
+            [(m, td, trimestre) for m, td in deletes]
+        )
+    if upserts:
+        db.executemany(
+            '''
+            INSERT INTO NotasTrimestrais (matricula_id, turma_disciplina_id, trimestre, nota, versao, origem)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(matricula_id, turma_disciplina_id, trimestre)
+            DO UPDATE SET nota = excluded.nota, versao = excluded.versao, origem = excluded.origem
+            WHERE nota <> excluded.nota OR origem <> excluded.origem
+            ''',
+            [(m, td, trimestre, nota, versao, origem) for m, td, nota in upserts]
+        )
+    boletim.actualizar(db, [(m, td) for m, td, _ in upserts] + list(deletes))
+    return versao
+
+
+def gravar_notas(db, turma_id, trimestre, celulas):
+    """Gravar as células numa única transacção de escrita.
+
+    Células de matrículas inactivas ou disciplinas de outra turma são
+    ignoradas, e as de disciplinas com avaliações no trimestre não são
+    gravadas. Devolve o número de células gravadas, apagadas e recusadas
+    por as notas virem das avaliações (só as que o formulário alterava).
+    """
+    # BEGIN IMMEDIATE (ou o escritor) reserva o lock de escrita logo no
+    # início e evita a promoção de leitura para escrita a meio
+    def gravar(db):
+        matriculas, turma_disciplinas = _celulas_validas(db, turma_id)
+        bloqueadas = avaliadas(db, trimestre, {td for (_, td) in celulas if td in turma_disciplinas})
+        estado = _estado_atual(db, trimestre, bloqueadas)
+
+        upserts = []
+        deletes = []
+        recusadas = 0
+        for (matricula_id, turma_disciplina_id), nota in celulas.items():
+            if matricula_id not in matriculas or turma_disciplina_id not in turma_disciplinas:
+                continue
+            if turma_disciplina_id in bloqueadas:
+                if nota != estado.get((matricula_id, turma_disciplina_id), (None, 0))[0]:
+                    recusadas += 1
+                continue
+            if nota is None:
+                deletes.append((matricula_id, turma_disciplina_id))
+            else:
+                upserts.append((matricula_id, turma_disciplina_id, nota))
+
+        aplicar_celulas(db, trimestre, upserts, deletes)
+        return len(upserts), len(deletes), recusadas
+
+    return transaccao(db, gravar)
+
+
+def _estado_atual(db, trimestre, turma_disciplinas):
+    """Nota e versão actuais de cada célula das disciplinas indicadas."""
+    estado = {}
+    for turma_disciplina_id in turma_disciplinas:
+        for m, versao in db.execute(
+            '''
+            SELECT matricula_id, versao FROM NotasTrimestraisRemovidas
+            WHERE turma_disciplina_id = ? AND trimestre = ?
+            ''',
+            (turma_disciplina_id, trimestre)
+        ):
+            estado[(m, turma_disciplina_id)] = (None, versao)
+        for m, nota, versao in db.execute(
+            '''
+            SELECT matricula_id, nota, versao FROM NotasTrimestrais
+            WHERE turma_disciplina_id = ? AND trimestre = ?
+            ''',
+            (turma_disciplina_id, trimestre)
+        ):
+            estado[(m, turma_disciplina_id)] = (nota, versao)
+    return estado
+
+
+def alteracoes_desde(db, trimestre, turma_disciplinas, desde):
+    """Células (vivas ou apagadas) com versão posterior a ``desde``."""
+    alteracoes = []
+    for turma_disciplina_id in turma_disciplinas:
+        for m, nota, versao in db.execute(
+            '''
+            SELECT matricula_id, nota, versao FROM NotasTrimestrais
+            WHERE turma_disciplina_id = ? AND trimestre = ? AND versao > ?
+            UNION ALL
+            SELECT r.matricula_id, NULL, r.versao FROM NotasTrimestraisRemovidas r
+            WHERE r.turma_disciplina_id = ? AND r.trimestre = ? AND r.versao > ?
+              AND NOT EXISTS (
+                SELECT 1 FROM NotasTrimestrais nt
+                WHERE nt.matricula_id = r.matricula_id
+                  AND nt.turma_disciplina_id = r.turma_disciplina_id
+                  AND nt.trimestre = r.trimestre
+              )
+            ''',
+            (turma_disciplina_id, trimestre, desde, turma_disciplina_id, trimestre, desde)
+        ):
+            alteracoes.append({
+                'matricula_id': m,
+                'turma_disciplina_id': turma_disciplina_id,
+                'nota': nota,
+                'versao': versao
+            })
+    return alteracoes
+
+
+def ler_celulas_json(dados, turma_disciplina_id=None):
+    """Validar as células de um pedido de sincronização.
+
+    Cada célula traz ``matricula_id``, ``turma_disciplina_id`` (omitido
+    quando a disciplina é fixa), ``nota`` (``null`` = apagar) e a
+    ``versao`` em que o cliente se baseou (0 se a célula estava vazia).
+    """
+    celulas = {}
+    erros = []
+    for item in dados:
+        try:
+            matricula_id = int(item['matricula_id'])
+            td = turma_disciplina_id if turma_disciplina_id is not None else int(item['turma_disciplina_id'])
+            versao = int(item.get('versao') or 0)
+            nota = item.get('nota')
+            if nota is not None:
+                nota = float(str(nota).replace(',', '.'))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            erros.append({'celula': item, 'erro': 'Célula inválida.'})
+            continue
+        if nota is not None and (not math.isfinite(nota) or nota < 0 or nota > 20):
+            erros.append({'celula': item, 'erro': 'Nota inválida. Use um número entre 0 e 20.'})
+            continue
+        celulas[(matricula_id, td)] = (nota, versao)
+    return celulas, erros
+
+
+def sincronizar_notas(db, turma_id, trimestre, celulas, desde, turma_disciplinas=None):
+    """Aplicar só as células alteradas pelo cliente, com concorrência optimista.
+
+    Uma célula cuja versão no servidor difere da versão enviada (e cujo
+    valor também difere) não é gravada e volta em ``conflitos``, tal como
+    as células alteradas de disciplinas cujas notas do trimestre vêm das
+    avaliações. Devolve também as células alteradas no servidor desde a
+    versão ``desde``.
+    """
+    def sincronizar(db):
+        matriculas, validas = _celulas_validas(db, turma_id)
+        pedidas = [
+            td for td in (sorted(validas) if turma_disciplinas is None else turma_disciplinas)
+            if td in validas
+        ]
+
+        tocadas = {td for (_, td) in celulas if td in pedidas}
+        estado = _estado_atual(db, trimestre, tocadas)
+        bloqueadas = avaliadas(db, trimestre, tocadas)
+
+        upserts = []
+        deletes = []
+        conflitos = []
+        for (matricula_id, td), (nota, versao_base) in celulas.items():
+            if matricula_id not in matriculas or td not in tocadas:
+                continue
+            nota_atual, versao_atual = estado.get((matricula_id, td), (None, 0))
+            if nota == nota_atual:
+                continue
+            if versao_base != versao_atual or td in bloqueadas:
+                conflitos.append({
+                    'matricula_id': matricula_id,
+                    'turma_disciplina_id': td,
+                    'nota': nota_atual,
+                    'versao': versao_atual
+                })
+                continue
+            if nota is None:
+                deletes.append((matricula_id, td))
+            else:
+                upserts.append((matricula_id, td, nota))
+
+        aplicar_celulas(db, trimestre, upserts, deletes)
+        alteracoes = alteracoes_desde(db, trimestre, pedidas, desde)
+        versao = ler_contador(db, 'notas')
+        return {'versao': versao, 'alteracoes': alteracoes, 'conflitos': conflitos}
+
+    if celulas:
+        return transaccao(db, sincronizar)
+
+    # Sem células para gravar basta um snapshot de leitura (os pedidos GET
+    # já correm num, na conexão só de leitura)
+    if db.in_transaction:
+        return sincronizar(db)
+    db.execute('BEGIN')
+    try:
+        resultado = sincronizar(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return resultado
+
+
+class MatrizNotas:
+    """Grelha densa de notas de uma turma num trimestre.
+
+    As notas ficam num único ``array('d')`` indexado por linha (matrícula)
+    e coluna (turma_disciplina), com NaN nas células vazias. Médias e
+    contagens por linha e por coluna são calculadas uma só vez.
+    """
+
+    __slots__ = (
+        'matriculas', 'nomes', 'turma_disciplinas', 'disciplinas', 'valores',
+        'medias_linhas', 'medias_colunas', 'preenchidas_linhas', 'preenchidas_colunas'
+    )
+
+    def __init__(self, matriculas, nomes, turma_disciplinas, disciplinas):
+        self.matriculas = matriculas
+        self.nomes = nomes
+        self.turma_disciplinas = turma_disciplinas
+        self.disciplinas = disciplinas
+        self.valores = array('d', [math.nan]) * (len(matriculas) * len(turma_disciplinas))
+
+    @classmethod
+    def carregar(cls, db, turma_id, trimestre):
+        cur = db.cursor()
+        cur.row_factory = None
+
+        matriculas = array('q')
+        nomes = []
+        for matricula_id, nome in cur.execute(
+            '''
+            SELECT m.id, a.nome
+            FROM Matriculas m
+            JOIN Alunos a ON a.id = m.aluno_id
+            WHERE m.turma_id = ? AND m.status = 'ativa'
+            ORDER BY a.nome
+            ''',
+            (turma_id,)
+        ):
+            matriculas.append(matricula_id)
+            nomes.append(nome)
+
+        turma_disciplinas = array('q')
+        disciplinas = []
+        for turma_disciplina_id, nome in cur.execute(
+            '''
+            SELECT td.id, d.nome
+            FROM TurmaDisciplinas td
+            JOIN Disciplinas d ON d.id = td.disciplina_id
+            WHERE td.turma_id = ?
+            ORDER BY d.nome
+            ''',
+            (turma_id,)
+        ):
+            turma_disciplinas.append(turma_disciplina_id)
+            disciplinas.append(nome)
+
+        matriz = cls(matriculas, nomes, turma_disciplinas, disciplinas)
+        linha = {m: i for i, m in enumerate(matriculas)}
+        coluna = {td: j for j, td in enumerate(turma_disciplinas)}
+        largura = len(turma_disciplinas)
+        valores = matriz.valores
+        for matricula_id, turma_disciplina_id, nota in cur.execute(
+            '''
+            SELECT nt.matricula_id, nt.turma_disciplina_id, nt.nota
+            FROM NotasTrimestrais nt
+            JOIN TurmaDisciplinas td ON td.id = nt.turma_disciplina_id
+            WHERE td.turma_id = ? AND nt.trimestre = ?
+            ''',
+            (turma_id, trimestre)
+        ):
+            i = linha.get(matricula_id)
+            if i is not None:
+                valores[i * largura + coluna[turma_disciplina_id]] = nota
+
+        matriz._agregar()
+        return matriz
+
+    def _agregar(self):
+        altura = len(self.matriculas)
+        largura = len(self.turma_disciplinas)
+        somas_colunas = [0.0] * largura
+        contagens_colunas = [0] * largura
+        self.medias_linhas = array('d')
+        self.preenchidas_linhas = array('q')
+        for i in range(altura):
+            soma = 0.0
+            contagem = 0
+            for j, nota in enumerate(self.valores[i * largura:(i + 1) * largura]):
+                if nota == nota:
+                    soma += nota
+                    contagem += 1
+                    somas_colunas[j] += nota
+                    contagens_colunas[j] += 1
+            self.medias_linhas.append(soma / contagem if contagem else math.nan)
+            self.preenchidas_linhas.append(contagem)
+        self.medias_colunas = array('d', (
+            s / c if c else math.nan for s, c in zip(somas_colunas, contagens_colunas)
+        ))
+        self.preenchidas_colunas = array('q', contagens_colunas)
+
+    @property
+    def total(self):
+        return len(self.valores)
+
+    @property
+    def preenchidas(self):
+        return sum(self.preenchidas_linhas)
+
+    def nota(self, i, j):
+        nota = self.valores[i * len(self.turma_disciplinas) + j]
+        return None if nota != nota else nota
+
+    def linha(self, i):
+        """Pares ``(turma_disciplina_id, nota)`` da linha ``i``."""
+        largura = len(self.turma_disciplinas)
+        for turma_disciplina_id, nota in zip(
+            self.turma_disciplinas, self.valores[i * largura:(i + 1) * largura]
+        ):
+            yield turma_disciplina_id, (None if nota != nota else nota)
+
+    def media_linha(self, i):
+        media = self.medias_linhas[i]
+        return None if media != media else media
+
+    def media_coluna(self, j):
+        media = self.medias_colunas[j]
+        return None if media != media else media
+
+    def to_json(self):
+        def limpar(valores):
+            return [None if v != v else v for v in valores]
+
+        return {
+            'matriculas': self.matriculas.tolist(),
+            'nomes': self.nomes,
+            'turma_disciplinas': self.turma_disciplinas.tolist(),
+            'disciplinas': self.disciplinas,
+            'notas': limpar(self.valores),
+            'medias_linhas': limpar(self.medias_linhas),
+            'medias_colunas': limpar(self.medias_colunas)
+        }
+
+
+def flash_resultado(trimestre, erros):
+    for erro in erros:
+        flash(erro)
+    if erros:
+        flash(f'Notas do {trimestre}º trimestre salvas, exceto {len(erros)} célula(s) inválida(s).')
+    else:
+        flash(f'Notas do {trimestre}º trimestre salvas com sucesso.')
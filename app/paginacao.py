@@ -0,0 +1,117 @@
+import base64
+import bisect
+import json
+
+from flask import current_app, request
+
+
+def gerar_cursor(valores):
+    # Datas convertidas com str() ficam no formato gravado pelo SQLite
+    valores = [
+        v if v is None or isinstance(v, (int, float, str)) else str(v)
+        for v in valores
+    ]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+
+def ler_cursor(token, n):
+    if not token:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(valores, list) or len(valores) != n:
+        return None
+    return valores
+
+
+def ler_limite():
+    padrao = current_app.config['PAGINA_TAMANHO']
+    try:
+        limite = int(request.args.get('limite', padrao))
+    except (TypeError, ValueError):
+        limite = padrao
+    return max(1, min(limite, current_app.config['PAGINA_TAMANHO_MAX']))
+
+
+def paginar(db, select, filtros, parametros, chaves, descendente=False):
+    """Devolver uma página de ``select`` ordenada pelas ``chaves``.
+
+    ``chaves`` é uma lista de pares ``(expressão SQL, coluna no resultado)``
+    que tem de identificar cada linha de forma única (terminar no id).
+    A posição vem de ``?depois=`` e a página seguinte começa logo após a
+    última linha devolvida, por isso o custo não depende da página.
+    Devolve ``(linhas, proximo)``; ``proximo`` é ``None`` na última página.
+    """
+    filtros = list(filtros)
+    parametros = list(parametros)
+    expressoes = [expressao for expressao, _ in chaves]
+
+    depois = ler_cursor(request.args.get('depois'), len(chaves))
+    if depois is not None:
+        filtros.append('({}) {} ({})'.format(
+            ', '.join(expressoes),
+            '<' if descendente else '>',
+            ', '.join('?' * len(chaves))
+        ))
+        parametros.extend(depois)
+
+    sql = select
+    if filtros:
+        sql += ' WHERE ' + ' AND '.join(filtros)
+    direccao = ' DESC' if descendente else ''
+    sql += ' ORDER BY ' + ', '.join(e + direccao for e in expressoes) + ' LIMIT ?'
+
+    limite = ler_limite()
+    parametros.append(limite + 1)
+    linhas = db.execute(sql, parametros).fetchall()
+
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo = gerar_cursor([linhas[-1][coluna] for _, coluna in chaves])
+    return linhas, proximo
+
+
+def paginar_lista(linhas, chaves):
+    """Como ``paginar``, para linhas já em memória e ordenadas pelas ``chaves``.
+
+    ``chaves`` são os nomes das colunas da ordenação (a última é o id).
+    """
+    depois = ler_cursor(request.args.get('depois'), len(chaves))
+    if depois is not None:
+        try:
+            inicio = bisect.bisect_right(
+                linhas, tuple(depois), key=lambda linha: tuple(linha[c] for c in chaves)
+            )
+        except TypeError:
+            # Cursor com tipos que não correspondem às colunas: ignorar
+            inicio = 0
+        linhas = linhas[inicio:]
+
+    limite = ler_limite()
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo = gerar_cursor([linhas[-1][coluna] for coluna in chaves])
+    return linhas, proximo
+
+
+def pedido_json():
+    return request.args.get('formato') == 'json'
+
+
+def resposta_json(linhas, proximo):
+    return {'itens': [dict(linha) for linha in linhas], 'proximo': proximo}
+
+
+def ler_filtros(*nomes):
+    """Filtros inteiros presentes na query string (os inválidos são ignorados)."""
+    filtros = {}
+    for nome in nomes:
+        try:
+            filtros[nome] = int(request.args[nome])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return filtros
@@ -0,0 +1,225 @@
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+
+import click
+from flask import current_app, g, request
+
+logger = logging.getLogger('app.sql')
+
+_literais = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_listas = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_espacos = re.compile(r'\s+')
+
+
+def normalizar_sql(sql):
+    """Forma canónica de uma instrução, sem literais nem espaços extra."""
+    sql = _literais.sub('?', sql)
+    sql = _listas.sub('(?...)', sql)
+    return _espacos.sub(' ', sql).strip()
+
+
+class _Registo:
+    __slots__ = ('sql', 'parametros', 'segundos', 'linhas')
+
+    def __init__(self, sql, parametros):
+        self.sql = sql
+        self.parametros = parametros
+        self.segundos = 0.0
+        self.linhas = 0
+
+
+class CursorInstrumentado:
+    """Cursor que soma ao registo da instrução o tempo e as linhas lidas."""
+
+    def __init__(self, cursor, registos):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_registos', registos)
+        object.__setattr__(self, '_registo', None)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __setattr__(self, nome, valor):
+        setattr(self._cursor, nome, valor)
+
+    def _medir(self, funcao, *args):
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args)
+        finally:
+            if self._registo is not None:
+                self._registo.segundos += time.perf_counter() - inicio
+
+    def execute(self, sql, parametros=()):
+        registo = _Registo(sql, parametros)
+        object.__setattr__(self, '_registo', registo)
+        self._registos.append(registo)
+        self._medir(self._cursor.execute, sql, parametros)
+        return self
+
+    def executemany(self, sql, seq_parametros):
+        registo = _Registo(sql, None)
+        object.__setattr__(self, '_registo', registo)
+        self._registos.append(registo)
+        self._medir(self._cursor.executemany, sql, seq_parametros)
+        return self
+
+    def fetchone(self):
+        linha = self._medir(self._cursor.fetchone)
+        if linha is not None and self._registo is not None:
+            self._registo.linhas += 1
+        return linha
+
+    def fetchmany(self, size=None):
+        linhas = self._medir(self._cursor.fetchmany, size or self._cursor.arraysize)
+        if self._registo is not None:
+            self._registo.linhas += len(linhas)
+        return linhas
+
+    def fetchall(self):
+        linhas = self._medir(self._cursor.fetchall)
+        if self._registo is not None:
+            self._registo.linhas += len(linhas)
+        return linhas
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        linha = self.fetchone()
+        if linha is None:
+            raise StopIteration
+        return linha
+
+
+class ConexaoInstrumentada:
+    """Envolve uma conexão do pool e regista cada instrução executada."""
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.registos = []
+
+    def __getattr__(self, nome):
+        return getattr(self.conexao, nome)
+
+    def cursor(self):
+        return CursorInstrumentado(self.conexao.cursor(), self.registos)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, seq_parametros):
+        return self.cursor().executemany(sql, seq_parametros)
+
+    def executescript(self, script):
+        return self.conexao.executescript(script)
+
+
+def instrumentar(conexao):
+    return ConexaoInstrumentada(conexao)
+
+
+def _plano(conexao, registo):
+    if registo.parametros is None:
+        return None
+    try:
+        return [
+            linha[3] for linha in
+            conexao.execute('EXPLAIN QUERY PLAN ' + registo.sql, registo.parametros).fetchall()
+        ]
+    except Exception:
+        return None
+
+
+def _registar_pedido(e=None):
+    db = g.get('db')
+    if not isinstance(db, ConexaoInstrumentada) or not db.registos:
+        return
+
+    config = current_app.config
+    limite = config['SQL_SLOW_MS'] / 1000.0
+    instrucoes = defaultdict(lambda: [0, 0.0, 0])
+    lentas = []
+    for registo in db.registos:
+        sql = normalizar_sql(registo.sql)
+        agregado = instrucoes[sql]
+        agregado[0] += 1
+        agregado[1] += registo.segundos
+        agregado[2] += registo.linhas
+        if registo.segundos >= limite and len(lentas) < config['SQL_EXPLAIN_MAX']:
+            lentas.append({
+                'sql': sql,
+                'ms': round(registo.segundos * 1000, 3),
+                'linhas': registo.linhas,
+                'plano': _plano(db.conexao, registo)
+            })
+
+    perfil = {
+        'ts': time.time(),
+        'endpoint': request.endpoint,
+        'metodo': request.method,
+        'caminho': request.path,
+        'instrucoes': len(db.registos),
+        'ms': round(sum(r.segundos for r in db.registos) * 1000, 3),
+        'linhas': sum(r.linhas for r in db.registos),
+        'sql': [
+            {'sql': sql, 'n': n, 'ms': round(segundos * 1000, 3), 'linhas': linhas}
+            for sql, (n, segundos, linhas) in instrucoes.items()
+        ],
+        'lentas': lentas
+    }
+    g.sql_perfil = perfil
+
+    for lenta in lentas:
+        logger.warning(json.dumps(
+            dict(lenta, endpoint=perfil['endpoint'], caminho=perfil['caminho']),
+            ensure_ascii=False
+        ))
+
+    ficheiro = config['SQL_PROFILE_LOG']
+    if ficheiro:
+        with open(ficheiro, 'a', encoding='utf8') as f:
+            f.write(json.dumps(perfil, ensure_ascii=False) + '\n')
+
+
+@click.command('db-profile')
+@click.option('--ficheiro', help='Ficheiro JSONL gravado com SQL_PROFILE activo.')
+@click.option('--ordem', type=click.Choice(['ms', 'n', 'media', 'linhas']), default='ms')
+@click.option('--limite', default=20, show_default=True)
+@click.option('--endpoint', help='Considerar só pedidos deste endpoint.')
+def db_profile_command(ficheiro, ordem, limite, endpoint):
+    """Relatório das instruções SQL registadas, agrupadas por texto normalizado."""
+    ficheiro = ficheiro or current_app.config['SQL_PROFILE_LOG']
+    agregado = defaultdict(lambda: {'n': 0, 'ms': 0.0, 'linhas': 0, 'endpoints': set()})
+    pedidos = 0
+    with open(ficheiro, encoding='utf8') as f:
+        for linha in f:
+            perfil = json.loads(linha)
+            if endpoint and perfil['endpoint'] != endpoint:
+                continue
+            pedidos += 1
+            for item in perfil['sql']:
+                a = agregado[item['sql']]
+                a['n'] += item['n']
+                a['ms'] += item['ms']
+                a['linhas'] += item['linhas']
+                a['endpoints'].add(perfil['endpoint'])
+
+    for a in agregado.values():
+        a['media'] = a['ms'] / a['n']
+
+    click.echo(f'{pedidos} pedido(s), {len(agregado)} instrução(ões) distintas')
+    click.echo(f'{"n":>8} {"total ms":>12} {"média ms":>10} {"linhas":>10}  sql')
+    for sql, a in sorted(agregado.items(), key=lambda x: x[1][ordem], reverse=True)[:limite]:
+        click.echo(f'{a["n"]:>8} {a["ms"]:>12.2f} {a["media"]:>10.3f} {a["linhas"]:>10}  {sql[:120]}')
+        click.echo(f'{"":>44}  {", ".join(sorted(str(e) for e in a["endpoints"]))}')
+
+
+def init_app(app):
+    # teardown_request corre antes de teardown_appcontext, ou seja, com o
+    # pedido ainda disponível e antes de a conexão voltar ao pool
+    app.teardown_request(_registar_pedido)
+    app.cli.add_command(db_profile_command)
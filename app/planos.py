@@ -0,0 +1,216 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+
+import click
+from flask import g, request
+
+from app.desempenho import base_sintetica, contexto
+from app.perfil import normalizar_sql
+from app.sintetico import TRIMESTRE_ABERTO
+
+# Consultas críticas e o índice que cada uma tem de usar: (fragmento do
+# SQL normalizado, tabela ou alias no plano, índice)
+ESPERADOS = [
+    ('WHERE doc.professor_id = ? AND doc.data_fim IS NULL ORDER BY', 'doc', 'idx_docencia_professor'),
+    ('LEFT JOIN Docencia doc ON doc.turma_disciplina_id = td.id AND doc.data_fim IS NULL', 'doc',
+     'idx_docencia_activa_turma_disciplina'),
+    ('WHERE m.turma_id = ? AND m.status = ?', 'm', 'idx_matriculas_turma_status'),
+    ('FROM NotasTrimestrais WHERE turma_disciplina_id = ? AND trimestre = ?', 'NotasTrimestrais',
+     'idx_notas_tri_td_trimestre'),
+    ('FROM Usuarios WHERE username = ? OR email = ?', 'Usuarios', 'sqlite_autoindex_Usuarios_'),
+    ("WHERE u.status = ? AND u.papel = ?", 'u', 'idx_usuarios_pendentes'),
+    ('FROM Anuncios ORDER BY data_publicacao DESC', 'Anuncios', 'idx_anuncios_data_publicacao'),
+    ('JOIN FaltasDisciplinas fd ON fd.turma_disciplina_id = td.id AND fd.faltas > ?', 'fd',
+     'idx_faltas_disciplinas_td_faltas'),
+    # json_each num GET: corre na conexão só de leitura, com o autorizador
+    ('FROM Avaliacoes WHERE trimestre = ? AND turma_disciplina_id IN (SELECT value FROM json_each(?))',
+     'Avaliacoes', 'idx_avaliacoes_td_trimestre'),
+]
+
+# Varrimentos completos aceites: (endpoint, tabela ou alias) -> motivo; o
+# endpoint None aceita o varrimento em qualquer vista
+PERMITIDOS = {
+    ('admin.docencia_turma', 'Professores'): 'lista de todos os professores para a atribuição',
+    ('admin.turmas', 't'): 'listagem de todas as turmas, em stream',
+    ('admin.matricular', 't'): 'lista de todas as turmas para o select',
+    # Carregamento da cache de referência, no primeiro pedido que a usa
+    (None, 'Cursos'): 'tabela de referência, lida uma vez por versão',
+    (None, 'AnoLectivo'): 'tabela de referência, lida uma vez por versão',
+    (None, 'Disciplinas'): 'tabela de referência, lida uma vez por versão',
+    # Listas de ids passadas num só parâmetro JSON; cada valor é uma procura por chave
+    (None, 'json_each'): 'percorre só os valores do parâmetro',
+}
+
+_scan = re.compile(r'^SCAN (?!CONSTANT ROW)(\S+)(?: USING (?:COVERING )?INDEX (\S+))?')
+_indice = re.compile(r'^(?:SEARCH|SCAN) (\S+) USING (?:COVERING )?INDEX (\S+)')
+
+
+def _pedidos(ctx, aluno_id):
+    turma = ctx['turma_id']
+    td = ctx['turma_disciplina_id']
+    admin = ctx['admin_user_id']
+    prof = ctx['professor_user_id']
+    notas_prof = {'trimestre': str(TRIMESTRE_ABERTO), **{f'nota-{m}': '12' for m in ctx['matriculas']}}
+    notas_turma = {'trimestre': str(TRIMESTRE_ABERTO), **{
+        f'nota-{m}-{t}': '12' for m in ctx['matriculas'] for t in ctx['turma_disciplinas']
+    }}
+    return [
+        (None, 'GET', '/', None),
+        (None, 'GET', '/anuncios?limite=5', None),
+        (None, 'POST', '/auth/login', {'username': 'ninguem', 'password': 'x'}),
+        (aluno_id, 'GET', '/student/area', None),
+        (prof, 'GET', '/professor/', None),
+        (prof, 'GET', f'/professor/turma_disciplina/{td}/notas?trimestre=1', None),
+        (prof, 'GET', f'/professor/turma_disciplina/{td}/notas/1/sync?desde=0', None),
+        (prof, 'POST', f'/professor/turma_disciplina/{td}/notas/salvar', notas_prof),
+        (prof, 'GET', f'/professor/turma_disciplina/{td}/aulas', None),
+        (prof, 'GET', f'/professor/aula/{ctx["aula_id"]}/chamada', None),
+        (prof, 'POST', f'/professor/aula/{ctx["aula_id"]}/chamada', {f'estado-{ctx["matriculas"][0]}': 'falta'}),
+        (admin, 'GET', '/admin/cursos?limite=2', None),
+        (admin, 'GET', '/admin/disciplinas?limite=5&classe=10', None),
+        (admin, 'GET', '/admin/turmas', None),
+        (admin, 'GET', '/admin/matricular?limite=5&status=1', None),
+        (admin, 'GET', '/admin/anuncios?limite=5', None),
+        (admin, 'GET', '/admin/aprovar_alunos', None),
+        (admin, 'GET', '/admin/criar_turma', None),
+        (admin, 'GET', f'/admin/turma/{turma}', None),
+        (admin, 'GET', f'/admin/turma/{turma}/notas?trimestre=1', None),
+        (admin, 'GET', f'/admin/turma/{turma}/notas/1/grelha', None),
+        (admin, 'GET', f'/admin/turma/{turma}/notas/1/sync?desde=0', None),
+        (admin, 'GET', f'/admin/turma/{turma}/docencia', None),
+        (admin, 'GET', f'/admin/turma/{turma}/faltas', None),
+        (admin, 'POST', f'/admin/turma/{turma}/notas/salvar', notas_turma),
+    ]
+
+
+def _explicar(conexao, registo):
+    try:
+        return [linha[3] for linha in conexao.execute(
+            'EXPLAIN QUERY PLAN ' + registo.sql, registo.parametros
+        ).fetchall()]
+    except sqlite3.Error:
+        return None
+
+
+def verificar(escala='pequena', seed=42):
+    """Executar as vistas e analisar o plano de cada instrução SQL.
+
+    Devolve ``(planos, problemas)``: ``planos`` mapeia cada instrução
+    normalizada para ``{'endpoints', 'plano'}``; ``problemas`` lista os
+    varrimentos completos não permitidos e os índices esperados em falta.
+    """
+    from app import create_app
+    from app.db import fechar_pools, get_db
+
+    pasta = tempfile.mkdtemp(prefix='planos-')
+    database = os.path.join(pasta, 'app.sqlite')
+    shutil.copyfile(base_sintetica(escala, seed), database)
+
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': database,
+        'SQL_PROFILE': True,
+        'SQL_PROFILE_LOG': None,
+        'SQL_SLOW_MS': float('inf'),
+        'PASSWORD_HASH_WORKERS': 0,
+        'DB_LEITURA_VERIFICAR': True,
+    })
+    registos = []
+
+    # Registado depois do perfil, corre antes dele e com g.db ainda aberto
+    @app.teardown_request
+    def recolher(e=None):
+        db = g.get('db')
+        if db is not None and hasattr(db, 'registos'):
+            registos.extend((request.endpoint, r) for r in db.registos)
+
+    planos = {}
+    try:
+        with app.app_context():
+            db = get_db()
+            ctx = contexto(db)
+            aluno_id = db.execute(
+                "SELECT id FROM Usuarios WHERE papel = 'aluno' AND status = 'ativo' LIMIT 1"
+            ).fetchone()[0]
+
+        for user_id, metodo, caminho, dados in _pedidos(ctx, aluno_id):
+            cliente = app.test_client()
+            if user_id is not None:
+                with cliente.session_transaction() as sessao:
+                    sessao['user_id'] = user_id
+            resposta = cliente.open(caminho, method=metodo, data=dados)
+            resposta.get_data()
+            resposta.close()
+            if resposta.status_code not in (200, 302):
+                raise click.ClickException(f'{metodo} {caminho}: HTTP {resposta.status_code}')
+
+        conexao = sqlite3.connect(database)
+        try:
+            for endpoint, registo in registos:
+                sql = normalizar_sql(registo.sql)
+                if registo.parametros is None or not sql.upper().startswith(
+                        ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')):
+                    continue
+                entrada = planos.setdefault(sql, {'endpoints': set(), 'plano': None})
+                entrada['endpoints'].add(endpoint)
+                if entrada['plano'] is None:
+                    entrada['plano'] = _explicar(conexao, registo)
+        finally:
+            conexao.close()
+    finally:
+        with app.app_context():
+            fechar_pools()
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    problemas = []
+    for sql, entrada in planos.items():
+        for linha in entrada['plano'] or ():
+            m = _scan.match(linha)
+            if m is None or m.group(2) is not None and 'LIMIT' in sql:
+                continue
+            for endpoint in sorted(entrada['endpoints']):
+                if (endpoint, m.group(1)) not in PERMITIDOS and (None, m.group(1)) not in PERMITIDOS:
+                    problemas.append(f'{endpoint}: varrimento completo "{linha}" em: {sql}')
+
+    for fragmento, tabela, indice in ESPERADOS:
+        encontrados = [(sql, e) for sql, e in planos.items() if fragmento.lower() in sql.lower()]
+        if not encontrados:
+            problemas.append(f'Nenhuma vista executou a consulta esperada: {fragmento}')
+        for sql, entrada in encontrados:
+            usados = [
+                m.group(2) for m in map(_indice.match, entrada['plano'] or ())
+                if m is not None and m.group(1) == tabela
+            ]
+            if not any(u.startswith(indice) for u in usados):
+                problemas.append(f'{sql}: esperado {indice} em {tabela}, plano {entrada["plano"]}')
+
+    return planos, problemas
+
+
+@click.command('check-plans')
+@click.option('--escala', default='pequena', show_default=True)
+@click.option('--seed', default=42, show_default=True)
+@click.option('--mostrar', is_flag=True, help='Imprimir o plano de todas as instruções.')
+def check_plans_command(escala, seed, mostrar):
+    """Verificar os planos de consulta das vistas (falha em varrimentos completos)."""
+    planos, problemas = verificar(escala, seed)
+    if mostrar:
+        for sql, entrada in sorted(planos.items()):
+            click.echo(json.dumps({
+                'sql': sql,
+                'endpoints': sorted(str(e) for e in entrada['endpoints']),
+                'plano': entrada['plano']
+            }, ensure_ascii=False))
+    for problema in problemas:
+        click.echo(problema, err=True)
+    if problemas:
+        raise click.ClickException(f'{len(problemas)} problema(s) em {len(planos)} instruções.')
+    click.echo(f'{len(planos)} instruções verificadas, sem varrimentos completos.')
+
+
+def init_app(app):
+    app.cli.add_command(check_plans_command)
@@ -0,0 +1,261 @@
+import json
+import time
+
+import click
+
+from app.db import get_db
+from app.escritor import transaccao
+
+ESTADOS = ('presente', 'falta', 'justificada', 'atraso')
+# Estado de quem não vem no pedido: a chamada só envia as excepções
+ESTADO_OMISSAO = 'presente'
+# Estados contados em FaltasTrimestrais/FaltasDisciplinas, pela ordem das colunas
+CONTADOS = ('falta', 'justificada', 'atraso')
+
+# Máximo de faltas injustificadas numa disciplina durante o ano lectivo;
+# com mais o aluno fica acima do limite
+LIMITE_FALTAS = 15
+
+# Disciplinas que podem ser recalculadas de uma só vez
+_AMBITOS = {
+    'turma': 'td.turma_id = ?',
+    'ano_lectivo': 'td.turma_id IN (SELECT id FROM Turmas WHERE ano_lectivo_id = ?)',
+}
+
+
+def ler_excepcoes(form):
+    """Ler os campos ``estado-<matricula_id>`` de uma chamada.
+
+    Só as excepções precisam de vir no formulário; campos vazios ou com
+    ``presente`` são ignorados. Devolve ``(excepcoes, erros)``, com
+    ``excepcoes`` a mapear matricula_id para o estado.
+    """
+    excepcoes = {}
+    erros = []
+    for chave, valor in form.items():
+        if not chave.startswith('estado-'):
+            continue
+        try:
+            matricula_id = int(chave[len('estado-'):])
+        except ValueError:
+            erros.append(f'Campo inválido: {chave}')
+            continue
+        valor = (valor or '').strip()
+        if not valor or valor == ESTADO_OMISSAO:
+            continue
+        if valor not in ESTADOS:
+            erros.append(f'Estado inválido para a matrícula {matricula_id}: {valor}')
+            continue
+        excepcoes[matricula_id] = valor
+    return excepcoes, erros
+
+
+def abrir_aula(db, turma_disciplina_id, data, trimestre, conteudo=None):
+    """Devolver o id da aula da disciplina nesse dia, criando-a se ainda não existe.
+
+    Uma aula que já existe mantém o trimestre: as suas faltas já foram
+    contadas nele.
+    """
+    def abrir(db):
+        linha = db.execute(
+            'SELECT id FROM Aulas WHERE turma_disciplina_id = ? AND data = ?',
+            (turma_disciplina_id, data)
+        ).fetchone()
+        if linha is not None:
+            if conteudo:
+                db.execute('UPDATE Aulas SET conteudo = ? WHERE id = ?', (conteudo, linha[0]))
+            return linha[0]
+        # SELECT antes do INSERT: um ON CONFLICT gastaria um id do AUTOINCREMENT
+        return db.execute(
+            'INSERT INTO Aulas (turma_disciplina_id, data, trimestre, conteudo) VALUES (?, ?, ?, ?)',
+            (turma_disciplina_id, data, trimestre, conteudo)
+        ).lastrowid
+
+    return transaccao(db, abrir)
+
+
+def registar_chamada(db, aula, excepcoes):
+    """Gravar a presença de todos os alunos activos da turma numa aula.
+
+    Quem não está em ``excepcoes`` fica ``presente``. Todas as linhas vão
+    num só ``executemany``; as que já têm o estado pedido não são
+    reescritas. Excepções de matrículas que não estão activas na turma são
+    ignoradas. As contagens de faltas são acertadas na mesma transacção,
+    só para os alunos cujo estado mudou. Devolve o número de alunos
+    marcados.
+    """
+    def gravar(db):
+        activas = [row[0] for row in db.execute(
+            '''
+            SELECT m.id
+            FROM Matriculas m
+            JOIN TurmaDisciplinas td ON td.turma_id = m.turma_id
+            WHERE td.id = ? AND m.status = 'ativa'
+            ''',
+            (aula['turma_disciplina_id'],)
+        )]
+        anteriores = dict(db.execute(
+            'SELECT matricula_id, estado FROM Presencas WHERE aula_id = ?', (aula['id'],)
+        ).fetchall())
+        estados = {m: excepcoes.get(m, ESTADO_OMISSAO) for m in activas}
+        _contar(db, aula['turma_disciplina_id'], aula['trimestre'], [
+            (m, anteriores.get(m), estado)
+            for m, estado in estados.items() if anteriores.get(m) != estado
+        ])
+        db.executemany(
+            '''
+            INSERT INTO Presencas (aula_id, matricula_id, estado) VALUES (?, ?, ?)
+            ON CONFLICT(aula_id, matricula_id) DO UPDATE SET estado = excluded.estado
+            WHERE estado <> excluded.estado
+            ''',
+            [(aula['id'], m, estado) for m, estado in estados.items()]
+        )
+        return len(activas)
+
+    return transaccao(db, gravar)
+
+
+def _contar(db, turma_disciplina_id, trimestre, mudancas):
+    """Acertar FaltasTrimestrais e FaltasDisciplinas com as mudanças de estado.
+
+    ``mudancas`` são (matricula_id, estado anterior ou ``None``, estado
+    novo). Cada aluno soma a diferença às suas contagens; as linhas que
+    ficam a zero são apagadas.
+    """
+    deltas = []
+    for matricula_id, anterior, novo in mudancas:
+        delta = [(estado == novo) - (estado == anterior) for estado in CONTADOS]
+        if any(delta):
+            deltas.append((matricula_id, delta))
+    if not deltas:
+        return
+
+    db.executemany(
+        '''
+        INSERT INTO FaltasTrimestrais
+          (matricula_id, turma_disciplina_id, trimestre, faltas, justificadas, atrasos)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(matricula_id, turma_disciplina_id, trimestre) DO UPDATE SET
+          faltas = faltas + excluded.faltas,
+          justificadas = justificadas + excluded.justificadas,
+          atrasos = atrasos + excluded.atrasos
+        ''',
+        [(m, turma_disciplina_id, trimestre, *delta) for m, delta in deltas]
+    )
+    db.executemany(
+        '''
+        INSERT INTO FaltasDisciplinas (matricula_id, turma_disciplina_id, faltas, justificadas, atrasos)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(matricula_id, turma_disciplina_id) DO UPDATE SET
+          faltas = faltas + excluded.faltas,
+          justificadas = justificadas + excluded.justificadas,
+          atrasos = atrasos + excluded.atrasos
+        ''',
+        [(m, turma_disciplina_id, *delta) for m, delta in deltas]
+    )
+
+    # Só quem perdeu uma ausência pode ter ficado a zero
+    baixas = [m for m, delta in deltas if min(delta) < 0]
+    db.executemany(
+        '''
+        DELETE FROM FaltasTrimestrais
+        WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?
+          AND faltas = 0 AND justificadas = 0 AND atrasos = 0
+        ''',
+        [(m, turma_disciplina_id, trimestre) for m in baixas]
+    )
+    db.executemany(
+        '''
+        DELETE FROM FaltasDisciplinas
+        WHERE matricula_id = ? AND turma_disciplina_id = ?
+          AND faltas = 0 AND justificadas = 0 AND atrasos = 0
+        ''',
+        [(m, turma_disciplina_id) for m in baixas]
+    )
+
+
+def recalcular(db, turma_id=None, ano_lectivo_id=None):
+    """Recontar de raiz as faltas de uma turma, de um ano lectivo ou de todos.
+
+    Sem argumentos cada ano lectivo é recontado à vez. Não faz commit.
+    Devolve o número de linhas gravadas em FaltasDisciplinas.
+    """
+    if turma_id is not None:
+        ambito, valor = 'turma', turma_id
+    elif ano_lectivo_id is not None:
+        ambito, valor = 'ano_lectivo', ano_lectivo_id
+    else:
+        return sum(
+            recalcular(db, ano_lectivo_id=row[0])
+            for row in db.execute('SELECT id FROM AnoLectivo ORDER BY ano').fetchall()
+        )
+
+    onde = _AMBITOS[ambito]
+    for tabela in ('FaltasTrimestrais', 'FaltasDisciplinas'):
+        db.execute(
+            f'DELETE FROM {tabela} WHERE turma_disciplina_id IN (SELECT td.id FROM TurmaDisciplinas td WHERE {onde})',
+            (valor,)
+        )
+    db.execute(
+        f'''
+        INSERT INTO FaltasTrimestrais
+          (matricula_id, turma_disciplina_id, trimestre, faltas, justificadas, atrasos)
+        SELECT p.matricula_id, a.turma_disciplina_id, a.trimestre,
+               SUM(p.estado = 'falta'), SUM(p.estado = 'justificada'), SUM(p.estado = 'atraso')
+        FROM TurmaDisciplinas td
+        JOIN Aulas a ON a.turma_disciplina_id = td.id
+        JOIN Presencas p ON p.aula_id = a.id
+        WHERE {onde} AND p.estado <> '{ESTADO_OMISSAO}'
+        GROUP BY p.matricula_id, a.turma_disciplina_id, a.trimestre
+        ''',
+        (valor,)
+    )
+    return db.execute(
+        f'''
+        INSERT INTO FaltasDisciplinas (matricula_id, turma_disciplina_id, faltas, justificadas, atrasos)
+        SELECT ft.matricula_id, ft.turma_disciplina_id, SUM(ft.faltas), SUM(ft.justificadas), SUM(ft.atrasos)
+        FROM TurmaDisciplinas td
+        JOIN FaltasTrimestrais ft ON ft.turma_disciplina_id = td.id
+        WHERE {onde}
+        GROUP BY ft.matricula_id, ft.turma_disciplina_id
+        ''',
+        (valor,)
+    ).rowcount
+
+
+@click.command('rebuild-faltas')
+@click.option('--turma', 'turma_id', type=int, help='Só esta turma.')
+@click.option('--ano', type=int, help='Só este ano lectivo (ex.: 2025).')
+def rebuild_faltas_command(turma_id, ano):
+    """Recontar de raiz as faltas, justificadas e atrasos a partir das presenças."""
+    db = get_db()
+    inicio = time.perf_counter()
+    if ano is not None:
+        anos = db.execute('SELECT id FROM AnoLectivo WHERE ano = ?', (ano,)).fetchall()
+        if not anos:
+            raise click.ClickException(f'Ano lectivo {ano} não existe.')
+    else:
+        anos = db.execute('SELECT id FROM AnoLectivo ORDER BY ano').fetchall()
+
+    if turma_id is not None:
+        # Com --ano a turma tem de ser desse ano lectivo
+        turma = db.execute(
+            'SELECT 1 FROM Turmas WHERE id = ? AND ano_lectivo_id IN (SELECT value FROM json_each(?))',
+            (turma_id, json.dumps([row[0] for row in anos]))
+        ).fetchone()
+        if turma is None:
+            raise click.ClickException(
+                f'Turma {turma_id} não existe' + (f' no ano lectivo {ano}.' if ano is not None else '.')
+            )
+        lotes = [{'turma_id': turma_id}]
+    else:
+        # Uma transacção por ano lectivo para não prender o lock de escrita
+        lotes = [{'ano_lectivo_id': row[0]} for row in anos]
+    total = 0
+    for lote in lotes:
+        total += transaccao(db, lambda db: recalcular(db, **lote))
+    click.echo(f'{total} contagem(ns) por disciplina recalculada(s) em {time.perf_counter() - inicio:.1f}s.')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_faltas_command)
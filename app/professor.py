@@ -1,8 +1,14 @@
 import functools
+import math
 
-from flask import Blueprint, flash, g, redirect, render_template, request, url_for, session
+from flask import Blueprint, flash, g, jsonify, redirect, render_template, request, url_for, session
 
+from datetime import date
+
+from app import avaliacoes, condicional, presencas, repositorio
 from app.db import get_db
+from app.escritor import transaccao
+from app.notas import avaliadas, flash_resultado, gravar_notas, ler_celulas, ler_celulas_json, sincronizar_notas
 
 bp = Blueprint('professor', __name__, url_prefix='/professor')
 
@@ -33,27 +39,7 @@ def professor_required(view):
 @professor_required
 def index():
     db = get_db()
-    docencias = db.execute(
-        '''
-        SELECT
-            td.id as turma_disciplina_id,
-            t.id as turma_id,
-            t.designacao,
-            t.ano,
-            c.nome as curso_nome,
-            d.nome as disciplina_nome,
-            a.ano as ano_lectivo
-        FROM Docencia doc
-        JOIN TurmaDisciplinas td ON td.id = doc.turma_disciplina_id
-        JOIN Turmas t ON t.id = td.turma_id
-        JOIN Cursos c ON c.id = t.curso_id
-        JOIN Disciplinas d ON d.id = td.disciplina_id
-        JOIN AnoLectivo a ON a.id = t.ano_lectivo_id
-        WHERE doc.professor_id = ? AND doc.data_fim IS NULL
-        ORDER BY a.ano DESC, c.nome, t.ano, t.designacao, d.nome
-        ''',
-        (g.user['professor_id'],)
-    ).fetchall()
+    docencias = repositorio.docencias_professor(db, g.user['professor_id'])
 
     trimestre_default = session.get('prof_notas_trimestre', 1)
     if trimestre_default not in (1, 2, 3):
@@ -80,56 +66,27 @@ def notas_disciplina(turma_disciplina_id):
     if trimestre_int not in (1, 2, 3):
         trimestre_int = 1
 
-    session['prof_notas_trimestre'] = trimestre_int
+    # Só gravar se mudou: um cookie de sessão novo em cada resposta
+    # impediria o browser de revalidar a página com o ETag
+    if session.get('prof_notas_trimestre') != trimestre_int:
+        session['prof_notas_trimestre'] = trimestre_int
 
     db = get_db()
 
-    contexto = db.execute(
-        '''
-        SELECT
-            td.id as turma_disciplina_id,
-            t.id as turma_id,
-            t.designacao,
-            t.ano,
-            c.nome as curso_nome,
-            d.nome as disciplina_nome,
-            a.ano as ano_lectivo
-        FROM Docencia doc
-        JOIN TurmaDisciplinas td ON td.id = doc.turma_disciplina_id
-        JOIN Turmas t ON t.id = td.turma_id
-        JOIN Cursos c ON c.id = t.curso_id
-        JOIN Disciplinas d ON d.id = td.disciplina_id
-        JOIN AnoLectivo a ON a.id = t.ano_lectivo_id
-        WHERE doc.professor_id = ? AND doc.data_fim IS NULL AND td.id = ?
-        ''',
-        (g.user['professor_id'], turma_disciplina_id)
-    ).fetchone()
+    contexto = repositorio.docencia_professor(db, g.user['professor_id'], turma_disciplina_id)
 
     if contexto is None:
         flash('Acesso negado.')
         return redirect(url_for('professor.index'))
 
-    matriculas = db.execute(
-        '''
-        SELECT m.id as matricula_id, a.nome
-        FROM Matriculas m
-        JOIN Alunos a ON a.id = m.aluno_id
-        WHERE m.turma_id = ? AND m.status = 'ativa'
-        ORDER BY a.nome
-        ''',
-        (contexto['turma_id'],)
-    ).fetchall()
-
-    notas_rows = db.execute(
-        '''
-        SELECT matricula_id, nota
-        FROM NotasTrimestrais
-        WHERE turma_disciplina_id = ? AND trimestre = ?
-        ''',
-        (turma_disciplina_id, trimestre_int)
-    ).fetchall()
+    resposta = condicional.nao_modificado(
+        condicional.versao_notas_disciplina(db, turma_disciplina_id, trimestre_int)
+    )
+    if resposta is not None:
+        return resposta
 
-    notas = {row['matricula_id']: row['nota'] for row in notas_rows}
+    matriculas = repositorio.matriculas_activas(db, contexto['turma_id'])
+    notas = repositorio.notas_disciplina(db, turma_disciplina_id, trimestre_int)
 
     total_esperado = len(matriculas)
     total_preenchido = len(notas)
@@ -140,6 +97,7 @@ def notas_disciplina(turma_disciplina_id):
         trimestre=trimestre_int,
         matriculas=matriculas,
         notas=notas,
+        avaliada=bool(avaliadas(db, trimestre_int, [turma_disciplina_id])),
         total_esperado=total_esperado,
         total_preenchido=total_preenchido
     )
@@ -161,86 +119,276 @@ def salvar_notas_disciplina(turma_disciplina_id):
 
     db = get_db()
 
-    contexto = db.execute(
-        '''
-        SELECT
-            td.id as turma_disciplina_id,
-            t.id as turma_id
-        FROM Docencia doc
-        JOIN TurmaDisciplinas td ON td.id = doc.turma_disciplina_id
-        JOIN Turmas t ON t.id = td.turma_id
-        WHERE doc.professor_id = ? AND doc.data_fim IS NULL AND td.id = ?
-        ''',
-        (g.user['professor_id'], turma_disciplina_id)
-    ).fetchone()
+    turma_id = repositorio.turma_da_docencia(db, g.user['professor_id'], turma_disciplina_id)
+    if turma_id is None:
+        flash('Acesso negado.')
+        return redirect(url_for('professor.index'))
+
+    if avaliadas(db, trimestre_int, [turma_disciplina_id]):
+        flash(f'As notas do {trimestre_int}º trimestre são calculadas a partir das avaliações.')
+        return redirect(url_for('professor.notas_disciplina', turma_disciplina_id=turma_disciplina_id, trimestre=trimestre_int))
+
+    celulas, erros = ler_celulas(request.form, lambda sufixo: (int(sufixo), turma_disciplina_id))
+    gravar_notas(db, turma_id, trimestre_int, celulas)
+    flash_resultado(trimestre_int, erros)
+    return redirect(url_for('professor.notas_disciplina', turma_disciplina_id=turma_disciplina_id, trimestre=trimestre_int))
 
+
+
+@bp.route('/turma_disciplina/<int:turma_disciplina_id>/notas/<int:trimestre>/sync', methods=['GET', 'POST'])
+@professor_required
+def sync_notas_disciplina(turma_disciplina_id, trimestre):
+    if trimestre not in (1, 2, 3):
+        return jsonify({'erro': 'Trimestre inválido.'}), 400
+
+    if request.method == 'POST':
+        dados = request.get_json(silent=True)
+        if not isinstance(dados, dict):
+            return jsonify({'erro': 'Pedido inválido.'}), 400
+        itens = dados.get('celulas') or []
+    else:
+        dados = request.args
+        itens = []
+
+    try:
+        desde = int(dados.get('desde') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'erro': 'Versão inválida.'}), 400
+
+    db = get_db()
+
+    turma_id = repositorio.turma_da_docencia(db, g.user['professor_id'], turma_disciplina_id)
+    if turma_id is None:
+        return jsonify({'erro': 'Acesso negado.'}), 403
+
+    celulas, erros = ler_celulas_json(itens, turma_disciplina_id)
+    resultado = sincronizar_notas(
+        db, turma_id, trimestre, celulas, desde, [turma_disciplina_id]
+    )
+    resultado['erros'] = erros
+    return jsonify(resultado)
+
+
+def _avaliacao(db, avaliacao_id):
+    """Avaliação com o contexto da disciplina, ou ``None`` se o professor não a lecciona."""
+    avaliacao = db.execute('SELECT * FROM Avaliacoes WHERE id = ?', (avaliacao_id,)).fetchone()
+    if avaliacao is None:
+        return None, None
+    contexto = repositorio.docencia_professor(db, g.user['professor_id'], avaliacao['turma_disciplina_id'])
+    if contexto is None:
+        return None, None
+    return avaliacao, contexto
+
+
+@bp.route('/turma_disciplina/<int:turma_disciplina_id>/avaliacoes', methods=['GET', 'POST'])
+@professor_required
+def avaliacoes_disciplina(turma_disciplina_id):
+    db = get_db()
+    contexto = repositorio.docencia_professor(db, g.user['professor_id'], turma_disciplina_id)
     if contexto is None:
         flash('Acesso negado.')
         return redirect(url_for('professor.index'))
 
-    valid_matriculas_rows = db.execute(
-        "SELECT id FROM Matriculas WHERE turma_id = ? AND status = 'ativa'",
-        (contexto['turma_id'],)
+    if request.method == 'POST':
+        tipo = request.form.get('tipo')
+        titulo = (request.form.get('titulo') or '').strip() or None
+        try:
+            trimestre = int(request.form.get('trimestre'))
+            data = date.fromisoformat(request.form.get('data') or '').isoformat()
+            peso = float((request.form.get('peso') or '1').replace(',', '.'))
+            nota_max = float((request.form.get('nota_max') or '20').replace(',', '.'))
+        except (TypeError, ValueError):
+            trimestre = None
+        if (trimestre not in (1, 2, 3) or tipo not in avaliacoes.TIPOS
+                or not math.isfinite(peso) or peso <= 0 or not math.isfinite(nota_max) or nota_max <= 0):
+            flash('Dados da avaliação inválidos.')
+        else:
+            avaliacoes.criar_avaliacao(db, turma_disciplina_id, trimestre, tipo, titulo, data, peso, nota_max)
+            flash('Avaliação criada.')
+        return redirect(url_for(
+            'professor.avaliacoes_disciplina', turma_disciplina_id=turma_disciplina_id,
+            trimestre=trimestre if trimestre in (1, 2, 3) else None
+        ))
+
+    try:
+        trimestre = int(request.args.get('trimestre') or session.get('prof_notas_trimestre', 1))
+    except (TypeError, ValueError):
+        trimestre = 1
+    if trimestre not in (1, 2, 3):
+        trimestre = 1
+
+    lista = db.execute(
+        '''
+        SELECT a.*, (SELECT COUNT(*) FROM Notas n WHERE n.avaliacao_id = a.id) as lancadas
+        FROM Avaliacoes a
+        WHERE a.turma_disciplina_id = ? AND a.trimestre = ?
+        ORDER BY a.data, a.id
+        ''',
+        (turma_disciplina_id, trimestre)
     ).fetchall()
-    valid_matriculas = {row['id'] for row in valid_matriculas_rows}
+    return render_template(
+        'professor/avaliacoes.html',
+        contexto=contexto,
+        trimestre=trimestre,
+        avaliacoes=lista,
+        tipos=avaliacoes.TIPOS,
+        hoje=date.today().isoformat()
+    )
+
+
+@bp.route('/turma_disciplina/<int:turma_disciplina_id>/avaliacoes/recalcular', methods=['POST'])
+@professor_required
+def recalcular_avaliacoes(turma_disciplina_id):
+    db = get_db()
+    if repositorio.docencia_professor(db, g.user['professor_id'], turma_disciplina_id) is None:
+        flash('Acesso negado.')
+        return redirect(url_for('professor.index'))
 
-    for key, value in request.form.items():
-        if not key.startswith('nota-'):
-            continue
+    alteradas = transaccao(db, lambda db: avaliacoes.recalcular(db, turma_disciplina_id))
+    flash(f'Notas trimestrais recalculadas ({alteradas} alteração(ões)).')
+    return redirect(url_for('professor.avaliacoes_disciplina', turma_disciplina_id=turma_disciplina_id))
 
-        parts = key.split('-', 1)
-        if len(parts) != 2:
-            continue
 
-        try:
-            matricula_id = int(parts[1])
-        except (TypeError, ValueError):
-            flash('Dados inválidos nas notas.')
-            return redirect(url_for('professor.notas_disciplina', turma_disciplina_id=turma_disciplina_id, trimestre=trimestre_int))
+@bp.route('/avaliacao/<int:avaliacao_id>/notas', methods=['GET', 'POST'])
+@professor_required
+def notas_avaliacao(avaliacao_id):
+    db = get_db()
+    avaliacao, contexto = _avaliacao(db, avaliacao_id)
+    if avaliacao is None:
+        flash('Acesso negado.')
+        return redirect(url_for('professor.index'))
 
-        if matricula_id not in valid_matriculas:
-            continue
+    if request.method == 'POST':
+        celulas, erros = ler_celulas(request.form, int, avaliacao['nota_max'])
+        avaliacoes.gravar_notas_avaliacao(db, avaliacao, celulas)
+        for erro in erros:
+            flash(erro)
+        flash(f'Notas salvas; nota do {avaliacao["trimestre"]}º trimestre recalculada.')
+        return redirect(url_for('professor.notas_avaliacao', avaliacao_id=avaliacao_id))
+
+    matriculas = repositorio.matriculas_activas(db, contexto['turma_id'])
+    notas = dict(db.execute(
+        'SELECT matricula_id, nota FROM Notas WHERE avaliacao_id = ?', (avaliacao_id,)
+    ).fetchall())
+    trimestrais = repositorio.notas_disciplina(db, avaliacao['turma_disciplina_id'], avaliacao['trimestre'])
+    return render_template(
+        'professor/notas_avaliacao.html',
+        contexto=contexto,
+        avaliacao=avaliacao,
+        matriculas=matriculas,
+        notas=notas,
+        trimestrais=trimestrais
+    )
 
-        raw = (value or '').strip()
-        if raw == '':
-            db.execute(
-                'DELETE FROM NotasTrimestrais WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?',
-                (matricula_id, turma_disciplina_id, trimestre_int)
-            )
-            continue
 
-        try:
-            nota = float(raw.replace(',', '.'))
-        except ValueError:
-            flash('Nota inválida. Use um número entre 0 e 20.')
-            return redirect(url_for('professor.notas_disciplina', turma_disciplina_id=turma_disciplina_id, trimestre=trimestre_int))
+@bp.route('/avaliacao/<int:avaliacao_id>/deletar', methods=['POST'])
+@professor_required
+def deletar_avaliacao(avaliacao_id):
+    db = get_db()
+    avaliacao, _ = _avaliacao(db, avaliacao_id)
+    if avaliacao is None:
+        flash('Acesso negado.')
+        return redirect(url_for('professor.index'))
+
+    avaliacoes.apagar_avaliacao(db, avaliacao)
+    flash('Avaliação apagada; notas do trimestre recalculadas.')
+    return redirect(url_for(
+        'professor.avaliacoes_disciplina', turma_disciplina_id=avaliacao['turma_disciplina_id'],
+        trimestre=avaliacao['trimestre']
+    ))
 
-        if nota < 0 or nota > 20:
-            flash('Nota inválida. Use um número entre 0 e 20.')
-            return redirect(url_for('professor.notas_disciplina', turma_disciplina_id=turma_disciplina_id, trimestre=trimestre_int))
 
+def _aula(db, aula_id):
+    """Aula com o contexto da disciplina, ou ``None`` se o professor não a lecciona."""
+    aula = db.execute('SELECT * FROM Aulas WHERE id = ?', (aula_id,)).fetchone()
+    if aula is None:
+        return None, None
+    contexto = repositorio.docencia_professor(db, g.user['professor_id'], aula['turma_disciplina_id'])
+    if contexto is None:
+        return None, None
+    return aula, contexto
+
+
+@bp.route('/turma_disciplina/<int:turma_disciplina_id>/aulas', methods=['GET', 'POST'])
+@professor_required
+def aulas_disciplina(turma_disciplina_id):
+    db = get_db()
+    contexto = repositorio.docencia_professor(db, g.user['professor_id'], turma_disciplina_id)
+    if contexto is None:
+        flash('Acesso negado.')
+        return redirect(url_for('professor.index'))
+
+    if request.method == 'POST':
+        conteudo = (request.form.get('conteudo') or '').strip() or None
         try:
-            db.execute(
-                '''
-                INSERT INTO NotasTrimestrais (matricula_id, turma_disciplina_id, trimestre, nota)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(matricula_id, turma_disciplina_id, trimestre)
-                DO UPDATE SET nota = excluded.nota
-                ''',
-                (matricula_id, turma_disciplina_id, trimestre_int, nota)
-            )
-        except Exception:
-            try:
-                db.execute(
-                    'INSERT INTO NotasTrimestrais (matricula_id, turma_disciplina_id, trimestre, nota) VALUES (?, ?, ?, ?)',
-                    (matricula_id, turma_disciplina_id, trimestre_int, nota)
-                )
-            except Exception:
-                db.execute(
-                    'UPDATE NotasTrimestrais SET nota = ? WHERE matricula_id = ? AND turma_disciplina_id = ? AND trimestre = ?',
-                    (nota, matricula_id, turma_disciplina_id, trimestre_int)
-                )
-
-    db.commit()
-    flash(f'Notas do {trimestre_int}º trimestre salvas com sucesso.')
-    return redirect(url_for('professor.notas_disciplina', turma_disciplina_id=turma_disciplina_id, trimestre=trimestre_int))
+            data = date.fromisoformat(request.form.get('data') or '').isoformat()
+            trimestre = int(request.form.get('trimestre'))
+        except (TypeError, ValueError):
+            trimestre = None
+        if trimestre not in (1, 2, 3):
+            flash('Data ou trimestre inválidos.')
+            return redirect(url_for('professor.aulas_disciplina', turma_disciplina_id=turma_disciplina_id))
+        aula_id = presencas.abrir_aula(db, turma_disciplina_id, data, trimestre, conteudo)
+        return redirect(url_for('professor.chamada_aula', aula_id=aula_id))
+
+    aulas = db.execute(
+        '''
+        SELECT a.id, a.data, a.trimestre, a.conteudo,
+               COUNT(p.id) as marcados,
+               COALESCE(SUM(p.estado = 'falta'), 0) as faltas,
+               COALESCE(SUM(p.estado = 'justificada'), 0) as justificadas,
+               COALESCE(SUM(p.estado = 'atraso'), 0) as atrasos
+        FROM Aulas a
+        LEFT JOIN Presencas p ON p.aula_id = a.id
+        WHERE a.turma_disciplina_id = ?
+        GROUP BY a.id
+        ORDER BY a.data DESC
+        ''',
+        (turma_disciplina_id,)
+    ).fetchall()
+    trimestre_default = session.get('prof_notas_trimestre', 1)
+    if trimestre_default not in (1, 2, 3):
+        trimestre_default = 1
+    return render_template(
+        'professor/aulas.html',
+        contexto=contexto,
+        aulas=aulas,
+        matriculas=repositorio.matriculas_activas(db, contexto['turma_id']),
+        faltas=repositorio.faltas_disciplina(db, turma_disciplina_id),
+        limite=presencas.LIMITE_FALTAS,
+        trimestre_default=trimestre_default,
+        hoje=date.today().isoformat()
+    )
+
+
+@bp.route('/aula/<int:aula_id>/chamada', methods=['GET', 'POST'])
+@professor_required
+def chamada_aula(aula_id):
+    db = get_db()
+    aula, contexto = _aula(db, aula_id)
+    if aula is None:
+        flash('Acesso negado.')
+        return redirect(url_for('professor.index'))
+
+    if request.method == 'POST':
+        excepcoes, erros = presencas.ler_excepcoes(request.form)
+        marcados = presencas.registar_chamada(db, aula, excepcoes)
+        for erro in erros:
+            flash(erro)
+        flash(f'Chamada de {aula["data"]} registada: {marcados} aluno(s), '
+              f'{len(excepcoes)} ausência(s) ou atraso(s).')
+        return redirect(url_for('professor.aulas_disciplina', turma_disciplina_id=aula['turma_disciplina_id']))
+
+    matriculas = repositorio.matriculas_activas(db, contexto['turma_id'])
+    estados = dict(db.execute(
+        'SELECT matricula_id, estado FROM Presencas WHERE aula_id = ?', (aula_id,)
+    ).fetchall())
+    return render_template(
+        'professor/chamada.html',
+        contexto=contexto,
+        aula=aula,
+        matriculas=matriculas,
+        estados=estados,
+        opcoes=presencas.ESTADOS,
+        omissao=presencas.ESTADO_OMISSAO
+    )
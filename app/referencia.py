@@ -0,0 +1,77 @@
+import threading
+
+from flask import current_app, g
+
+from app import repositorio
+from app.db import get_db, incrementar_contador, ler_contador
+
+# Contador da tabela Contadores que versiona Cursos, AnoLectivo e Disciplinas
+CONTADOR = 'referencia'
+
+_lock = threading.Lock()
+
+
+class DadosReferencia:
+    """Cópia imutável das tabelas de referência numa dada versão."""
+
+    def __init__(self, versao, cursos, anos_lectivos, disciplinas):
+        self.versao = versao
+        # Por id (ordem de criação), como na pré-inscrição
+        self.cursos = cursos
+        self.cursos_por_nome = sorted(cursos, key=lambda c: (c.nome, c.id))
+        self.curso_por_id = {c.id: c for c in cursos}
+        # Do ano lectivo mais recente para o mais antigo
+        self.anos_lectivos = anos_lectivos
+        self.disciplinas = sorted(disciplinas, key=lambda d: (d.nome, d.id))
+        self.disciplinas_por_classe = {}
+        for disciplina in disciplinas:
+            self.disciplinas_por_classe.setdefault(
+                (disciplina.curso_id, disciplina.ano), []
+            ).append(disciplina)
+
+    def disciplinas_curso(self, curso_id, ano):
+        return self.disciplinas_por_classe.get((curso_id, ano), ())
+
+
+def _carregar(db, versao):
+    return DadosReferencia(
+        versao,
+        repositorio.todas(db, 'SELECT id, nome, descricao, carga_horaria FROM Cursos ORDER BY id'),
+        repositorio.todas(db, 'SELECT id, ano FROM AnoLectivo ORDER BY ano DESC'),
+        repositorio.todas(db, '''
+            SELECT Disciplinas.*, c.nome as curso_nome
+            FROM Disciplinas
+            JOIN Cursos c ON c.id = Disciplinas.curso_id
+        ''')
+    )
+
+
+def dados():
+    """Tabelas de referência em memória, recarregadas quando a versão muda.
+
+    A versão é lida da tabela Contadores uma vez por pedido, por isso uma
+    alteração feita noutro worker é vista no pedido seguinte. Lê-se a
+    versão antes das tabelas: uma escrita concorrente deixa a cópia mais
+    nova do que a versão registada e força apenas uma recarga a mais.
+    """
+    if 'referencia' in g:
+        return g.referencia
+    db = get_db()
+    versao = ler_contador(db, CONTADOR)
+    actual = current_app.extensions.get('referencia')
+    if actual is None or actual.versao != versao:
+        with _lock:
+            actual = current_app.extensions.get('referencia')
+            if actual is None or actual.versao != versao:
+                actual = current_app.extensions['referencia'] = _carregar(db, versao)
+    g.referencia = actual
+    return actual
+
+
+def invalidar(db):
+    """Marcar as tabelas de referência como alteradas em todos os workers.
+
+    Chamar na transacção de escrita, antes do commit.
+    """
+    g.pop('referencia', None)
+    return incrementar_contador(db, CONTADOR)
@@ -0,0 +1,274 @@
+from datetime import datetime
+from operator import itemgetter
+
+# Colunas TIMESTAMP do esquema, convertidas para datetime ao serem lidas
+COLUNAS_TIMESTAMP = frozenset({
+    'data_matricula', 'data_contratacao', 'data_criacao', 'data_publicacao', 'criado_em'
+})
+
+_classes = {}
+
+
+def _converter(valor):
+    return datetime.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
+def _timestamp(indice):
+    return property(lambda linha: _converter(tuple.__getitem__(linha, indice)))
+
+
+class Linha(tuple):
+    """Tuplo com acesso por nome (``linha.nome`` ou ``linha['nome']``).
+
+    Mais leve do que ``sqlite3.Row``. As colunas de data/hora ficam como
+    texto e só são convertidas quando lidas pelo nome.
+    """
+
+    __slots__ = ()
+    _colunas = ()
+    _indices = {}
+
+    def __getitem__(self, chave):
+        if isinstance(chave, str):
+            valor = tuple.__getitem__(self, self._indices[chave])
+            return _converter(valor) if chave in COLUNAS_TIMESTAMP else valor
+        return tuple.__getitem__(self, chave)
+
+    def keys(self):
+        return self._colunas
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join(f'{c}={tuple.__getitem__(self, i)!r}' for i, c in enumerate(self._colunas))
+        )
+
+
+def classe_linha(colunas):
+    """Classe de linha (em cache) para uma sequência de nomes de colunas."""
+    colunas = tuple(colunas)
+    classe = _classes.get(colunas)
+    if classe is None:
+        atributos = {
+            '__slots__': (),
+            '_colunas': colunas,
+            '_indices': {coluna: indice for indice, coluna in enumerate(colunas)}
+        }
+        for indice, coluna in enumerate(colunas):
+            if not coluna.isidentifier() or hasattr(Linha, coluna):
+                continue
+            if coluna in COLUNAS_TIMESTAMP:
+                atributos[coluna] = _timestamp(indice)
+            else:
+                atributos[coluna] = property(itemgetter(indice))
+        classe = _classes[colunas] = type('Linha', (Linha,), atributos)
+    return classe
+
+
+def _cursor(db, sql, parametros):
+    cursor = db.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, parametros)
+    return cursor
+
+
+def todas(db, sql, parametros=()):
+    cursor = _cursor(db, sql, parametros)
+    classe = classe_linha(d[0] for d in cursor.description)
+    return list(map(classe, cursor.fetchall()))
+
+
+def uma(db, sql, parametros=()):
+    cursor = _cursor(db, sql, parametros)
+    linha = cursor.fetchone()
+    if linha is None:
+        return None
+    return classe_linha(d[0] for d in cursor.description)(linha)
+
+
+def turma(db, turma_id):
+    """Turma com o nome e descrição do curso e o ano lectivo."""
+    return uma(db, '''
+        SELECT t.*, c.nome as curso_nome, c.descricao as curso_descricao, a.ano as ano_lectivo
+        FROM Turmas t
+        JOIN Cursos c ON t.curso_id = c.id
+        JOIN AnoLectivo a ON t.ano_lectivo_id = a.id
+        WHERE t.id = ?
+    ''', (turma_id,))
+
+
+_DOCENCIAS = '''
+    SELECT
+        td.id as turma_disciplina_id,
+        t.id as turma_id,
+        t.designacao,
+        t.ano,
+        c.nome as curso_nome,
+        d.nome as disciplina_nome,
+        a.ano as ano_lectivo
+    FROM Docencia doc
+    JOIN TurmaDisciplinas td ON td.id = doc.turma_disciplina_id
+    JOIN Turmas t ON t.id = td.turma_id
+    JOIN Cursos c ON c.id = t.curso_id
+    JOIN Disciplinas d ON d.id = td.disciplina_id
+    JOIN AnoLectivo a ON a.id = t.ano_lectivo_id
+    WHERE doc.professor_id = ? AND doc.data_fim IS NULL
+'''
+
+
+def docencias_professor(db, professor_id):
+    """Disciplinas que o professor lecciona actualmente, do ano mais recente para trás."""
+    return todas(
+        db, _DOCENCIAS + ' ORDER BY a.ano DESC, c.nome, t.ano, t.designacao, d.nome', (professor_id,)
+    )
+
+
+def docencia_professor(db, professor_id, turma_disciplina_id):
+    """Contexto completo de uma disciplina do professor, ou ``None`` sem acesso."""
+    return uma(db, _DOCENCIAS + ' AND td.id = ?', (professor_id, turma_disciplina_id))
+
+
+def turma_da_docencia(db, professor_id, turma_disciplina_id):
+    """Turma de uma disciplina leccionada pelo professor (``None`` sem acesso)."""
+    linha = _cursor(db, '''
+        SELECT td.turma_id
+        FROM Docencia doc
+        JOIN TurmaDisciplinas td ON td.id = doc.turma_disciplina_id
+        WHERE doc.professor_id = ? AND doc.data_fim IS NULL AND td.id = ?
+    ''', (professor_id, turma_disciplina_id)).fetchone()
+    return linha[0] if linha is not None else None
+
+
+def matriculas_activas(db, turma_id):
+    """Alunos com matrícula activa na turma, por nome."""
+    return todas(db, '''
+        SELECT m.id as matricula_id, a.id, a.nome, a.email, m.status
+        FROM Matriculas m
+        JOIN Alunos a ON a.id = m.aluno_id
+        WHERE m.turma_id = ? AND m.status = 'ativa'
+        ORDER BY a.nome
+    ''', (turma_id,))
+
+
+def disciplinas_turma(db, turma_id):
+    return todas(db, '''
+        SELECT d.nome, d.descricao
+        FROM Disciplinas d
+        JOIN TurmaDisciplinas td ON d.id = td.disciplina_id
+        WHERE td.turma_id = ?
+        ORDER BY d.nome
+    ''', (turma_id,))
+
+
+def docentes_turma(db, turma_id):
+    """Disciplinas da turma com o professor actual (ou ``None``)."""
+    return todas(db, '''
+        SELECT
+            td.id as turma_disciplina_id,
+            d.nome as disciplina_nome,
+            p.id as professor_id,
+            p.nome as professor_nome
+        FROM TurmaDisciplinas td
+        JOIN Disciplinas d ON d.id = td.disciplina_id
+        LEFT JOIN Docencia doc
+            ON doc.turma_disciplina_id = td.id
+            AND doc.data_fim IS NULL
+        LEFT JOIN Professores p
+            ON p.id = doc.professor_id
+        WHERE td.turma_id = ?
+        ORDER BY d.nome
+    ''', (turma_id,))
+
+
+def notas_disciplina(db, turma_disciplina_id, trimestre):
+    """Notas de uma disciplina num trimestre, por matrícula."""
+    return dict(_cursor(db, '''
+        SELECT matricula_id, nota
+        FROM NotasTrimestrais
+        WHERE turma_disciplina_id = ? AND trimestre = ?
+    ''', (turma_disciplina_id, trimestre)).fetchall())
+
+
+def boletins_turma(db, turma_id):
+    """Boletim de cada matrícula activa da turma, por nome (sem notas: colunas a NULL)."""
+    return todas(db, '''
+        SELECT m.id as matricula_id, a.nome, b.media_t1, b.media_t2, b.media_t3, b.media_final,
+               b.negativas, b.resultado
+        FROM Matriculas m
+        JOIN Alunos a ON a.id = m.aluno_id
+        LEFT JOIN Boletins b ON b.matricula_id = m.id
+        WHERE m.turma_id = ? AND m.status = 'ativa'
+        ORDER BY a.nome
+    ''', (turma_id,))
+
+
+def boletins_aluno(db, aluno_id):
+    """Boletins de todas as matrículas do aluno, do ano lectivo mais recente para trás."""
+    return todas(db, '''
+        SELECT m.id as matricula_id, m.status, t.designacao, t.ano, c.nome as curso_nome,
+               al.ano as ano_lectivo, b.media_t1, b.media_t2, b.media_t3, b.media_final,
+               b.negativas, b.resultado
+        FROM Matriculas m
+        JOIN Turmas t ON t.id = m.turma_id
+        JOIN Cursos c ON c.id = t.curso_id
+        JOIN AnoLectivo al ON al.id = t.ano_lectivo_id
+        LEFT JOIN Boletins b ON b.matricula_id = m.id
+        WHERE m.aluno_id = ?
+        ORDER BY al.ano DESC, m.id DESC
+    ''', (aluno_id,))
+
+
+def boletim_disciplinas(db, matricula_id):
+    """Notas, classificações e faltas por disciplina de uma matrícula, por nome da disciplina."""
+    return todas(db, '''
+        SELECT d.nome as disciplina_nome, bd.nota_t1, bd.nota_t2, bd.nota_t3, bd.media,
+               bd.classificacao_final,
+               COALESCE(fd.faltas, 0) as faltas,
+               COALESCE(fd.justificadas, 0) as justificadas,
+               COALESCE(fd.atrasos, 0) as atrasos
+        FROM Matriculas m
+        JOIN TurmaDisciplinas td ON td.turma_id = m.turma_id
+        JOIN Disciplinas d ON d.id = td.disciplina_id
+        LEFT JOIN BoletimDisciplinas bd
+            ON bd.matricula_id = m.id AND bd.turma_disciplina_id = td.id
+        LEFT JOIN FaltasDisciplinas fd
+            ON fd.matricula_id = m.id AND fd.turma_disciplina_id = td.id
+        WHERE m.id = ?
+        ORDER BY d.nome
+    ''', (matricula_id,))
+
+
+def faltas_disciplina(db, turma_disciplina_id):
+    """Faltas de cada trimestre e do ano numa disciplina, por matrícula (só quem tem ausências)."""
+    return {linha['matricula_id']: linha for linha in todas(db, '''
+        SELECT fd.matricula_id, fd.faltas, fd.justificadas, fd.atrasos,
+               COALESCE(ft1.faltas, 0) as faltas_t1,
+               COALESCE(ft2.faltas, 0) as faltas_t2,
+               COALESCE(ft3.faltas, 0) as faltas_t3
+        FROM FaltasDisciplinas fd
+        LEFT JOIN FaltasTrimestrais ft1
+            ON ft1.matricula_id = fd.matricula_id AND ft1.turma_disciplina_id = fd.turma_disciplina_id
+            AND ft1.trimestre = 1
+        LEFT JOIN FaltasTrimestrais ft2
+            ON ft2.matricula_id = fd.matricula_id AND ft2.turma_disciplina_id = fd.turma_disciplina_id
+            AND ft2.trimestre = 2
+        LEFT JOIN FaltasTrimestrais ft3
+            ON ft3.matricula_id = fd.matricula_id AND ft3.turma_disciplina_id = fd.turma_disciplina_id
+            AND ft3.trimestre = 3
+        WHERE fd.turma_disciplina_id = ?
+    ''', (turma_disciplina_id,))}
+
+
+def faltas_acima_limite(db, turma_id, limite):
+    """Alunos activos da turma com mais de ``limite`` faltas numa disciplina, por nome."""
+    return todas(db, '''
+        SELECT m.id as matricula_id, a.nome, d.nome as disciplina_nome,
+               fd.faltas, fd.justificadas, fd.atrasos
+        FROM TurmaDisciplinas td
+        JOIN FaltasDisciplinas fd ON fd.turma_disciplina_id = td.id AND fd.faltas > ?
+        JOIN Matriculas m ON m.id = fd.matricula_id
+        JOIN Alunos a ON a.id = m.aluno_id
+        JOIN Disciplinas d ON d.id = td.disciplina_id
+        WHERE td.turma_id = ? AND m.status = 'ativa'
+        ORDER BY a.nome, d.nome
+    ''', (limite, turma_id))
@@ -1,13 +1,25 @@
 -- ============================================================
 -- schema.sql (SQLite) - Plataforma de gestão escolar
 -- ============================================================
+-- Bases em uso não são recriadas: cada alteração a este ficheiro tem
+-- também de ser acrescentada como migração em app/migracoes/
+-- (flask db-migrate). O init-db regista todas as migrações como aplicadas.
 -- Nota: Em SQLite, as Foreign Keys só funcionam se estiver activo:
 PRAGMA foreign_keys = ON;
 
 -- ============================================================
 -- DROP (ordem inversa das dependências)
 -- ============================================================
+DROP TABLE IF EXISTS schema_version;
+DROP TABLE IF EXISTS ImportacaoRejeicoes;
+DROP TABLE IF EXISTS Importacoes;
+DROP TABLE IF EXISTS Contadores;
+DROP TABLE IF EXISTS Boletins;
+DROP TABLE IF EXISTS BoletimDisciplinas;
+DROP TABLE IF EXISTS NotasTrimestraisRemovidas;
 DROP TABLE IF EXISTS Anuncios;
+DROP TABLE IF EXISTS FaltasDisciplinas;
+DROP TABLE IF EXISTS FaltasTrimestrais;
 DROP TABLE IF EXISTS Presencas;
 DROP TABLE IF EXISTS Aulas;
 DROP TABLE IF EXISTS Notas;
@@ -165,6 +177,7 @@ CREATE TABLE Docencia (
 CREATE TABLE Avaliacoes (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+  trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)), -- entra na nota deste trimestre
   tipo TEXT NOT NULL CHECK(tipo IN ('teste','trabalho','prova','exame','oral','participacao')),
   titulo TEXT,                 -- ex: "Teste 1"
   data DATE NOT NULL,
@@ -190,9 +203,50 @@ CREATE TABLE NotasTrimestrais (
   trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)),
   nota REAL NOT NULL CHECK(nota >= 0 AND nota <= 20),
   criado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  versao INTEGER NOT NULL DEFAULT 0, -- valor do contador 'notas' na última alteração
+  -- 'avaliacoes' = calculada por app/avaliacoes.py; só essas são recalculadas ou apagadas
+  origem TEXT NOT NULL DEFAULT 'manual' CHECK(origem IN ('manual','avaliacoes')),
   UNIQUE (matricula_id, turma_disciplina_id, trimestre)
 );
 
+-- Notas apagadas, para a sincronização incremental saber o que removeu
+CREATE TABLE NotasTrimestraisRemovidas (
+  turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+  trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)),
+  matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+  versao INTEGER NOT NULL,
+  PRIMARY KEY (turma_disciplina_id, trimestre, matricula_id)
+) WITHOUT ROWID;
+
+-- ============================================================
+-- Boletins (calculados a partir de NotasTrimestrais; flask rebuild-boletins)
+-- ============================================================
+
+-- Por disciplina: notas dos trimestres, média dos trimestres lançados e
+-- classificação anual (só com os três trimestres)
+CREATE TABLE BoletimDisciplinas (
+  matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+  turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+  nota_t1 REAL,
+  nota_t2 REAL,
+  nota_t3 REAL,
+  media REAL,
+  classificacao_final REAL,
+  PRIMARY KEY (matricula_id, turma_disciplina_id)
+) WITHOUT ROWID;
+
+-- Por matrícula: médias de cada trimestre, média final e resultado
+CREATE TABLE Boletins (
+  matricula_id INTEGER PRIMARY KEY REFERENCES Matriculas(id) ON DELETE CASCADE,
+  media_t1 REAL,
+  media_t2 REAL,
+  media_t3 REAL,
+  media_final REAL,
+  disciplinas INTEGER NOT NULL,
+  negativas INTEGER NOT NULL,
+  resultado TEXT NOT NULL CHECK(resultado IN ('em_curso','aprovado','reprovado'))
+);
+
 -- ============================================================
 -- Aulas e Presenças (faltas)
 -- ============================================================
@@ -201,6 +255,7 @@ CREATE TABLE Aulas (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
   data DATE NOT NULL,
+  trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)), -- as faltas contam para este trimestre
   conteudo TEXT,
   UNIQUE (turma_disciplina_id, data)
 );
@@ -214,6 +269,64 @@ CREATE TABLE Presencas (
   UNIQUE (aula_id, matricula_id)
 );
 
+-- Contagem das ausências (mantida ao registar a chamada; flask rebuild-faltas).
+-- Só há linha para os pares com alguma falta, justificada ou atraso.
+CREATE TABLE FaltasTrimestrais (
+  matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+  turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+  trimestre INTEGER NOT NULL CHECK(trimestre IN (1,2,3)),
+  faltas INTEGER NOT NULL,
+  justificadas INTEGER NOT NULL,
+  atrasos INTEGER NOT NULL,
+  PRIMARY KEY (matricula_id, turma_disciplina_id, trimestre)
+) WITHOUT ROWID;
+
+-- Totais do ano lectivo por disciplina
+CREATE TABLE FaltasDisciplinas (
+  matricula_id INTEGER NOT NULL REFERENCES Matriculas(id) ON DELETE CASCADE,
+  turma_disciplina_id INTEGER NOT NULL REFERENCES TurmaDisciplinas(id) ON DELETE CASCADE,
+  faltas INTEGER NOT NULL,
+  justificadas INTEGER NOT NULL,
+  atrasos INTEGER NOT NULL,
+  PRIMARY KEY (matricula_id, turma_disciplina_id)
+) WITHOUT ROWID;
+
+-- ============================================================
+-- Contadores monotónicos (versões de dados)
+-- ============================================================
+
+CREATE TABLE Contadores (
+  nome TEXT PRIMARY KEY,
+  valor INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- ============================================================
+-- Importação de alunos em massa (flask import-students)
+-- ============================================================
+
+-- Uma linha por ficheiro (pelo sha256); ``linhas`` é o ponto de retoma
+CREATE TABLE Importacoes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  checksum TEXT NOT NULL UNIQUE,
+  ficheiro TEXT NOT NULL,
+  status_usuarios TEXT NOT NULL DEFAULT 'pendente' CHECK(status_usuarios IN ('ativo','pendente')),
+  estado TEXT NOT NULL DEFAULT 'em_curso' CHECK(estado IN ('em_curso','concluida')),
+  linhas INTEGER NOT NULL DEFAULT 0,
+  inseridos INTEGER NOT NULL DEFAULT 0,
+  rejeitados INTEGER NOT NULL DEFAULT 0,
+  admin_id INTEGER REFERENCES Usuarios(id) ON DELETE SET NULL,
+  criado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  concluida_em TIMESTAMP
+);
+
+CREATE TABLE ImportacaoRejeicoes (
+  importacao_id INTEGER NOT NULL REFERENCES Importacoes(id) ON DELETE CASCADE,
+  linha INTEGER NOT NULL,
+  motivo TEXT NOT NULL,
+  dados TEXT NOT NULL, -- JSON com os campos da linha original
+  PRIMARY KEY (importacao_id, linha)
+) WITHOUT ROWID;
+
 -- ============================================================
 -- Encarregados de educação
 -- ============================================================
@@ -237,11 +350,18 @@ CREATE TABLE AlunoEncarregado (
 -- Índices (performance)
 -- ============================================================
 
+CREATE INDEX idx_alunos_nome ON Alunos(nome);
+-- Duplicados de email sem distinguir maiúsculas (importação de alunos)
+CREATE INDEX idx_alunos_email_lower ON Alunos(lower(email));
+CREATE INDEX idx_anuncios_data_publicacao ON Anuncios(data_publicacao);
+CREATE INDEX idx_disciplinas_nome ON Disciplinas(nome);
+
 CREATE INDEX idx_turmas_curso_id ON Turmas(curso_id);
 CREATE INDEX idx_turmas_ano_lectivo_id ON Turmas(ano_lectivo_id);
 
 CREATE INDEX idx_matriculas_aluno_id ON Matriculas(aluno_id);
-CREATE INDEX idx_matriculas_turma_id ON Matriculas(turma_id);
+-- Cobre "turma_id = ? AND status = 'ativa'" sem ler a tabela
+CREATE INDEX idx_matriculas_turma_status ON Matriculas(turma_id, status, aluno_id);
 
 CREATE INDEX idx_disciplinas_curso_id ON Disciplinas(curso_id);
 CREATE INDEX idx_disciplinas_curso_ano ON Disciplinas(curso_id, ano);
@@ -249,23 +369,35 @@ CREATE INDEX idx_disciplinas_curso_ano ON Disciplinas(curso_id, ano);
 CREATE INDEX idx_turma_disciplinas_turma_id ON TurmaDisciplinas(turma_id);
 CREATE INDEX idx_turma_disciplinas_disciplina_id ON TurmaDisciplinas(disciplina_id);
 
-CREATE INDEX idx_docencia_professor_id ON Docencia(professor_id);
-CREATE INDEX idx_docencia_turma_disciplina_id ON Docencia(turma_disciplina_id);
+-- Docência actual (data_fim IS NULL) por professor e por disciplina; a
+-- chave única (turma_disciplina_id, professor_id, data_inicio) serve a FK
+CREATE INDEX idx_docencia_professor ON Docencia(professor_id, data_fim, turma_disciplina_id);
+CREATE INDEX idx_docencia_activa_turma_disciplina ON Docencia(turma_disciplina_id, professor_id)
+  WHERE data_fim IS NULL;
 
-CREATE INDEX idx_avaliacoes_turma_disciplina_id ON Avaliacoes(turma_disciplina_id);
+CREATE INDEX idx_avaliacoes_td_trimestre ON Avaliacoes(turma_disciplina_id, trimestre);
 CREATE INDEX idx_notas_avaliacao_id ON Notas(avaliacao_id);
 CREATE INDEX idx_notas_matricula_id ON Notas(matricula_id);
 
 CREATE INDEX idx_notas_tri_matricula ON NotasTrimestrais(matricula_id);
-CREATE INDEX idx_notas_tri_turma_disciplina ON NotasTrimestrais(turma_disciplina_id);
+-- Cobre a grelha (turma_disciplina_id, trimestre) e a sincronização (versao > ?)
+CREATE INDEX idx_notas_tri_td_trimestre
+  ON NotasTrimestrais(turma_disciplina_id, trimestre, versao, matricula_id, nota);
+CREATE INDEX idx_notas_tri_removidas_matricula ON NotasTrimestraisRemovidas(matricula_id);
+CREATE INDEX idx_boletim_disciplinas_td ON BoletimDisciplinas(turma_disciplina_id);
 
 CREATE INDEX idx_aulas_turma_disciplina_id ON Aulas(turma_disciplina_id);
 CREATE INDEX idx_presencas_aula_id ON Presencas(aula_id);
 CREATE INDEX idx_presencas_matricula_id ON Presencas(matricula_id);
+-- Alunos acima do limite de faltas de cada disciplina
+CREATE INDEX idx_faltas_disciplinas_td_faltas ON FaltasDisciplinas(turma_disciplina_id, faltas);
 
 CREATE INDEX idx_usuarios_papel ON Usuarios(papel);
 CREATE INDEX idx_usuarios_professor_id ON Usuarios(professor_id);
 CREATE INDEX idx_usuarios_aluno_id ON Usuarios(aluno_id);
+CREATE INDEX idx_usuarios_email_lower ON Usuarios(lower(email));
+-- Só as pré-inscrições por aprovar
+CREATE INDEX idx_usuarios_pendentes ON Usuarios(papel, aluno_id) WHERE status = 'pendente';
 
 -- ============================================================
 -- Seed (opcional): AnoLectivo e admin
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+_prefixos = {}
+
+_metricas_lock = threading.Lock()
+_metricas = {}
+_em_curso = 0
+_inicio = time.monotonic()
+
+
+def _executor():
+    """Pool de processos deste worker (``None`` se PASSWORD_HASH_WORKERS = 0)."""
+    global _pool, _pool_pid
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    if not workers:
+        return None
+    # Um pool criado antes de um fork não pode ser usado pelo filho
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(max_workers=workers)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _executar(operacao, funcao, *args):
+    global _em_curso
+    inicio = time.perf_counter()
+    with _metricas_lock:
+        _em_curso += 1
+    try:
+        executor = _executor()
+        if executor is None:
+            return funcao(*args)
+        return executor.submit(funcao, *args).result()
+    finally:
+        duracao = time.perf_counter() - inicio
+        with _metricas_lock:
+            _em_curso -= 1
+            m = _metricas.setdefault(operacao, {'total': 0, 'segundos': 0.0, 'max_segundos': 0.0})
+            m['total'] += 1
+            m['segundos'] += duracao
+            m['max_segundos'] = max(m['max_segundos'], duracao)
+
+
+def _metodo():
+    return current_app.config['PASSWORD_HASH_METHOD']
+
+
+def gerar_hash(password):
+    return _executar('gerar', generate_password_hash, password, _metodo())
+
+
+def gerar_hashes(passwords):
+    """Gerar vários hashes em paralelo, pela ordem recebida."""
+    passwords = list(passwords)
+    executor = _executor()
+    if executor is None or len(passwords) < 2:
+        return [gerar_hash(p) for p in passwords]
+    metodo = _metodo()
+    inicio = time.perf_counter()
+    hashes = list(executor.map(
+        generate_password_hash, passwords, [metodo] * len(passwords),
+        chunksize=max(1, len(passwords) // (4 * current_app.config['PASSWORD_HASH_WORKERS']))
+    ))
+    duracao = time.perf_counter() - inicio
+    with _metricas_lock:
+        m = _metricas.setdefault('gerar', {'total': 0, 'segundos': 0.0, 'max_segundos': 0.0})
+        m['total'] += len(passwords)
+        m['segundos'] += duracao
+    return hashes
+
+
+def verificar(pwhash, password):
+    return _executar('verificar', check_password_hash, pwhash, password)
+
+
+def precisa_rehash(pwhash):
+    """Indica se o hash foi gerado com parâmetros diferentes dos configurados."""
+    metodo = _metodo()
+    prefixo = _prefixos.get(metodo)
+    if prefixo is None:
+        # O werkzeug expande os parâmetros omitidos (ex.: "scrypt" ->
+        # "scrypt:32768:8:1"); um hash de referência dá a forma canónica
+        prefixo = generate_password_hash('', metodo).split('$', 1)[0]
+        _prefixos[metodo] = prefixo
+    return pwhash.split('$', 1)[0] != prefixo
+
+
+def metricas():
+    with _metricas_lock:
+        operacoes = {}
+        for nome, m in _metricas.items():
+            operacoes[nome] = dict(
+                m, media_segundos=m['segundos'] / m['total'] if m['total'] else 0.0
+            )
+        return {
+            'pid': os.getpid(),
+            'segundos_desde_inicio': time.monotonic() - _inicio,
+            'workers': current_app.config['PASSWORD_HASH_WORKERS'],
+            'metodo': _metodo(),
+            'em_curso': _em_curso,
+            'operacoes': operacoes
+        }
@@ -0,0 +1,297 @@
+import random
+import time
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+
+from app import boletim, presencas, referencia
+from app.db import get_db, incrementar_contador
+from app.senhas import gerar_hash
+
+NOMES = (
+    'Ana', 'António', 'Beatriz', 'Carlos', 'Domingos', 'Esperança', 'Fernando', 'Graça',
+    'Helena', 'Isabel', 'João', 'Joaquim', 'Luísa', 'Manuel', 'Maria', 'Mateus', 'Nzinga',
+    'Paulo', 'Pedro', 'Rosa', 'Sebastião', 'Teresa', 'Tomás', 'Victória', 'Zeferino'
+)
+APELIDOS = (
+    'Almeida', 'Baptista', 'Cardoso', 'Dias', 'Domingos', 'Fernandes', 'Gaspar', 'João',
+    'Kiala', 'Lopes', 'Mateus', 'Miguel', 'Neto', 'Paulo', 'Quissanga', 'Santos', 'Silva',
+    'Tavares', 'Vieira', 'Zua'
+)
+CURSOS = (
+    ('CFB', 'Ciências Físicas e Biológicas'),
+    ('CEJ', 'Ciências Económicas e Jurídicas'),
+    ('CHu', 'Ciências Humanas'),
+    ('AVi', 'Artes Visuais'),
+)
+DISCIPLINAS = (
+    'Língua Portuguesa', 'Matemática', 'Física', 'Química', 'Biologia', 'História',
+    'Geografia', 'Inglês', 'Francês', 'Filosofia', 'Educação Física', 'Empreendedorismo',
+    'Informática', 'Desenho', 'Economia', 'Direito'
+)
+ESTADOS = ('presente', 'falta', 'justificada', 'atraso')
+PESOS_ESTADOS = (90, 6, 2, 2)
+TIPOS_AVALIACAO = ('teste', 'trabalho', 'prova', 'oral')
+# Trimestre em curso no último ano lectivo: ainda sem avaliações, as notas
+# são lançadas à mão (é o trimestre dos cenários de gravação do bench e
+# do load-test)
+TRIMESTRE_ABERTO = 3
+
+# Ordem de escrita: uma tabela só é gravada depois das que ela referencia
+TABELAS = (
+    ('AnoLectivo', ('id', 'ano')),
+    ('Cursos', ('id', 'nome', 'descricao', 'carga_horaria')),
+    ('Disciplinas', ('id', 'curso_id', 'ano', 'nome', 'descricao')),
+    ('Professores', ('id', 'nome', 'email', 'numero_bilhete', 'genero', 'departamento')),
+    ('Alunos', ('id', 'nome', 'data_nascimento', 'email', 'numero_bilhete', 'genero',
+                'curso_preferido_id', 'ano_preferido')),
+    ('Usuarios', ('id', 'username', 'password', 'email', 'papel', 'status', 'professor_id', 'aluno_id')),
+    ('Anuncios', ('id', 'titulo', 'conteudo', 'data_publicacao', 'admin_id')),
+    ('Turmas', ('id', 'curso_id', 'ano_lectivo_id', 'ano', 'sala_aula', 'designacao')),
+    ('TurmaDisciplinas', ('id', 'turma_id', 'disciplina_id')),
+    ('Docencia', ('id', 'turma_disciplina_id', 'professor_id', 'data_inicio')),
+    ('Matriculas', ('id', 'aluno_id', 'turma_id', 'status')),
+    ('NotasTrimestrais', ('matricula_id', 'turma_disciplina_id', 'trimestre', 'nota', 'origem')),
+    ('Avaliacoes', ('id', 'turma_disciplina_id', 'trimestre', 'tipo', 'titulo', 'data', 'peso', 'nota_max')),
+    ('Notas', ('avaliacao_id', 'matricula_id', 'nota')),
+    ('Aulas', ('id', 'turma_disciplina_id', 'data', 'trimestre')),
+    ('Presencas', ('aula_id', 'matricula_id', 'estado')),
+)
+
+
+class _Escritor:
+    """Acumula linhas por tabela e grava-as com executemany em lotes."""
+
+    def __init__(self, db, lote):
+        self.db = db
+        self.lote = lote
+        self.buffers = {nome: [] for nome, _ in TABELAS}
+        self.sql = {
+            nome: 'INSERT INTO {} ({}) VALUES ({})'.format(
+                nome, ', '.join(colunas), ', '.join('?' * len(colunas)))
+            for nome, colunas in TABELAS
+        }
+        self.totais = dict.fromkeys(self.buffers, 0)
+        self.pendentes = 0
+        self.ids = {}
+        for nome, colunas in TABELAS:
+            if colunas[0] == 'id':
+                self.ids[nome] = db.execute(f'SELECT COALESCE(MAX(id), 0) FROM {nome}').fetchone()[0]
+
+    def novo_id(self, tabela):
+        self.ids[tabela] += 1
+        return self.ids[tabela]
+
+    def add(self, tabela, linha):
+        self.buffers[tabela].append(linha)
+        self.pendentes += 1
+        if self.pendentes >= self.lote:
+            self.flush()
+
+    def flush(self):
+        for nome, _ in TABELAS:
+            linhas = self.buffers[nome]
+            if linhas:
+                self.db.executemany(self.sql[nome], linhas)
+                self.totais[nome] += len(linhas)
+                linhas.clear()
+        self.db.commit()
+        self.pendentes = 0
+
+
+def _nome(rng):
+    return f'{rng.choice(NOMES)} {rng.choice(APELIDOS)} {rng.choice(APELIDOS)}'
+
+
+def gerar(escolas, anos, ano_inicial, cursos, disciplinas_por_classe, turmas_por_classe,
+          alunos_por_turma, professores, avaliacoes, aulas, pendentes, anuncios, seed, lote,
+          password='eskola'):
+    """Gerar uma rede escolar sintética determinística para a semente dada.
+
+    O esquema não tem uma tabela de escolas: cada escola tem os seus
+    próprios cursos (ex.: "CFB E03"), disciplinas, turmas e professores.
+    Os alunos avançam uma classe por ano lectivo; as matrículas dos anos
+    anteriores ficam 'concluida' e as do último ano 'ativa'. As notas
+    trimestrais são as médias ponderadas das avaliações, excepto no
+    ``TRIMESTRE_ABERTO`` do último ano, que não tem avaliações.
+    """
+    rng = random.Random(seed)
+    db = get_db()
+    # Todos os utilizadores sintéticos partilham um único hash
+    pwhash = gerar_hash(password)
+
+    # Integridade garantida pela ordem de escrita; sem verificação de FKs
+    # e sem fsync por commit a carga é muito mais rápida
+    db.commit()
+    db.execute('PRAGMA foreign_keys = OFF')
+    db.execute('PRAGMA synchronous = OFF')
+    try:
+        escritor = _Escritor(db, lote)
+        w = escritor.add
+
+        anos_lectivos = []
+        existentes = dict(db.execute('SELECT ano, id FROM AnoLectivo').fetchall())
+        for ano in range(ano_inicial, ano_inicial + anos):
+            if ano not in existentes:
+                existentes[ano] = escritor.novo_id('AnoLectivo')
+                w('AnoLectivo', (existentes[ano], ano))
+            anos_lectivos.append((ano, existentes[ano]))
+
+        admin_id = escritor.novo_id('Usuarios')
+        w('Usuarios', (admin_id, f'admin{admin_id}', pwhash, f'admin{admin_id}@sintetico.eskola',
+                       'admin', 'ativo', None, None))
+        for _ in range(anuncios):
+            anuncio_id = escritor.novo_id('Anuncios')
+            publicado = date(ano_inicial, 1, 1) + timedelta(days=rng.randrange(365 * anos))
+            w('Anuncios', (anuncio_id, f'Comunicado {anuncio_id}', 'Conteúdo do comunicado.',
+                           f'{publicado} {rng.randrange(24):02d}:{rng.randrange(60):02d}:00', admin_id))
+
+        def novo_aluno(curso_id, classe, status='ativo'):
+            aluno_id = escritor.novo_id('Alunos')
+            nascimento = date(ano_inicial - 6 - classe, 1, 1) + timedelta(days=rng.randrange(365))
+            w('Alunos', (aluno_id, _nome(rng), nascimento.isoformat(), f'aluno{aluno_id}@sintetico.eskola',
+                         f'SA{aluno_id:010d}', rng.choice(('M', 'F')), curso_id, classe))
+            user_id = escritor.novo_id('Usuarios')
+            w('Usuarios', (user_id, f'aluno{aluno_id}', pwhash, f'aluno{aluno_id}@sintetico.eskola',
+                           'aluno', status, None, aluno_id))
+            return aluno_id
+
+        for escola in range(1, escolas + 1):
+            professores_escola = []
+            for _ in range(professores):
+                professor_id = escritor.novo_id('Professores')
+                w('Professores', (professor_id, _nome(rng), f'prof{professor_id}@sintetico.eskola',
+                                  f'SP{professor_id:010d}', rng.choice(('M', 'F')), f'Escola {escola}'))
+                user_id = escritor.novo_id('Usuarios')
+                w('Usuarios', (user_id, f'prof{professor_id}', pwhash, f'prof{professor_id}@sintetico.eskola',
+                               'professor', 'ativo', professor_id, None))
+                professores_escola.append(professor_id)
+
+            for sigla, descricao in (CURSOS * (cursos // len(CURSOS) + 1))[:cursos]:
+                curso_id = escritor.novo_id('Cursos')
+                w('Cursos', (curso_id, f'{sigla} E{escola:02d} #{curso_id}', descricao, 900))
+
+                disciplinas = {}
+                for classe in (10, 11, 12):
+                    nomes = rng.sample(DISCIPLINAS, min(disciplinas_por_classe, len(DISCIPLINAS)))
+                    disciplinas[classe] = []
+                    for nome in nomes:
+                        disciplina_id = escritor.novo_id('Disciplinas')
+                        w('Disciplinas', (disciplina_id, curso_id, classe, nome, None))
+                        disciplinas[classe].append(disciplina_id)
+
+                # Coortes: (turma k, ano de entrada na 10ª) -> alunos
+                coortes = {}
+                for indice_ano, (ano, ano_lectivo_id) in enumerate(anos_lectivos):
+                    ultimo = indice_ano == len(anos_lectivos) - 1
+                    for classe in (10, 11, 12):
+                        entrada = indice_ano - (classe - 10)
+                        for k in range(turmas_por_classe):
+                            turma_id = escritor.novo_id('Turmas')
+                            w('Turmas', (turma_id, curso_id, ano_lectivo_id, classe,
+                                         f'Sala {rng.randrange(1, 40)}', f'{classe}{chr(65 + k)}'))
+
+                            alunos = coortes.get((k, entrada))
+                            if alunos is None:
+                                alunos = [novo_aluno(curso_id, classe) for _ in range(alunos_por_turma)]
+                                coortes[(k, entrada)] = alunos
+
+                            matriculas = []
+                            for aluno_id in alunos:
+                                matricula_id = escritor.novo_id('Matriculas')
+                                w('Matriculas', (matricula_id, aluno_id, turma_id,
+                                                 'ativa' if ultimo else 'concluida'))
+                                matriculas.append(matricula_id)
+
+                            for disciplina_id in disciplinas[classe]:
+                                td_id = escritor.novo_id('TurmaDisciplinas')
+                                w('TurmaDisciplinas', (td_id, turma_id, disciplina_id))
+                                w('Docencia', (escritor.novo_id('Docencia'), td_id,
+                                               rng.choice(professores_escola), f'{ano}-02-01'))
+
+                                for trimestre in (1, 2, 3):
+                                    inicio = date(ano, 2, 1) + timedelta(days=91 * (trimestre - 1))
+                                    # Com avaliações a nota trimestral é a média ponderada
+                                    # delas, como em app/avaliacoes.py
+                                    somas = dict.fromkeys(matriculas, 0.0)
+                                    pesos = 0.0
+                                    aberto = ultimo and trimestre == TRIMESTRE_ABERTO
+                                    for a in range(0 if aberto else avaliacoes):
+                                        avaliacao_id = escritor.novo_id('Avaliacoes')
+                                        tipo = rng.choice(TIPOS_AVALIACAO)
+                                        peso = rng.choice((1.0, 1.0, 2.0))
+                                        w('Avaliacoes', (avaliacao_id, td_id, trimestre, tipo, f'Avaliação {a + 1}',
+                                                         (inicio + timedelta(days=30 * a + 20)).isoformat(),
+                                                         peso, 20))
+                                        pesos += peso
+                                        for matricula_id in matriculas:
+                                            nota = round(rng.uniform(4, 20), 1)
+                                            somas[matricula_id] += peso * nota
+                                            w('Notas', (avaliacao_id, matricula_id, nota))
+                                    origem = 'avaliacoes' if pesos else 'manual'
+                                    for matricula_id in matriculas:
+                                        nota = somas[matricula_id] / pesos if pesos else rng.uniform(4, 20)
+                                        w('NotasTrimestrais', (matricula_id, td_id, trimestre, round(nota, 1), origem))
+                                    for a in range(aulas):
+                                        aula_id = escritor.novo_id('Aulas')
+                                        w('Aulas', (aula_id, td_id, (inicio + timedelta(days=7 * a)).isoformat(), trimestre))
+                                        estados = rng.choices(ESTADOS, PESOS_ESTADOS, k=len(matriculas))
+                                        for matricula_id, estado in zip(matriculas, estados):
+                                            w('Presencas', (aula_id, matricula_id, estado))
+
+                for _ in range(pendentes):
+                    novo_aluno(curso_id, 10, status='pendente')
+
+        # Dados novos em todas as tabelas: invalidar caches e ETags dos workers
+        incrementar_contador(db, referencia.CONTADOR)
+        incrementar_contador(db, 'turmas')
+        incrementar_contador(db, 'anuncios')
+        escritor.flush()
+        # Boletins e contagens de faltas de raiz, um ano lectivo por transacção
+        escritor.totais['Boletins'] = 0
+        escritor.totais['FaltasDisciplinas'] = 0
+        for (ano_lectivo_id,) in db.execute('SELECT id FROM AnoLectivo ORDER BY ano').fetchall():
+            escritor.totais['Boletins'] += boletim.recalcular(db, ano_lectivo_id=ano_lectivo_id)
+            escritor.totais['FaltasDisciplinas'] += presencas.recalcular(db, ano_lectivo_id=ano_lectivo_id)
+            db.commit()
+        return escritor.totais
+    finally:
+        db.execute('PRAGMA synchronous = {}'.format(current_app.config['DB_SYNCHRONOUS']))
+        db.execute('PRAGMA foreign_keys = ON')
+
+
+@click.command('seed-synthetic')
+@click.option('--escolas', default=1, show_default=True)
+@click.option('--anos', default=3, show_default=True, help='Anos lectivos consecutivos.')
+@click.option('--ano-inicial', default=2025, show_default=True)
+@click.option('--cursos', default=4, show_default=True, help='Cursos por escola.')
+@click.option('--disciplinas', default=8, show_default=True, help='Disciplinas por curso e classe.')
+@click.option('--turmas-por-classe', default=3, show_default=True)
+@click.option('--alunos-por-turma', default=40, show_default=True)
+@click.option('--professores', default=60, show_default=True, help='Professores por escola.')
+@click.option('--avaliacoes', default=2, show_default=True, help='Avaliações por disciplina e trimestre.')
+@click.option('--aulas', default=6, show_default=True, type=click.IntRange(0, 13),
+              help='Aulas semanais por disciplina e trimestre.')
+@click.option('--pendentes', default=10, show_default=True, help='Pré-inscrições pendentes por curso.')
+@click.option('--anuncios', default=200, show_default=True)
+@click.option('--seed', default=42, show_default=True)
+@click.option('--lote', default=50000, show_default=True, help='Linhas por executemany/commit.')
+def seed_synthetic_command(escolas, anos, ano_inicial, cursos, disciplinas, turmas_por_classe,
+                           alunos_por_turma, professores, avaliacoes, aulas, pendentes, anuncios,
+                           seed, lote):
+    """Gerar dados sintéticos em grande escala (determinísticos para a semente)."""
+    inicio = time.perf_counter()
+    totais = gerar(
+        escolas, anos, ano_inicial, cursos, disciplinas, turmas_por_classe, alunos_por_turma,
+        professores, avaliacoes, aulas, pendentes, anuncios, seed, lote
+    )
+    duracao = time.perf_counter() - inicio
+    for tabela, total in totais.items():
+        if total:
+            click.echo(f'{tabela:>18}: {total}')
+    click.echo(f'{sum(totais.values())} linhas em {duracao:.1f}s. Password dos utilizadores: eskola')
+
+
+def init_app(app):
+    app.cli.add_command(seed_synthetic_command)
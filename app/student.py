@@ -1,9 +1,18 @@
 from flask import Blueprint, render_template, g
 from app.auth import login_required
+from app.db import get_db
+from app import presencas, repositorio
 
 bp = Blueprint('student', __name__, url_prefix='/student')
 
 @bp.route('/area')
 @login_required
 def student_area():
-    return render_template('student_area.html')
\ No newline at end of file
+    boletins = []
+    if g.user['papel'] == 'aluno' and g.user['aluno_id'] is not None:
+        db = get_db()
+        boletins = [
+            (b, repositorio.boletim_disciplinas(db, b['matricula_id']))
+            for b in repositorio.boletins_aluno(db, g.user['aluno_id'])
+        ]
+    return render_template('student_area.html', boletins=boletins, limite_faltas=presencas.LIMITE_FALTAS)